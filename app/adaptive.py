@@ -0,0 +1,180 @@
+"""
+Per-client adaptation for /stream.mjpg.
+
+Each client sits on a rung of a quality/size ladder derived from its base
+profile and has its own frame-rate cap. Clients on the same rung share that
+rung's broadcaster, so there is still one encode per rung, not per client.
+
+The kernel send queue (SIOCOUTQ) tells how many bytes are still waiting for
+the client; with the acked-byte rate that gives the queueing delay. Frames are
+skipped rather than queued while that delay eats more than half the latency
+target, and the rung/fps are lowered while the estimated latency is over it.
+"""
+import itertools, struct, time
+from . import settings
+from .transform import out_size
+
+try:
+    import fcntl, termios
+except ImportError:  # not Linux: fall back to timing blocked writes
+    fcntl = termios = None
+
+# (scale of the base size, JPEG quality cap); rung 0 is the profile as configured
+LADDER = ((1.0, None), (1.0, 70), (0.75, 60), (0.5, 50), (0.33, 40))
+EWMA = 0.3
+HOLD_S = 3.0         # calm time before stepping back up; doubles on flapping
+HOLD_MAX_S = 30.0
+CHANGE_GAP_S = 0.5   # let a step-down show its effect before the next one
+RATE_WINDOW_S = 0.1  # shortest interval a drain rate is computed over
+
+CLIENTS = {}  # id -> StreamClient, for /api/stream/clients
+_ids = itertools.count(1)
+
+def rung_profile(base, i, native):
+    if i == 0: return base
+    scale, q = LADDER[i]
+    w, h = base.size or native
+    size = (max(2, int(w * scale)) & ~1, max(2, int(h * scale)) & ~1)
+    return base._replace(name=f"{base.name}@{i}", size=size, quality=min(base.quality, q))
+
+def _outq(sock):
+    # bytes sent but not yet acknowledged by the client
+    if sock is None or fcntl is None: return None
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0"))[0]
+    except (OSError, ValueError):
+        return None
+
+class StreamClient:
+    def __init__(self, profile, snap, sock=None, remote=None):
+        self.id = next(_ids)
+        self.profile, self.sock, self.remote = profile, sock, remote
+        self.target_s = snap["stream.target_latency_ms"] / 1000.0
+        self.max_fps = float(profile.fps or snap["camera.framerate"])
+        self.min_fps = max(0.1, min(self.max_fps, snap["stream.min_fps"]))
+        self.fps = self.max_fps
+        self.rung = 0
+        self.started = time.time()
+        self.frames = self.skipped = self.bytes = 0
+        self.outq = None
+        self.drain_bps = None
+        self.queue_s = 0.0
+        self.latency_s = 0.0
+        self._next_t = 0.0
+        self._sent_t = 0.0
+        self._meas_t = None
+        self._acked = 0
+        self._calm_t = None
+        self._hold = HOLD_S
+        self._down_t = self._up_t = 0.0
+
+    def _measure(self, now):
+        outq = _outq(self.sock)
+        if outq is None: return False
+        # slightly low (chunk framing isn't counted), which only matters over tiny windows
+        acked = self.bytes - outq
+        if self._meas_t is None:
+            self._meas_t, self._acked = now, acked
+        elif now - self._meas_t >= RATE_WINDOW_S:
+            if outq or acked > self._acked:  # an idle link says nothing about capacity
+                rate = max(0.0, (acked - self._acked) / (now - self._meas_t))
+                self.drain_bps = rate if self.drain_bps is None else self.drain_bps + EWMA * (rate - self.drain_bps)
+            self._meas_t, self._acked = now, acked
+        self.outq = outq
+        return True
+
+    def admit(self, now, frame_ts):
+        """False when this frame should be dropped: over the fps cap, already
+        older than the target, or the socket still holds more than half the
+        latency budget. A frame that is too old counts as an over-budget sample,
+        and one is let through anyway once ``min_fps`` would be missed, so a
+        pipeline slower than the target degrades the stream rather than freezing it."""
+        if now < self._next_t: return False
+        age = time.time() - frame_ts
+        if age > self.target_s and now - self._sent_t < 1.0 / self.min_fps:
+            self.latency_s = age
+            self._adapt(now)
+            return False
+        # the backlog still unsent when the next frame is ready is the queueing
+        # delay it would see; right after a write it would just be that frame
+        if self._measure(now):
+            self.queue_s = self.outq / self.drain_bps if self.drain_bps else (self.target_s if self.outq else 0.0)
+        return self.queue_s <= self.target_s * 0.5
+
+    def sent(self, nbytes, frame_ts, t0, t1):
+        self.frames += 1
+        self.bytes += nbytes
+        if not self._measure(t1):
+            # no queue visibility: a write only blocks once the send buffer is full
+            blocked = t1 - t0
+            self.queue_s = blocked
+            if blocked > 1e-3:
+                rate = nbytes / blocked
+                self.drain_bps = rate if self.drain_bps is None else self.drain_bps + EWMA * (rate - self.drain_bps)
+        self.latency_s = max(0.0, time.time() - frame_ts) + self.queue_s
+        self._next_t = t0 + 1.0 / self.fps
+        self._sent_t = t0
+        self._adapt(t1)
+
+    def _adapt(self, now):
+        if self.latency_s > self.target_s:
+            self._calm_t = None
+            if now - self._down_t < CHANGE_GAP_S: return
+            if now - self._up_t < 5.0:  # the last step up didn't hold
+                self._hold = min(HOLD_MAX_S, self._hold * 2)
+            # cheaper frames first, then fewer of them
+            if self.rung < len(LADDER) - 1:
+                self.rung += 1
+            else:
+                self.fps = max(self.min_fps, self.fps * 0.7)
+            self._down_t = now
+        elif self.latency_s < self.target_s * 0.5:
+            if self._calm_t is None:
+                self._calm_t = now
+            elif now - self._calm_t >= self._hold:
+                # recover the other way round: frame rate, then quality
+                if self.fps < self.max_fps:
+                    self.fps = min(self.max_fps, self.fps * 1.25)
+                elif self.rung > 0:
+                    self.rung -= 1
+                else:
+                    self._hold = HOLD_S
+                self._calm_t, self._up_t = now, now
+        else:
+            self._calm_t = None
+
+    def stats(self):
+        el = max(1e-6, time.time() - self.started)
+        return {"id": self.id, "remote": self.remote, "profile": self.profile.name, "rung": self.rung,
+                "quality": min(self.profile.quality, LADDER[self.rung][1] or 100),
+                "scale": LADDER[self.rung][0], "fps_cap": round(self.fps, 2),
+                "fps": round(self.frames / el, 2), "frames": self.frames, "skipped": self.skipped,
+                "kbps": round(self.bytes * 8 / el / 1000, 1),
+                "drain_kbps": None if self.drain_bps is None else round(self.drain_bps * 8 / 1000, 1),
+                "send_queue_bytes": self.outq, "queue_ms": round(self.queue_s * 1000, 1),
+                "latency_ms": round(self.latency_s * 1000, 1), "target_ms": round(self.target_s * 1000)}
+
+def stream(cam, base, sock=None, remote=None):
+    """MJPEG parts for one client, switching rung broadcasters as it adapts."""
+    snap = settings.snapshot()
+    c = StreamClient(base, snap, sock, remote)
+    CLIENTS[c.id] = c
+    native = out_size(snap)
+    frames, rung, b = None, None, None
+    try:
+        while True:
+            if c.rung != rung:
+                if frames is not None: frames.close()
+                rung = c.rung
+                b = cam.broadcaster(rung_profile(base, rung, native))
+                frames = b.frames()
+            seq, ts, part, _ = next(frames)
+            t0 = time.monotonic()
+            if not c.admit(t0, ts) or (part := b.take(seq, part)) is None:
+                c.skipped += 1
+                continue
+            yield part  # resumes once the server has written it
+            c.sent(len(part), ts, t0, time.monotonic())
+    finally:
+        if frames is not None: frames.close()
+        CLIENTS.pop(c.id, None)
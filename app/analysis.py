@@ -0,0 +1,60 @@
+import threading, time, cv2, numpy as np
+
+class AnalysisLane:
+    """Low-resolution grayscale copy of the capture for analytics.
+
+    One small frame (``analysis.size``) is produced at most ``analysis.fps``
+    times per second, either by downscaling the main frame or straight from
+    the Y plane of Picamera2's ``lores`` stream. Motion scoring, the lux
+    estimate and any other consumer work on this instead of the 720p frame.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.size = (160, 90)
+        self.fps = 15.0
+        self.seq = 0
+        self.gray = None
+        self.ts = None
+        self.lux = None  # mean luma 0..255
+        self._last_t = 0.0
+        self._consumers = []
+
+    def configure(self, snap):
+        self.size = tuple(snap["analysis.size"])
+        self.fps = max(0.1, snap["analysis.fps"])
+
+    def subscribe(self, fn):
+        # fn(gray, ts) runs on the producing thread; keep it short
+        self._consumers.append(fn)
+
+    def due(self, now):
+        return now - self._last_t >= 1.0 / self.fps
+
+    def mark(self, now):
+        # claim the slot when the frame is scheduled, not when it's processed
+        self._last_t = now
+
+    def from_main(self, frame):
+        w, h = self.size
+        if (frame.shape[0] > frame.shape[1]) != (h > w): w, h = h, w  # rotated 90/270 by the transform
+        small = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        code = cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(small, code)
+
+    def from_lores(self, yuv):
+        # YUV420 planar: the first h rows are the Y (luma) plane
+        w, h = self.size
+        gray = yuv[:h, :w]
+        if gray.shape != (h, w):
+            gray = cv2.resize(gray, (w, h), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(gray)
+
+    def publish(self, gray, now=None):
+        now = time.monotonic() if now is None else now
+        lux = float(cv2.mean(gray)[0])
+        with self.cond:
+            self.gray, self.ts, self.lux = gray, now, lux
+            self.seq += 1
+            self.cond.notify_all()
+        for fn in self._consumers:
+            fn(gray, now)
@@ -0,0 +1,291 @@
+"""
+Asyncio HTTP front end (RPICAM_SERVER=async, the default).
+
+/stream.mjpg and the SSE feeds (stats, overlay) are coroutines: no thread per
+viewer, and frames go out through non-blocking transports whose small write buffer makes
+``drain()`` the backpressure point; a viewer that can't keep up skips to the
+newest frame instead of queueing. Everything else (pages, settings, the JSON
+API) is handed to the Flask app on a small thread pool, so all existing routes
+behave as before. A native handler that returns False (camera not ready,
+unknown profile) falls through to Flask for the usual error response. Flask
+responses that stream (no Content-Length, e.g. clip playback) hold a pool
+thread for their whole life, so at most ``WSGI_STREAMS`` run at once; more get
+a 503 and the pool stays free for everything else.
+"""
+import asyncio, io, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+from . import settings
+from .transform import out_size
+from .push import HUB, parse_limits
+
+WSGI_THREADS = 6
+WSGI_STREAMS = 3         # streaming Flask responses allowed at once
+HIGH_WATER = 64 * 1024   # transport buffer above which drain() waits
+STALL_S = 10.0           # a viewer that accepts nothing for this long is dropped
+HEARTBEAT_S = 15.0
+
+class Request:
+    __slots__ = ("method", "path", "query", "version", "headers", "body", "args", "peer")
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        conn = self.header("connection", "").lower()
+        return conn != "close" if self.version == "HTTP/1.1" else conn == "keep-alive"
+
+async def _read_request(reader, peer):
+    line = await reader.readline()
+    if not line.strip(): return None
+    method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""): break
+        k, _, v = h.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    # chunked bodies aren't supported: no body is read and the caller answers 411
+    n = 0 if "transfer-encoding" in headers else int(headers.get("content-length") or 0)
+    req = Request()
+    u = urlsplit(target)
+    req.method, req.path, req.query, req.version = method, u.path, u.query, version
+    req.headers, req.peer = headers, peer
+    req.body = await reader.readexactly(n) if n else b""
+    req.args = {k: v[-1] for k, v in parse_qs(u.query).items()}
+    return req
+
+class _Fanout:
+    """Bridges a producer thread's "something new" signal to waiting coroutines."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.events = set()
+
+    def signal(self):  # any thread
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for ev in self.events:
+            ev.set()
+
+class Server:
+    def __init__(self, app, cam_ref, host="0.0.0.0", port=8000):
+        self.app, self.cam_ref, self.host, self.port = app, cam_ref, host, port
+        self.pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="wsgi")
+        self.streams = threading.BoundedSemaphore(WSGI_STREAMS)
+        self.native = {"/stream.mjpg": self._mjpeg, "/api/stats/stream": self._sse,
+                       "/api/overlay/stream": self._overlay_sse}
+        self._fanouts = {}
+        self.loop = None
+
+    def _fanout(self, key, attach):
+        f = self._fanouts.get(key)
+        if f is None:
+            f = self._fanouts[key] = _Fanout(self.loop)
+            attach(f.signal)
+        return f
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        srv = await asyncio.start_server(self._conn, self.host, self.port)
+        async with srv:
+            await srv.serve_forever()
+
+    async def _conn(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=HIGH_WATER)
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while True:
+                req = await _read_request(reader, peer)
+                if req is None: break
+                if "transfer-encoding" in req.headers:  # the body's framing is unknown: close
+                    writer.write(b"HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                handler = self.native.get(req.path)
+                if handler is not None and req.method == "GET" and await handler(req, writer) is not False:
+                    break  # streams own the connection until the client goes away
+                if not await self._wsgi(req, writer) or not req.keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # --- Flask pass-through ---------------------------------------------------
+
+    def _environ(self, req):
+        env = {
+            "REQUEST_METHOD": req.method, "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(req.path, encoding="latin-1"), "QUERY_STRING": req.query,
+            "SERVER_NAME": self.host, "SERVER_PORT": str(self.port), "SERVER_PROTOCOL": req.version,
+            "REMOTE_ADDR": req.peer[0], "REMOTE_PORT": str(req.peer[1]),
+            "wsgi.version": (1, 0), "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(req.body),
+            "wsgi.errors": sys.stderr, "wsgi.multithread": True, "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for k, v in req.headers.items():
+            if k == "content-type": env["CONTENT_TYPE"] = v
+            elif k == "content-length": env["CONTENT_LENGTH"] = v
+            else: env["HTTP_" + k.upper().replace("-", "_")] = v
+        return env
+
+    def _run_wsgi(self, req, writer):
+        # runs on a pool thread; every write hops to the loop and waits for drain
+        state = {}
+        def send(data):
+            asyncio.run_coroutine_threadsafe(self._send(writer, data), self.loop).result()
+        def start_response(status, headers, exc_info=None):
+            state["status"], state["headers"] = status, headers
+            return send
+        result = self.app(self._environ(req), start_response)
+        slot = False
+        try:
+            it = iter(result)  # Flask has called start_response by the time it returns
+            code = int(state["status"].split(" ", 1)[0])
+            bodyless = req.method == "HEAD" or code < 200 or code in (204, 304)
+            first = b"" if bodyless else next(it, b"")
+            names = {k.lower() for k, _ in state["headers"]}
+            if bodyless:  # nothing follows the head, so no stream slot and the connection can stay open
+                it = iter(())
+                if "content-length" not in names and code >= 200 and code != 204:
+                    state["headers"] = list(state["headers"]) + [("Content-Length", "0")]
+            elif "content-length" not in names:
+                slot = self.streams.acquire(blocking=False)
+                if not slot:
+                    send(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\nRetry-After: 5\r\n"
+                         b"Content-Length: 17\r\nConnection: close\r\n\r\ntoo many streams\n")
+                    return False
+            keep = ("content-length" in names or bodyless) and req.keep_alive
+            head = [f"HTTP/1.1 {state['status']}"] + [f"{k}: {v}" for k, v in state["headers"]]
+            head.append("Connection: keep-alive" if keep else "Connection: close")
+            send(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + first)
+            for chunk in it:
+                if chunk: send(chunk)
+            return keep
+        finally:
+            if slot: self.streams.release()
+            if hasattr(result, "close"): result.close()
+
+    async def _send(self, writer, data):
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), STALL_S)
+
+    async def _wsgi(self, req, writer):
+        return await self.loop.run_in_executor(self.pool, self._run_wsgi, req, writer)
+
+    # --- native streams ---------------------------------------------------------
+
+    async def _mjpeg(self, req, writer):
+        from .stream import lookup
+        from .adaptive import StreamClient, CLIENTS, rung_profile
+        cam = self.cam_ref()
+        base = lookup(req.args.get("profile", "full"), req.args.get("overlay"))
+        if cam is None or base is None: return False
+        snap = settings.snapshot()
+        client = None
+        if snap.flag("stream.adaptive") and req.args.get("adaptive", "1") != "0":
+            client = StreamClient(base, snap, writer.get_extra_info("socket"), req.peer[0])
+            CLIENTS[client.id] = client
+        native = out_size(snap)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        ev, b, fan, rung, last = asyncio.Event(), None, None, None, 0
+        try:
+            while True:
+                r = client.rung if client else 0
+                if r != rung:
+                    if b is not None: b.detach(); fan.events.discard(ev)
+                    rung = r
+                    b = cam.broadcaster(rung_profile(base, r, native))
+                    fan = self._fanout(b, b.listeners.append)
+                    fan.events.add(ev)
+                    b.attach()
+                    last = 0
+                ev.clear()
+                seq, ts, part, _ = b.latest()
+                if seq == last or part is None:
+                    try:
+                        await asyncio.wait_for(ev.wait(), 1.0)
+                    except asyncio.TimeoutError:
+                        if writer.is_closing(): break
+                    continue
+                last = seq
+                t0 = time.monotonic()
+                if client is not None and not client.admit(t0, ts):
+                    client.skipped += 1
+                    continue
+                part = b.take(seq, part)  # a copy out of the worker's ring in process mode
+                if part is None: continue
+                writer.write(part)
+                await asyncio.wait_for(writer.drain(), STALL_S)
+                if client is not None:
+                    client.sent(len(part), ts, t0, time.monotonic())
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            if b is not None: b.detach(); fan.events.discard(ev)
+            if client is not None: CLIENTS.pop(client.id, None)
+
+    async def _sse(self, req, writer):
+        limits = parse_limits(settings.get("push.min_interval_s"))
+        fan = self._fanout(HUB, HUB.listeners.append)
+        ev = asyncio.Event()
+        fan.events.add(ev)
+        with HUB.cond:
+            HUB.clients += 1
+        sent, wait = {}, None
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"X-Accel-Buffering: no\r\nConnection: close\r\n\r\nretry: 2000\n\n")
+            while True:
+                ev.clear()
+                event, wait = HUB.take(sent, limits, time.monotonic())
+                if event:
+                    writer.write(event.encode())
+                    await asyncio.wait_for(writer.drain(), STALL_S)
+                try:
+                    await asyncio.wait_for(ev.wait(), wait or HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    if wait is None:
+                        writer.write(b": ping\n\n")
+                        await asyncio.wait_for(writer.drain(), STALL_S)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            fan.events.discard(ev)
+            with HUB.cond:
+                HUB.clients -= 1
+
+    async def _overlay_sse(self, req, writer):
+        cam = self.cam_ref()
+        if cam is None: return False
+        feed = cam.overlay_feed
+        fan = self._fanout(feed, feed.listeners.append)
+        ev = asyncio.Event()
+        fan.events.add(ev)
+        with feed.cond:
+            feed.clients += 1
+        sent = {}
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"X-Accel-Buffering: no\r\nConnection: close\r\n\r\nretry: 2000\n\n")
+            while True:
+                ev.clear()
+                event = feed.take(sent)
+                if event:
+                    writer.write(event.encode())
+                    await asyncio.wait_for(writer.drain(), STALL_S)
+                try:
+                    await asyncio.wait_for(ev.wait(), HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                    await asyncio.wait_for(writer.drain(), STALL_S)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            fan.events.discard(ev)
+            with feed.cond:
+                feed.clients -= 1
+
+def run(app, cam_ref, host="0.0.0.0", port=8000):
+    asyncio.run(Server(app, cam_ref, host, port).serve())
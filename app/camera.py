@@ -1,26 +1,85 @@
-import threading, time, io, cv2, numpy as np
-from picamera2 import Picamera2
-from . import settings
+import threading, time, numpy as np
+from . import settings, telemetry, hw, metrics, trace
 from .sensors import get_state
 from .motion import MotionDetector
+from .overlay import Overlay, OverlayFeed
+from .analysis import AnalysisLane
+from .transform import Transform
+from .stream import MjpegBroadcaster, PROFILES
+from .pipeline import DropQueue, Frame, FramePool, LatencyTracker, readonly, stage_thread
+
+STAGES = ("capture", "transform", "overlay", "publish")
+
+CAPTURED = metrics.Counter("rpicam_frames_captured_total", "Frames taken from the sensor.")
+STAGE_SECONDS = metrics.Histogram("rpicam_stage_seconds",
+    "Per-frame time spent reaching each pipeline stage (end_to_end = sensor to publish).", ("stage",))
 
 class Camera:
-    def __init__(self):
-        self.picam = Picamera2()
+    Broadcaster = MjpegBroadcaster
+
+    def __init__(self, analyze=True):
+        self.picam = None  # opened by start()
+        self.analyze = analyze  # False in the capture worker: analysis runs in the web process
         self.frame_lock = threading.Lock()
+        self.frame_cond = threading.Condition(self.frame_lock)
         self.frame = None
+        self.frame_seq = 0
+        self.frame_t = None  # capture time of ``frame``, monotonic s
+        self._broadcasters = {}
         self.motion = MotionDetector()
+        self.motion.listeners.append(self._on_motion_event)
+        self._motion_peak = 0.0
+        self.analysis = AnalysisLane()
+        self.analysis.subscribe(self._on_analysis)
+        self.lores = False
+        self._last_motion_log = 0
+        self.overlay = Overlay()
+        self.overlay_feed = OverlayFeed(self.overlay)
+        self.latency = LatencyTracker(hist=STAGE_SECONDS)
+        self.pool = FramePool(8)
+        self.tpool = FramePool(8)  # transformed frames (their shape can differ from the sensor's)
+        self.transform = Transform()
+        self.lores_transform = Transform()
+        self.fps = None          # current sensor frame rate; the governor may lower it
+        self.quality_cap = 100   # JPEG quality ceiling applied by every broadcaster
+        self.listeners = []      # fn(seq, frame, ts) on the publish thread; ts = capture time, monotonic s
+        # capture -> transform -> overlay -> publish, with analysis branching off transform
+        self.queues = {n: DropQueue(2, name=n) for n in ("transform", "analysis", "overlay", "publish")}
         self.running = False
 
     def start(self):
         if self.running: return
-        w,h = [int(x) for x in settings.get("camera.resolution","1280x720").split('x')]
-        fps = int(settings.get("camera.framerate","30"))
-        config = self.picam.create_video_configuration(main={"size":(w,h)}, controls={"FrameRate": fps})
+        if self.picam is None: self.picam = hw.camera()
+        snap = settings.snapshot()
+        w,h = snap["camera.resolution"]
+        fps = self.fps = int(snap["camera.framerate"])
+        self.analysis.configure(snap)
+        self.lores = self.analyze and snap.flag("camera.lores")
+        extra = {"lores": {"size": self.analysis.size}} if self.lores else {}
+        config = self.picam.create_video_configuration(main={"size":(w,h)}, controls={"FrameRate": fps}, **extra)
         self.picam.configure(config)
         self.picam.start()
         self.running = True
-        threading.Thread(target=self._loop, daemon=True).start()
+        alive = lambda: self.running
+        q = self.queues
+        threading.Thread(target=self._capture_loop, name="cam-capture", daemon=True).start()
+        stage_thread("cam-transform", q["transform"], self._transform, alive)
+        stage_thread("cam-analysis", q["analysis"], self._analyze, alive)
+        stage_thread("cam-overlay", q["overlay"], self._overlay, alive)
+        stage_thread("cam-publish", q["publish"], self._publish, alive)
+
+    def set_fps(self, fps):
+        fps = max(1.0, round(fps, 1))
+        if fps == self.fps: return
+        try:
+            self.picam.set_controls({"FrameRate": fps})
+            self.fps = fps
+        except Exception:
+            pass
+
+    def viewers(self):
+        with self.frame_lock:
+            return sum(b.viewers for b in self._broadcasters.values())
 
     def stop(self):
         try:
@@ -29,78 +88,124 @@ class Camera:
         self.running = False
 
     def latest(self):
+        # published frames are read-only views of pool buffers; no copy needed
         with self.frame_lock:
-            return None if self.frame is None else self.frame.copy()
-
-    def _draw_guidelines(self, img):
-        for i in (1,2):
-            color = settings.get(f"guideline{i}.color","#00FF00").lstrip('#')
-            r = int(color[0:2], 16); g = int(color[2:4], 16); b = int(color[4:6], 16)
-            alpha = float(settings.get(f"guideline{i}.alpha","0.6"))
-            thick = int(settings.get(f"guideline{i}.width","4"))
-            sx,sy = [float(x) for x in settings.get(f"guideline{i}.start","0.25,0.8").split(',')]
-            ex,ey = [float(x) for x in settings.get(f"guideline{i}.end","0.25,0.95").split(',')]
-            h,w = img.shape[:2]
-            p1 = (int(sx*w), int(sy*h))
-            p2 = (int(ex*w), int(ey*h))
-            overlay = img.copy()
-            cv2.line(overlay, p1, p2, (b,g,r), thickness=thick, lineType=cv2.LINE_AA)
-            cv2.addWeighted(overlay, alpha, img, 1-alpha, 0, img)
-
-    def _overlay_texts(self, img):
-        st = get_state()
-        if settings.get("overlay.enabled","1") != "1": return
-        xnorm, ynorm = [float(x) for x in settings.get("overlay.text_pos","0.02,0.10").split(',')]
-        scale = float(settings.get("overlay.text_scale","1.0"))
-        x = int(xnorm*img.shape[1]); y = int(ynorm*img.shape[0])
-        lines = []
-        if settings.get("overlay.show_distance","1")=="1" and st.distance_m is not None:
-            lines.append(f"Dist: {st.distance_m:.1f} m")
-        if settings.get("overlay.show_battery","1")=="1" and st.batt_pct is not None:
-            lines.append(f"Batt: {st.batt_pct:.0f}% ({(st.voltage or 0):.2f}V)")
-        if settings.get("overlay.show_cpu","1")=="1" and st.cpu_temp_c is not None:
-            lines.append(f"CPU: {st.cpu_temp_c:.1f}C load {st.cpu_load:.2f}")
-
-        for i,txt in enumerate(lines):
-            cv2.putText(img, txt, (x, y + i*int(28*scale)), cv2.FONT_HERSHEY_SIMPLEX,
-                        scale, (0,0,0), thickness=3, lineType=cv2.LINE_AA)
-            cv2.putText(img, txt, (x, y + i*int(28*scale)), cv2.FONT_HERSHEY_SIMPLEX,
-                        scale, (255,255,255), thickness=1, lineType=cv2.LINE_AA)
-
-    def _maybe_rotate(self, img):
-        rot = int(settings.get("camera.rotation","0"))
-        if rot % 360 == 180:
-            return cv2.rotate(img, cv2.ROTATE_180)
-        return img
-
-    def _loop(self):
-        last_motion_log = 0
+            return self.frame
+
+    def wait_frame(self, after_seq, timeout=None):
+        with self.frame_cond:
+            self.frame_cond.wait_for(lambda: self.frame_seq != after_seq, timeout=timeout)
+            return self.frame_seq, self.frame, self.frame_t  # read together: t belongs to this frame
+
+    def _capture(self):
+        # main (and lores) arrays plus the sensor timestamp from one request
+        req = self.picam.capture_request()
+        try:
+            # one copy out of the camera buffer into a reused pool buffer
+            with hw.mapped(req, "main") as m:
+                src = m.array
+                main = self.pool.acquire(src.shape, src.dtype)
+                np.copyto(main, src)
+            lores = req.make_array("lores") if self.lores else None
+            ts = req.get_metadata().get("SensorTimestamp")
+        finally:
+            req.release()
+        now = time.monotonic_ns()
+        if ts is None or not 0 <= now - ts < 1_000_000_000:  # not on our clock
+            ts = now
+        return main, lores, ts
+
+    def _on_analysis(self, gray, ts):
+        # motion score every analysis frame; the trend keeps the 5 s peak
+        mscore = self.motion.tick(gray, ts)
+        trace.record(trace.CH["motion_cells"], ts, self.motion.active)
+        trace.record(trace.CH["motion"], ts, mscore)
+        self._motion_peak = max(self._motion_peak, mscore)
+        now = int(time.time())
+        if now - self._last_motion_log >= 5:  # sample coarsely
+            telemetry.log_motion(now, float(self._motion_peak))
+            self._last_motion_log = now
+            self._motion_peak = 0.0
+
+    def _on_motion_event(self, ev):
+        if ev.end is not None:
+            telemetry.log_motion_event(ev)
+
+    def _capture_loop(self):
+        seq = 0
         while self.running:
-            frame = self.picam.capture_array("main")
-            frame = self._maybe_rotate(frame)
-            # motion score + log occasionally
-            mscore = self.motion.tick(frame)
-            now = int(time.time())
-            if now - last_motion_log >= 5:  # sample coarsely
-                from .settings import log_motion
-                log_motion(now, float(mscore))
-                last_motion_log = now
-            self._draw_guidelines(frame)
-            self._overlay_texts(frame)
-            with self.frame_lock:
-                self.frame = frame
-
-    def mjpeg_generator(self, quality=80):
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-        while True:
-            frame = self.latest()
-            if frame is None:
-                time.sleep(0.01); continue
-            ok, jpg = cv2.imencode('.jpg', frame, encode_param)
-            if not ok:
-                continue
-            b = jpg.tobytes()
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n"
-                   b"Content-Length: " + str(len(b)).encode() + b"\r\n\r\n" +
-                   b + b"\r\n")
+            try:
+                img, lores, ts = self._capture()
+            except Exception:
+                time.sleep(0.05); continue
+            seq += 1
+            CAPTURED.inc()
+            f = Frame(seq, img, lores, ts)
+            f.stamp("capture")
+            self.queues["transform"].put(f)
+
+    def _transform(self, f):
+        snap = settings.snapshot()  # one lock-free read per frame
+        t0 = time.perf_counter()
+        f.img = self.transform.apply(f.img, snap, self.tpool)
+        if self.transform.kind != "identity": self.latency.add("transform.main", (time.perf_counter() - t0) * 1000.0)
+        now = f.t_capture / 1e9
+        if self.analyze and self.analysis.due(now):
+            # decimate here so analysis never reads a frame the overlay is drawing on
+            if f.lores is not None:
+                t0 = time.perf_counter()
+                f.small = self.lores_transform.apply(self.analysis.from_lores(f.lores), snap)
+                if self.lores_transform.kind != "identity":
+                    self.latency.add("transform.lores", (time.perf_counter() - t0) * 1000.0)
+            else:
+                f.small = self.analysis.from_main(f.img)
+            self.analysis.mark(now)
+        f.stamp("transform")  # before either hand-off: analysis reads it
+        if f.small is not None: self.queues["analysis"].put(f)
+        self.queues["overlay"].put(f)
+
+    def _analyze(self, f):
+        self.analysis.publish(f.small, f.t_capture / 1e9)
+        self.latency.add("analysis", (time.monotonic_ns() - f.stamps["transform"]) / 1e6)
+
+    def _overlay(self, f):
+        snap = settings.snapshot()
+        if snap.raw.get("overlay.mode") != "client":  # client mode: browsers draw it from overlay_feed
+            self.overlay.draw(f.img, snap, get_state())
+        f.stamp("overlay")
+        self.queues["publish"].put(f)
+
+    def _publish(self, f):
+        view = readonly(f.img)
+        with self.frame_cond:
+            self.frame = view
+            self.frame_seq += 1
+            self.frame_t = f.t_capture / 1e9
+            seq = self.frame_seq
+            self.frame_cond.notify_all()
+        self.overlay_feed.publish(seq, time.time(), settings.snapshot(), get_state(), view.shape)
+        for fn in self.listeners:
+            fn(seq, view, f.t_capture / 1e9)
+        f.stamp("publish")
+        self.latency.record(f, STAGES)
+
+    def stats(self):
+        return {
+            "latency_ms": self.latency.summary(),
+            "dropped": {n: q.dropped for n, q in self.queues.items()},
+            "pool": self.pool.stats(),
+            "transform": {"main": self.transform.stats(),
+                          **({"lores": self.lores_transform.stats()} if self.lores else {})},
+        }
+
+    def broadcaster(self, profile="full"):
+        # one broadcaster per profile (a name or a StreamProfile); each only works while it has clients
+        p = PROFILES[profile] if isinstance(profile, str) else profile
+        with self.frame_lock:
+            b = self._broadcasters.get(p.name)
+            if b is None or b.profile != p:
+                b = self._broadcasters[p.name] = self.Broadcaster(self, p)
+            return b
+
+    def mjpeg_generator(self, profile="full"):
+        return self.broadcaster(profile).stream()
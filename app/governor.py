@@ -0,0 +1,132 @@
+import threading, time, os
+from collections import namedtuple
+from . import settings, telemetry, metrics, sensors
+from .push import HUB
+
+# fps: share of camera.framerate; analysis_fps/quality: caps (None = as configured);
+# led_hz: cap on sensor-driven LED re-renders (blink edges are never delayed)
+Tier = namedtuple("Tier", "name fps analysis_fps quality led_hz")
+TIERS = (
+    Tier("full",     1.0,  None, None, None),
+    Tier("balanced", 0.67, 10.0, 75,   20.0),
+    Tier("eco",      0.5,  5.0,  65,   10.0),
+    Tier("critical", 0.34, 3.0,  50,   5.0),
+)
+TIER_INDEX = {t.name: i for i, t in enumerate(TIERS)}
+EVAL_S = 1.0
+
+TIER_GAUGE = metrics.Gauge("rpicam_governor_tier", "Current performance tier (0 = full).")
+
+def _level(cur, value, enter, hyst, falling=False):
+    """Hysteretic level 0..len(enter) for one input.
+
+    Level i+1 is entered once ``value`` crosses ``enter[i]`` and only left when
+    it is back past ``enter[i]`` by ``hyst``; ``falling`` flips the direction
+    (battery: lower is worse).
+    """
+    if value is None: return cur
+    sign = -1.0 if falling else 1.0
+    v = sign * value
+    thr = [sign * t for t in enter]
+    while cur < len(thr) and v >= thr[cur]:
+        cur += 1
+    while cur > 0 and v < thr[cur - 1] - hyst:
+        cur -= 1
+    return cur
+
+class Governor(threading.Thread):
+    """Picks a performance tier from CPU temperature, load, battery level and
+    whether anyone is watching, and applies it to the camera, analysis lane,
+    stream encoders and LEDs.
+
+    Each input keeps its own hysteretic level; the tier is the worst of them.
+    Dropping to a lower tier is immediate. Climbing back after temperature,
+    battery or load happens one tier at a time and only after those inputs have
+    allowed it for ``governor.dwell_s``; the idle tier is left as soon as
+    someone starts watching.
+    """
+    def __init__(self, cam_ref, leds_ref=None):
+        super().__init__(daemon=True, name="governor")
+        self.cam_ref = cam_ref
+        self.leds_ref = leds_ref or (lambda: None)
+        self._stop = threading.Event()
+        self.tier = 0
+        self.reason = "start"
+        self.levels = {"temp": 0, "battery": 0, "load": 0, "idle": 0}
+        self.changed_t = time.time()
+        self.held = 0  # tier from temp/battery/load, stepped back up through the dwell
+        self._better_since = None
+        self._applied = None
+
+    def stop(self): self._stop.set()
+
+    def _inputs(self, snap):
+        st = sensors.get_state()
+        cam = self.cam_ref()
+        lv = self.levels
+        lv["temp"] = _level(lv["temp"], st.cpu_temp_c, snap["governor.temp_c"], snap["governor.temp_hyst_c"])
+        lv["battery"] = _level(lv["battery"], st.batt_pct, snap["governor.batt_pct"],
+                               snap["governor.batt_hyst_pct"], falling=True)
+        load = None if st.cpu_load is None else st.cpu_load / (os.cpu_count() or 1)
+        lv["load"] = _level(lv["load"], load, (snap["governor.load"],), 0.25)
+        watching = cam is not None and cam.viewers() > 0
+        lv["idle"] = 0 if watching else TIER_INDEX.get(snap.raw.get("governor.idle_tier"), 0)
+        return lv
+
+    def evaluate(self, snap, now):
+        lv = self._inputs(snap)
+        rest, stepped = max(v for k, v in lv.items() if k != "idle"), False
+        if rest >= self.held:
+            self.held, self._better_since = rest, None
+        elif self._better_since is None:
+            self._better_since = now
+        elif now - self._better_since >= snap["governor.dwell_s"]:
+            self._better_since = now  # the next step up waits a full dwell again
+            self.held -= 1
+            stepped = True
+        tier = max(self.held, lv["idle"])
+        if tier > self.tier: return tier, max(lv, key=lv.get)
+        if tier < self.tier: return tier, "recovered" if stepped else "watched"
+        return self.tier, self.reason
+
+    def apply(self, snap):
+        t = TIERS[self.tier]
+        cam, leds = self.cam_ref(), self.leds_ref()
+        key = (self.tier, snap.version, cam is not None, leds is not None)
+        if key == self._applied: return
+        self._applied = key
+        if cam is not None:
+            cam.set_fps(snap["camera.framerate"] * t.fps)
+            cam.quality_cap = t.quality or 100
+            af = snap["analysis.fps"]
+            cam.analysis.fps = max(0.1, min(af, t.analysis_fps) if t.analysis_fps else af)
+        if leds is not None:
+            leds.max_hz = t.led_hz
+
+    def _set(self, tier, reason):
+        old = TIERS[self.tier].name
+        self.tier, self.reason, self.changed_t = tier, reason, time.time()
+        TIER_GAUGE.set(tier)
+        telemetry.submit("tier", (self.changed_t, TIERS[tier].name, f"{old}->{TIERS[tier].name}: {reason}"))
+        st = sensors.get_state()
+        st.tier = TIERS[tier].name
+        HUB.publish(st)
+
+    def run(self):
+        sensors.get_state().tier = TIERS[self.tier].name
+        while not self._stop.is_set():
+            snap = settings.snapshot()
+            if snap.flag("governor.enabled"):
+                tier, reason = self.evaluate(snap, time.monotonic())
+            else:
+                tier, reason = 0, "disabled"
+            if tier != self.tier:
+                self._set(tier, reason)
+            self.apply(snap)
+            self._stop.wait(EVAL_S)
+
+    def stats(self):
+        t = TIERS[self.tier]
+        return {"tier": t.name, "index": self.tier, "reason": self.reason, "since": self.changed_t,
+                "levels": {k: TIERS[v].name for k, v in self.levels.items()}, "settings": t._asdict(),
+                "log": settings.get_tier_log(20)}
@@ -0,0 +1,92 @@
+"""
+Hardware backend selection.
+
+RPICAM_BACKEND=hw    (default) real drivers only; a missing driver raises ImportError,
+                     so its subsystem shows up as absent
+RPICAM_BACKEND=sim   simulated camera/sensors/LEDs from app.sim
+RPICAM_BACKEND=auto  real drivers where importable, simulation otherwise (development)
+
+Simulation is never picked unless asked for: on the car, fake distances or
+video in place of a failed driver would be worse than none.
+"""
+import errno, os
+
+BACKEND = os.environ.get("RPICAM_BACKEND", "hw").lower()
+used = {}  # device -> "hw" | "sim", for diagnostics
+
+def _pick(device, load_hw, load_sim):
+    if BACKEND != "sim":
+        try:
+            obj = load_hw()
+            used[device] = "hw"
+            return obj
+        except ImportError:
+            if BACKEND == "hw": raise
+    used[device] = "sim"
+    return load_sim()
+
+def _picamera2():
+    from picamera2 import Picamera2
+    # with nothing on the CSI port Picamera2() fails with a RuntimeError/IndexError;
+    # OSError makes the camera "absent" rather than "failed"
+    if not Picamera2.global_camera_info():
+        raise OSError(errno.ENODEV, "no cameras available")
+    return Picamera2
+
+def camera():
+    def hw():
+        return _picamera2()()
+    def sim():
+        from .sim import SimPicamera2
+        return SimPicamera2()
+    return _pick("camera", hw, sim)
+
+def check_camera():
+    """Raise as ``camera()`` would for a missing driver or camera, without opening it."""
+    _pick("camera", _picamera2, lambda: None)
+
+def mapped(request, stream):
+    """Context manager whose ``.array`` views a request's buffer without copying."""
+    if hasattr(request, "mapped"):  # simulated request
+        return request.mapped(stream)
+    from picamera2 import MappedArray
+    return MappedArray(request, stream)
+
+def i2c():
+    def hw():
+        import board, busio
+        return busio.I2C(board.SCL, board.SDA)
+    def sim():
+        from .sim import SimI2C
+        return SimI2C()
+    return _pick("i2c", hw, sim)
+
+def ina219(address=0x43):
+    def hw():
+        try:
+            from ina219 import INA219  # pi-ina219 naming
+        except ImportError:
+            from piina219 import INA219
+        return INA219(shunt_ohms=0.1, address=address, busnum=None)
+    def sim():
+        from .sim import SimINA219
+        return SimINA219()
+    return _pick("ina219", hw, sim)
+
+def vl53l1x(i2c_bus):
+    def hw():
+        import adafruit_vl53l1x
+        return adafruit_vl53l1x.VL53L1X(i2c_bus)
+    def sim():
+        from .sim import SimVL53L1X
+        return SimVL53L1X()
+    return _pick("vl53l1x", hw, sim)
+
+def neopixel(pin_no, n, brightness):
+    def hw():
+        import board, neopixel
+        return neopixel.NeoPixel(getattr(board, f"D{pin_no}"), n, brightness=brightness, auto_write=False)
+    def sim():
+        from .sim import FakeNeoPixel
+        return FakeNeoPixel(n, brightness=brightness)
+    return _pick("neopixel", hw, sim)
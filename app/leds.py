@@ -1,73 +1,138 @@
 import threading, time, math
-from . import settings
+from . import settings, sensors
 from .sensors import get_state
-import board, neopixel
+from .pipeline import LatencyTracker
+from . import hw, metrics
+
+OFF = (0,0,0)
+IDLE_WAIT_S = 1.0  # upper bound on sleep when nothing is blinking
+
+EDGE_LATE = metrics.Histogram("rpicam_led_edge_late_seconds", "How late the LED loop woke for a blink edge.")
+WRITES = metrics.Counter("rpicam_led_writes_total", "Writes pushed to the LED strip.")
 
 class LedController(threading.Thread):
+    """Event-driven LED renderer.
+
+    Sleeps until a new sensor reading, a settings change, or the next blink
+    edge. Blinking is driven by a phase accumulator (cycles), so a change in
+    warning frequency bends the period without a phase jump and edges land on
+    computed times instead of being discovered by polling. The strip is only
+    written when the output color (or brightness) actually changes.
+    """
     def __init__(self):
         super().__init__(daemon=True)
         self._stop = threading.Event()
+        self._wake = threading.Event()
         self.n = int(settings.get("led.count", 16))
-        pin = getattr(board, f"D{settings.get('led.pin','18')}")
-        self.pixels = neopixel.NeoPixel(pin, self.n, brightness=float(settings.get("led.brightness", 0.4)),
-                                        auto_write=False)
-        self._phase = 0
-        self._last_toggle = time.monotonic()
-        self._on_white = True
+        self.pixels = hw.neopixel(settings.get('led.pin','18'), self.n, float(settings.get("led.brightness", 0.4)))
+        self._phase = 0.0      # blink cycles; white for the first half of each cycle
+        self._phase_t = time.monotonic()
+        self._freq = 0.0
+        self._shown = None
+        self._brightness = None
+        self._last_edge = None  # (monotonic t, half-period at that time)
+        self._seen_dist_t = None
+        self.writes = 0
+        self.max_hz = None  # governor cap on sensor-driven re-renders
+        self.timing = LatencyTracker(256)
+        settings.watch(self._wake)
+        sensors.watch(self._wake)
 
     def stop(self):
         self._stop.set()
+        self._wake.set()
         try:
-            self.pixels.fill((0,0,0)); self.pixels.show()
+            self.pixels.fill(OFF); self.pixels.show()
         except Exception:
             pass
 
-    def _hex_to_rgb(self, hx):
-        hx = hx.lstrip("#")
-        return tuple(int(hx[i:i+2], 16) for i in (0,2,4))
+    def _warning_freq(self, snap, state):
+        if not snap.flag("warning.enabled") or state.distance_m is None:
+            return 0.0
+        fmin = snap["warning.freq_min_hz"]
+        fmax = snap["warning.freq_max_hz"]
+        dmin = snap["distance.min_m"]
+        dmax = snap["distance.max_m"]
+        d = max(dmin, min(dmax, state.distance_m))
+        # map dmax->fmin, dmin->fmax
+        return fmin + ( (dmax - d) / max(0.001, (dmax - dmin)) ) * (fmax - fmin)
 
-    def run(self):
-        white = self._hex_to_rgb(settings.get("led.white_color","#FFFFFF"))
-        red   = self._hex_to_rgb(settings.get("led.red_color","#FF0000"))
-        master = settings.get("led.master_on","1") == "1"
-        while not self._stop.is_set():
-            state = get_state()
-            master = settings.get("led.master_on","1") == "1"
-            if not master:
-                self.pixels.fill((0,0,0)); self.pixels.show(); time.sleep(0.1); continue
+    def _write(self, color, brightness):
+        if brightness != self._brightness:
+            self.pixels.brightness = brightness
+            self._brightness = brightness
+            self._shown = None  # brightness only takes effect on the next show()
+        if color == self._shown:
+            return False
+        self.pixels.fill(color)
+        self.pixels.show()
+        self._shown = color
+        self.writes += 1
+        WRITES.inc()
+        return True
 
-            # Illumination on dark
-            illum = False
-            if settings.get("led.illum_on_dark","1") == "1" and state.lux_approx is not None:
-                illum = state.lux_approx < float(settings.get("led.dark_lux_threshold","40"))
+    def _render(self, now):
+        """Update outputs for time ``now``; returns seconds until the next edge or None."""
+        state = get_state()
+        snap = settings.snapshot()
+        white = snap["led.white_color"]
+        red   = snap["led.red_color"]
 
-            # Distance warning
-            warn_enabled = settings.get("warning.enabled","1") == "1"
-            fmin = float(settings.get("warning.freq_min_hz","0.1"))
-            fmax = float(settings.get("warning.freq_max_hz","20.0"))
-            dmin = float(settings.get("distance.min_m","0.2"))
-            dmax = float(settings.get("distance.max_m","4.0"))
-            f = 0.0
-            if warn_enabled and state.distance_m is not None:
-                d = max(dmin, min(dmax, state.distance_m))
-                # map dmax->fmin, dmin->fmax
-                f = fmin + ( (dmax - d) / max(0.001, (dmax - dmin)) ) * (fmax - fmin)
+        # advance the phase at the old frequency, then switch
+        self._phase += self._freq * (now - self._phase_t)
+        self._phase_t = now
+        self._freq = f = self._warning_freq(snap, state) if snap.flag("led.master_on") else 0.0
 
+        next_edge = None
+        if not snap.flag("led.master_on"):
+            color = OFF
+        elif f > 0:
+            half = math.floor(self._phase * 2.0)
+            color = white if half % 2 == 0 else red
+            next_edge = ((half + 1) / 2.0 - self._phase) / f
+        elif snap.flag("led.illum_on_dark") and state.lux_approx is not None \
+                and state.lux_approx < snap["led.dark_lux_threshold"]:
             color = white
-            now = time.monotonic()
-            if f > 0:
-                # alternate white <-> red according to frequency f
-                period = 1.0 / f
-                if now - self._last_toggle >= period / 2.0:
-                    self._on_white = not self._on_white
-                    self._last_toggle = now
-                color = white if self._on_white else red
-            elif illum:
-                color = white
-            else:
-                color = (0,0,0)
+        else:
+            color = OFF
+
+        prev = self._shown
+        changed = self._write(color, snap["led.brightness"])
+        if changed and f > 0 and prev in (white, red) and color != prev:
+            # blink accuracy: measured half-period vs. the one we were aiming for
+            if self._last_edge is not None:
+                t_prev, want = self._last_edge
+                got = now - t_prev
+                self.timing.add("half_period_err_ms", (got - want) * 1000.0)
+                self.timing.add("freq_err_pct", (want / got - 1.0) * 100.0 if got > 0 else 0.0)
+            self._last_edge = (now, 0.5 / f)
+        elif f <= 0:
+            self._last_edge = None
 
-            self.pixels.fill(color)
-            self.pixels.show()
-            state.led_status = "white" if color == white else ("red" if color==red else "off")
-            time.sleep(0.01)
+        # distance reading -> LED state applied
+        dt = getattr(state, "distance_t", None)
+        if dt is not None and dt != self._seen_dist_t:
+            self._seen_dist_t = dt
+            self.timing.add("distance_to_led_ms", (time.monotonic() - dt) * 1000.0)
+
+        state.led_status = "white" if color == white else ("red" if color==red else "off")
+        return next_edge
+
+    def stats(self):
+        return {"freq_hz": round(self._freq, 3), "writes": self.writes, "timing": self.timing.summary()}
+
+    def run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            next_edge = self._render(now)
+            # edges are tiny in the past when we wake right on them; nudge past
+            wait = IDLE_WAIT_S if next_edge is None else min(IDLE_WAIT_S, max(0.0, next_edge) + 1e-4)
+            if not self._wake.wait(wait):
+                if next_edge is not None and next_edge < IDLE_WAIT_S:
+                    EDGE_LATE.observe(time.monotonic() - (now + max(0.0, next_edge)))
+            elif self.max_hz:
+                # woken by a reading/setting: coalesce up to 1/max_hz, but not past the next edge
+                gap = now + 1.0 / self.max_hz - time.monotonic()
+                if next_edge is not None: gap = min(gap, next_edge)
+                if gap > 0: self._stop.wait(gap)
+            self._wake.clear()
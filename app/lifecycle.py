@@ -0,0 +1,92 @@
+import threading, time
+
+T0 = time.monotonic()  # process-relative origin for startup timings
+
+PENDING, STARTING, READY, FAILED, ABSENT, SKIPPED = "pending", "starting", "ready", "failed", "absent", "skipped"
+DEGRADED = "degraded"
+UP = (READY, DEGRADED)
+
+class Subsystem:
+    __slots__ = ("name", "start_fn", "deps", "required", "state", "error", "obj", "t_start", "t_ready", "done")
+
+    def __init__(self, name, start_fn, deps, required):
+        self.name = name
+        self.start_fn = start_fn
+        self.deps = tuple(deps)
+        self.required = required
+        self.state = PENDING
+        self.error = None
+        self.obj = None
+        self.t_start = None
+        self.t_ready = None
+        self.done = threading.Event()
+
+    def report(self):
+        rel = lambda t: None if t is None else round(t - T0, 3)
+        return {"state": self.state, "required": self.required, "deps": list(self.deps), "error": self.error,
+                "started_s": rel(self.t_start), "ready_s": rel(self.t_ready),
+                "took_s": None if self.t_ready is None else round(self.t_ready - self.t_start, 3)}
+
+class Lifecycle:
+    """Starts registered subsystems concurrently, each once its deps are up.
+
+    ``start_fn()`` returns the subsystem object (or None). A device that isn't
+    there (ImportError/OSError) marks the subsystem "absent", any other
+    exception "failed"; either way dependents are "skipped" and the rest of the
+    app keeps running. An object whose ``degraded`` attribute is set (a reason)
+    runs without some of its parts: "degraded", still usable by dependents.
+    ``ready()`` is true once every required one is up.
+    """
+    def __init__(self):
+        self.subs = {}
+        self._started = False
+
+    def add(self, name, start_fn, deps=(), required=False):
+        self.subs[name] = Subsystem(name, start_fn, deps, required)
+
+    def get(self, name):
+        s = self.subs.get(name)
+        return s.obj if s is not None and s.state in UP else None
+
+    def _run(self, s):
+        try:
+            for d in s.deps:
+                dep = self.subs[d]
+                dep.done.wait()
+                if dep.state not in UP:
+                    s.state, s.error = SKIPPED, f"{d} {dep.state}"
+                    return
+            s.state, s.t_start = STARTING, time.monotonic()
+            try:
+                s.obj = s.start_fn()
+            except (ImportError, OSError) as e:
+                s.state, s.error = ABSENT, f"{type(e).__name__}: {e}"
+                return
+            except Exception as e:
+                s.state, s.error = FAILED, f"{type(e).__name__}: {e}"
+                return
+            s.t_ready = time.monotonic()
+            s.error = getattr(s.obj, "degraded", None)
+            s.state = DEGRADED if s.error else READY
+        finally:
+            s.done.set()
+
+    def start(self):
+        if self._started: return
+        self._started = True
+        for s in self.subs.values():
+            threading.Thread(target=self._run, args=(s,), daemon=True, name=f"start-{s.name}").start()
+
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        for s in self.subs.values():
+            if not s.done.wait(None if end is None else max(0.0, end - time.monotonic())):
+                return False
+        return True
+
+    def ready(self):
+        return all(s.state in UP for s in self.subs.values() if s.required)
+
+    def report(self):
+        return {"ready": self.ready(), "uptime_s": round(time.monotonic() - T0, 3),
+                "subsystems": {n: s.report() for n, s in self.subs.items()}}
@@ -0,0 +1,146 @@
+"""
+Prometheus text-format metrics.
+
+Every metric (and every label combination) is created up front, and callers
+keep a reference to the child they record into. Recording is then an index
+into a preallocated ``array``: no dicts, tuples, strings or lists are built on
+the hot path. Values are updated without a lock; a racing increment can at
+worst be lost, which is fine for monitoring.
+"""
+import time
+from array import array
+from bisect import bisect_left
+
+REGISTRY = []
+
+# seconds; fine enough at the bottom for per-stage work on a Pi, up to a stalled frame
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BYTE_BUCKETS = (8e3, 16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6)
+
+def _fmt(v):
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._children = {}
+        self._one = None if self.labelnames else self.labels()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """The child for these label values; look it up once and keep it."""
+        values = tuple(str(v) for v in values)
+        ch = self._children.get(values)
+        if ch is None:
+            ch = self._children[values] = self._child()
+        return ch
+
+    def render(self, out):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for values, ch in list(self._children.items()):
+            ch.render(out, self.name, self.labelnames, values)
+
+class _Value:
+    __slots__ = ("v",)
+
+    def __init__(self):
+        self.v = array("d", (0.0,))
+
+    def inc(self, n=1.0):
+        self.v[0] += n
+
+    def dec(self, n=1.0):
+        self.v[0] -= n
+
+    def set(self, x):
+        self.v[0] = x
+
+    def render(self, out, name, names, values):
+        out.append(f"{name}{_labels(names, values)} {_fmt(self.v[0])}")
+
+class Counter(_Family):
+    kind = "counter"
+    _child = _Value
+
+    def inc(self, n=1.0):
+        self._one.inc(n)
+
+class Gauge(_Family):
+    """``fn`` makes a gauge sampled at scrape time instead: it returns a value,
+    or ``{label values tuple: value}`` for a labelled gauge (None = no sample)."""
+    kind = "gauge"
+    _child = _Value
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, x):
+        self._one.set(x)
+
+    def render(self, out):
+        if self.fn is None:
+            return super().render(out)
+        try:
+            got = self.fn()
+        except Exception:
+            got = None
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} gauge")
+        items = got.items() if isinstance(got, dict) else [((), got)]
+        for values, v in items:
+            if v is not None:
+                out.append(f"{self.name}{_labels(self.labelnames, values)} {_fmt(float(v))}")
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array("Q", bytes(8 * (len(bounds) + 1)))  # last slot is +Inf
+        self.sum = array("d", (0.0,))
+
+    def observe(self, x):
+        self.counts[bisect_left(self.bounds, x)] += 1
+        self.sum[0] += x
+
+    def render(self, out, name, names, values):
+        acc = 0
+        for le, n in zip(self.bounds + (float("inf"),), self.counts):
+            acc += n
+            le = 'le="%s"' % _fmt(le)
+            out.append(f"{name}_bucket{_labels(names, values, le)} {acc}")
+        out.append(f"{name}_sum{_labels(names, values)} {_fmt(self.sum[0])}")
+        out.append(f"{name}_count{_labels(names, values)} {acc}")
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.buckets = tuple(float(b) for b in sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, x):
+        self._one.observe(x)
+
+def render():
+    out = []
+    for fam in list(REGISTRY):
+        fam.render(out)
+    out.append("")
+    return "\n".join(out)
+
+START = time.time()
+Gauge("rpicam_start_time_seconds", "Unix time the process started.", fn=lambda: START)
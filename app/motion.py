@@ -1,17 +1,122 @@
 import cv2, numpy as np, time
+from collections import namedtuple
 from . import settings
 
+# start/end: epoch seconds (end is None while the event is still open);
+# peak: highest zone magnitude seen (% of zone pixels changed);
+# cells: bitmask of grid cells that were active at any point, row-major
+MotionEvent = namedtuple("MotionEvent", "start end peak cells")
+
+def parse_zones(txt):
+    zones = []
+    for part in str(txt or "").split(';'):
+        try:
+            x0, y0, x1, y1 = [float(v) for v in part.split(',')]
+        except ValueError:
+            continue
+        zones.append((min(x0,x1), min(y0,y1), max(x0,x1), max(y0,y1)))
+    return zones
+
+def zone_mask(zones, cols, rows):
+    # a cell belongs to a zone when its center lies inside it; a zone too small
+    # to hold any center gets the cell under its own center; no zones = everything
+    if not zones:
+        return np.ones((rows, cols), bool)
+    cx = (np.arange(cols) + 0.5) / cols
+    cy = (np.arange(rows) + 0.5) / rows
+    m = np.zeros((rows, cols), bool)
+    for x0, y0, x1, y1 in zones:
+        z = ((cy >= y0) & (cy <= y1))[:, None] & ((cx >= x0) & (cx <= x1))[None, :]
+        if not z.any():
+            z[min(rows - 1, max(0, int((y0 + y1) / 2 * rows))), min(cols - 1, max(0, int((x0 + x1) / 2 * cols)))] = True
+        m |= z
+    return m
+
 class MotionDetector:
+    """Running-average background model with a per-cell activity grid.
+
+    ``tick`` returns the zone magnitude for one analysis frame and drives a
+    hysteresis state machine: an event opens when the magnitude reaches
+    ``motion.on_pct`` and closes once it has stayed below ``motion.off_pct``
+    for ``motion.hold_s``. Listeners are called with a ``MotionEvent`` on
+    open (``end`` is None) and again on close. ``feed`` drives the same state
+    machine from recorded scores; ``tick`` stands aside while ``replay`` is set.
+    """
     def __init__(self):
-        self.prev = None
+        self.bg = None
+        self.listeners = []
+        self.score = 0.0
+        self.cell_frac = None
+        self.active = 0
+        self._ver = None
+        self._ev = None
+        self._quiet_since = None
+        self.replay = False
+
+    def _configure(self, snap):
+        cols, rows = snap["motion.grid"]
+        self.cols, self.rows = max(1, int(cols)), max(1, int(rows))
+        if self.cols * self.rows > 63:  # keep the cell bitmask in a signed 64-bit column
+            self.cols, self.rows = 8, 6
+        self.zone = zone_mask(parse_zones(snap.raw.get("motion.zones")), self.cols, self.rows)
+        self._bits = (1 << np.arange(self.cols * self.rows, dtype=np.int64)).reshape(self.rows, self.cols)
+        self.pix_thr = snap["motion.pixel_threshold"]
+        self.cell_thr = snap["motion.cell_threshold"]
+        self.alpha = snap["motion.bg_alpha"]
+        self.on_pct = snap["motion.on_pct"]
+        self.off_pct = min(snap["motion.off_pct"], self.on_pct)
+        self.hold_s = snap["motion.hold_s"]
+        self._ver = snap.version
 
-    def tick(self, frame_bgr):
-        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (9,9), 0)
-        if self.prev is None:
-            self.prev = gray
+    def _emit(self, ev):
+        for fn in self.listeners:
+            fn(ev)
+
+    def tick(self, gray, ts=None):
+        if self.replay: return self.score
+        snap = settings.snapshot()
+        if snap.version != self._ver: self._configure(snap)
+        ts = time.monotonic() if ts is None else ts
+        f = cv2.GaussianBlur(gray, (3,3), 0).astype(np.float32)
+        if self.bg is None or self.bg.shape != f.shape:
+            self.bg = f
             return 0.0
-        diff = cv2.absdiff(self.prev, gray)
-        self.prev = gray
-        score = float(np.mean(diff))
-        return score
+        moving = (cv2.absdiff(f, self.bg) > self.pix_thr)
+        cv2.accumulateWeighted(f, self.bg, self.alpha)
+
+        # fraction of changed pixels per grid cell, trimmed to whole cells
+        h, w = moving.shape
+        ch, cw = h // self.rows, w // self.cols
+        frac = moving[:ch*self.rows, :cw*self.cols].reshape(self.rows, ch, self.cols, cw).mean(axis=(1,3))
+        active = (frac > self.cell_thr) & self.zone
+        self.cell_frac = frac
+        self.active = int(self._bits[active].sum())
+        self.score = float(frac[self.zone].mean() * 100.0)
+        self._step(ts)
+        return self.score
+
+    def feed(self, score, active, ts):
+        """A recorded score and cell mask in place of a frame (trace replay)."""
+        snap = settings.snapshot()
+        if snap.version != self._ver: self._configure(snap)
+        self.replay = True
+        self.score, self.active = score, active
+        self._step(ts)
+
+    def _step(self, ts):
+        wall = time.time() - (time.monotonic() - ts)
+        if self._ev is None:
+            if self.score >= self.on_pct:
+                self._ev = MotionEvent(wall, None, self.score, self.active)
+                self._quiet_since = None
+                self._emit(self._ev)
+            return
+        ev = self._ev
+        self._ev = ev = ev._replace(peak=max(ev.peak, self.score), cells=ev.cells | self.active)
+        if self.score >= self.off_pct:
+            self._quiet_since = None
+        elif self._quiet_since is None:
+            self._quiet_since = wall
+        elif wall - self._quiet_since >= self.hold_s:
+            self._ev = None
+            self._emit(ev._replace(end=self._quiet_since))
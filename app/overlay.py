@@ -0,0 +1,205 @@
+import json, threading, time, cv2, numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+GUIDE_KEYS = tuple(f"guideline{i}.{k}" for i in (1,2) for k in ("color","alpha","width","start","end"))
+_TEXT_CACHE_MAX = 64
+STALE_S = 1.0  # distance older than this is shown as unknown
+
+class Sprite:
+    """Pre-multiplied RGBA patch: blending is ``roi = roi*inv + pre``."""
+    __slots__ = ("x", "y", "pre", "inv")
+
+    def __init__(self, x, y, color, alpha):
+        # color: (h,w,C) float32, alpha: (h,w) float32 0..1
+        a = alpha[..., None]
+        self.x, self.y = x, y
+        self.pre = color * a + 0.5  # +0.5 rounds on the uint8 store
+        self.inv = 1.0 - a
+
+    def blend(self, img, x=None, y=None):
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        h, w = self.inv.shape[:2]
+        H, W = img.shape[:2]
+        x0, y0, x1, y1 = max(0, x), max(0, y), min(W, x+w), min(H, y+h)
+        if x0 >= x1 or y0 >= y1: return
+        sy, sx = slice(y0-y, y1-y), slice(x0-x, x1-x)
+        roi = img[y0:y1, x0:x1]
+        roi[:] = roi * self.inv[sy, sx] + self.pre[sy, sx]
+
+def _color_vec(bgr, channels):
+    # XBGR8888 frames carry a 4th channel; keep it opaque
+    return np.array(bgr + (255,)*(channels-3), dtype=np.float32)[:channels]
+
+def _guideline_sprite(snap, i, w, h, channels):
+    r,g,b = snap[f"guideline{i}.color"]
+    alpha = max(0.0, min(1.0, snap[f"guideline{i}.alpha"]))
+    thick = max(1, int(snap[f"guideline{i}.width"]))
+    sx,sy = snap[f"guideline{i}.start"]
+    ex,ey = snap[f"guideline{i}.end"]
+    p1 = (int(sx*w), int(sy*h)); p2 = (int(ex*w), int(ey*h))
+    pad = thick + 2  # room for the round caps and AA fringe
+    x0 = max(0, min(p1[0], p2[0]) - pad); y0 = max(0, min(p1[1], p2[1]) - pad)
+    x1 = min(w, max(p1[0], p2[0]) + pad); y1 = min(h, max(p1[1], p2[1]) + pad)
+    if alpha <= 0 or x0 >= x1 or y0 >= y1: return None
+    mask = np.zeros((y1-y0, x1-x0), np.uint8)
+    cv2.line(mask, (p1[0]-x0, p1[1]-y0), (p2[0]-x0, p2[1]-y0), 255, thickness=thick, lineType=cv2.LINE_AA)
+    color = np.empty((y1-y0, x1-x0, channels), np.float32)
+    color[:] = _color_vec((b,g,r), channels)
+    return Sprite(x0, y0, color, mask.astype(np.float32) * (alpha/255.0))
+
+def _text_sprite(txt, scale, channels):
+    (tw, th), base = cv2.getTextSize(txt, FONT, scale, 3)
+    ox, oy = 3, th + 3
+    mask = np.zeros((th + base + 6, tw + 6), np.uint8)
+    fg = np.zeros(mask.shape, np.uint8)
+    # black 3px outline under 1px white text, as the old putText pair drew it
+    cv2.putText(mask, txt, (ox, oy), FONT, scale, 255, thickness=3, lineType=cv2.LINE_AA)
+    cv2.putText(fg, txt, (ox, oy), FONT, scale, 255, thickness=1, lineType=cv2.LINE_AA)
+    color = np.repeat(fg[..., None].astype(np.float32), channels, axis=2)
+    if channels > 3: color[..., 3:] = 255
+    # anchor is relative to the baseline origin putText would have used
+    return Sprite(-ox, -oy, color, mask.astype(np.float32) / 255.0)
+
+class Overlay:
+    """Guideline + HUD compositor.
+
+    Guidelines are rendered once into small sprites and only rebuilt when a
+    ``guideline*`` setting or the frame geometry changes; per frame only their
+    bounding boxes are blended. HUD strings are rendered once per distinct
+    text and reused until the displayed value changes.
+    """
+    def __init__(self):
+        self._ver = None
+        self._key = None
+        self._guides = []
+        self._texts = {}
+
+    def _guides_for(self, img, snap):
+        h, w = img.shape[:2]
+        ch = img.shape[2] if img.ndim == 3 else 1
+        if snap.version == self._ver and self._key and self._key[0] == (w, h, ch):
+            return self._guides
+        key = ((w, h, ch),) + tuple(snap.raw.get(k) for k in GUIDE_KEYS)
+        if key != self._key:
+            self._guides = [s for s in (_guideline_sprite(snap, i, w, h, ch) for i in (1,2)) if s]
+            self._key = key
+        self._ver = snap.version
+        return self._guides
+
+    def _text(self, txt, scale, channels):
+        k = (txt, scale, channels)
+        spr = self._texts.get(k)
+        if spr is None:
+            if len(self._texts) >= _TEXT_CACHE_MAX: self._texts.clear()
+            spr = self._texts[k] = _text_sprite(txt, scale, channels)
+        return spr
+
+    def hud_lines(self, snap, st):
+        lines = []
+        if snap.flag("overlay.show_distance") and st.distance_m is not None:
+            t = getattr(st, "distance_t", None)
+            fresh = t is None or time.monotonic() - t <= STALE_S
+            lines.append(f"Dist: {st.distance_m:.1f} m" if fresh else "Dist: --.- m")
+        if snap.flag("overlay.show_battery") and st.batt_pct is not None:
+            lines.append(f"Batt: {st.batt_pct:.0f}% ({(st.voltage or 0):.2f}V)")
+        if snap.flag("overlay.show_cpu") and st.cpu_temp_c is not None:
+            lines.append(f"CPU: {st.cpu_temp_c:.1f}C load {st.cpu_load:.2f}")
+        return lines
+
+    def draw_guidelines(self, img, snap):
+        for spr in self._guides_for(img, snap):
+            spr.blend(img)
+
+    def draw_texts(self, img, snap, st):
+        if not snap.flag("overlay.enabled"): return
+        xnorm, ynorm = snap["overlay.text_pos"]
+        scale = snap["overlay.text_scale"]
+        x = int(xnorm*img.shape[1]); y = int(ynorm*img.shape[0])
+        ch = img.shape[2]
+        for i, txt in enumerate(self.hud_lines(snap, st)):
+            spr = self._text(txt, scale, ch)
+            spr.blend(img, x + spr.x, y + i*int(28*scale) + spr.y)
+
+    def draw(self, img, snap, st):
+        self.draw_guidelines(img, snap)
+        self.draw_texts(img, snap, st)
+
+def geometry(snap, shape):
+    """What ``Overlay.draw`` would draw besides the HUD values, for a client
+    that renders it itself: normalized guideline ends, pixel sizes relative
+    to ``frame``."""
+    h, w = shape[:2]
+    guides = []
+    for i in (1,2):
+        r,g,b = snap[f"guideline{i}.color"]
+        guides.append({"color": "#%02x%02x%02x" % (r,g,b), "alpha": max(0.0, min(1.0, snap[f"guideline{i}.alpha"])),
+                       "width": max(1, int(snap[f"guideline{i}.width"])),
+                       "start": list(snap[f"guideline{i}.start"]), "end": list(snap[f"guideline{i}.end"])})
+    scale = snap["overlay.text_scale"]
+    return {"frame": [w, h], "guides": guides, "text": snap.flag("overlay.enabled"),
+            "text_pos": list(snap["overlay.text_pos"]), "text_scale": scale, "line_px": int(28*scale)}
+
+class OverlayFeed:
+    """Overlay state for clients that draw it themselves (``overlay.mode`` = client).
+
+    ``geometry`` is re-encoded only when the settings or the frame size change;
+    each published frame gets a small HUD message tagged with the same sequence
+    number its MJPEG parts carry in ``X-Frame-Seq``. Nothing is built while no
+    client is subscribed.
+    """
+    def __init__(self, overlay):
+        self.overlay = overlay
+        self.cond = threading.Condition()
+        self.clients = 0
+        self.listeners = []  # fn() called on the publishing thread after each update
+        self.geo, self.geo_ver, self._geo_key = None, 0, None
+        self.hud, self.seq = None, 0
+
+    def publish(self, seq, ts, snap, st, shape):
+        if not self.clients: return
+        key = (snap.version, shape[1], shape[0])
+        geo = json.dumps(geometry(snap, shape)) if key != self._geo_key else None
+        lines = self.overlay.hud_lines(snap, st) if snap.flag("overlay.enabled") else []
+        hud = json.dumps({"seq": seq, "ts": ts, "lines": lines, "distance_m": st.distance_m,
+                          "batt_pct": st.batt_pct, "cpu_temp_c": st.cpu_temp_c, "cpu_load": st.cpu_load})
+        with self.cond:
+            if geo is not None:
+                self.geo, self._geo_key = geo, key
+                self.geo_ver += 1
+            self.hud, self.seq = hud, seq
+            self.cond.notify_all()
+        for fn in self.listeners:
+            fn()
+
+    def take(self, sent):
+        """SSE text for whatever changed since ``sent`` (updated in place), or None."""
+        with self.cond:
+            geo, gv, hud, seq = self.geo, self.geo_ver, self.hud, self.seq
+        out = ""
+        if geo is not None and sent.get("geo") != gv:
+            out += f"event: geometry\ndata: {geo}\n\n"
+            sent["geo"] = gv
+        if hud is not None and sent.get("seq") != seq:
+            out += f"data: {hud}\n\n"
+            sent["seq"] = seq
+        return out or None
+
+    def stream(self):
+        with self.cond:
+            self.clients += 1
+        try:
+            yield "retry: 2000\n\n"
+            sent = {}
+            while True:
+                ev = self.take(sent)
+                if ev is None:
+                    with self.cond:
+                        if not self.cond.wait_for(lambda: self.hud is not None and self.seq != sent.get("seq"),
+                                                  timeout=15.0):
+                            ev = ": ping\n\n"
+                if ev is not None: yield ev
+        finally:
+            with self.cond:
+                self.clients -= 1
+
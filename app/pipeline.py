@@ -0,0 +1,161 @@
+import logging, threading, time, sys, numpy as np
+from . import metrics
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+DROPPED = metrics.Counter("rpicam_frames_dropped_total", "Frames discarded by a full stage queue.", ("queue",))
+
+class DropQueue:
+    """Bounded hand-off between stages; ``put`` never blocks and discards the
+    oldest item when full, so an upstream stage (capture) can't be stalled."""
+    def __init__(self, maxlen=2, name=None):
+        self._q = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self._m_dropped = DROPPED.labels(name) if name else None
+
+    def put(self, item):
+        with self._cond:
+            if len(self._q) == self._q.maxlen:
+                self.dropped += 1
+                if self._m_dropped: self._m_dropped.inc()
+            self._q.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._q, timeout=timeout):
+                return None
+            return self._q.popleft()
+
+    def __len__(self):
+        return len(self._q)
+
+POOL_MISSES = metrics.Counter("rpicam_frame_pool_misses_total", "Frame buffers allocated because every pooled one was in use.")
+
+def readonly(a):
+    """A view of ``a`` that can't be written through; it keeps ``a`` referenced."""
+    v = a.view()
+    v.flags.writeable = False
+    return v
+
+class FramePool:
+    """Preallocated frame buffers reused across captures.
+
+    A buffer is free when nothing outside the pool references it: the
+    interpreter's refcount covers the pipeline's Frame objects as well as every
+    read-only view handed to readers (a view holds its base), so readers never
+    have to release anything. When all buffers are busy a fresh array is
+    returned and counted as a miss, so a stuck reader can't stall capture.
+    """
+    def __init__(self, size=8):
+        self.size = size
+        self.shape = self.dtype = None
+        self._slots = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self.misses = 0
+
+    def _free(self, i):
+        # 2 = the reference from self._slots plus getrefcount's own argument
+        return sys.getrefcount(self._slots[i]) == 2
+
+    def acquire(self, shape, dtype=np.uint8):
+        """A writable buffer of ``shape``; contents are stale, not zeroed."""
+        with self._lock:
+            if shape != self.shape or dtype != self.dtype:
+                self.shape, self.dtype, self._slots = shape, dtype, []
+            n = len(self._slots)
+            for k in range(n):
+                i = (self._next + k) % n
+                if self._free(i):
+                    self._next = i + 1
+                    return self._slots[i]
+            buf = np.empty(shape, dtype)
+            if n < self.size:
+                self._slots.append(buf)
+            else:
+                self.misses += 1
+                POOL_MISSES.inc()
+            return buf
+
+    def stats(self):
+        with self._lock:
+            busy = sum(not self._free(i) for i in range(len(self._slots)))
+            return {"slots": len(self._slots), "busy": busy, "misses": self.misses}
+
+class Frame:
+    __slots__ = ("seq", "img", "lores", "small", "t_capture", "stamps")
+
+    def __init__(self, seq, img, lores=None, t_capture=None):
+        self.seq = seq
+        self.img = img
+        self.lores = lores
+        self.small = None
+        # all stamps are time.monotonic_ns(); t_capture is the sensor timestamp
+        self.t_capture = time.monotonic_ns() if t_capture is None else t_capture
+        self.stamps = {}
+
+    def stamp(self, stage):
+        self.stamps[stage] = time.monotonic_ns()
+
+class LatencyTracker:
+    """Fixed-size per-stage sample rings (ms) with percentile summaries,
+    optionally mirrored into a histogram labelled by stage (seconds)."""
+    def __init__(self, n=512, hist=None):
+        self.n = n
+        self._buf = {}
+        self._idx = {}
+        self._hist = hist
+        self._h = {}
+
+    def add(self, stage, ms):
+        buf = self._buf.get(stage)
+        if buf is None:
+            buf = self._buf[stage] = np.zeros(self.n, np.float32)
+            self._idx[stage] = 0
+            if self._hist is not None: self._h[stage] = self._hist.labels(stage)
+        i = self._idx[stage]
+        buf[i % self.n] = ms
+        self._idx[stage] = i + 1
+        if self._hist is not None: self._h[stage].observe(ms / 1000.0)
+
+    def record(self, frame, order):
+        # per-stage time is the gap to the previous stamp, starting at capture
+        prev = frame.t_capture
+        for stage in order:
+            t = frame.stamps.get(stage)
+            if t is None: continue
+            self.add(stage, (t - prev) / 1e6)
+            prev = t
+        self.add("end_to_end", (prev - frame.t_capture) / 1e6)
+
+    def summary(self):
+        out = {}
+        for stage, buf in list(self._buf.items()):
+            n = min(self._idx[stage], self.n)
+            if not n: continue
+            p50, p90, p99 = np.percentile(buf[:n], (50, 90, 99))
+            out[stage] = {"p50": round(float(p50), 2), "p90": round(float(p90), 2),
+                          "p99": round(float(p99), 2), "max": round(float(buf[:n].max()), 2), "n": n}
+        return out
+
+STAGE_ERRORS = metrics.Counter("rpicam_stage_errors_total", "Items a pipeline stage failed on.", ("stage",))
+
+def stage_thread(name, src, fn, running):
+    # generic stage: pull from src, hand to fn, until running() goes false;
+    # a failing item is logged and counted, never allowed to end the stage
+    errors = STAGE_ERRORS.labels(name)
+    def run():
+        while running():
+            item = src.get(timeout=0.5)
+            if item is None: continue
+            try:
+                fn(item)
+            except Exception:
+                errors.inc()
+                log.exception("%s: stage failed on an item", name)
+    t = threading.Thread(target=run, name=name, daemon=True)
+    t.start()
+    return t
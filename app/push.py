@@ -0,0 +1,104 @@
+import json, threading, time
+
+def _r(v, nd):
+    return None if v is None else round(v, nd)
+
+def stats_fields(s):
+    # rounded to what the UI shows, so sub-display jitter isn't a "change"
+    return {
+        "distance_m": _r(s.distance_m, 1),
+        "led_status": s.led_status,
+        "wifi_ssid": s.wifi_ssid,
+        "wifi_rssi": s.wifi_rssi,
+        "cpu_temp_c": _r(s.cpu_temp_c, 1),
+        "cpu_load": _r(s.cpu_load, 2),
+        "battery_pct": _r(s.batt_pct, 1),
+        "voltage": _r(s.voltage, 3), "current": _r(s.current, 3), "power": _r(s.power, 3),
+        "lux": _r(s.lux_approx, 0),
+        "tier": getattr(s, "tier", None),
+    }
+
+def parse_limits(txt):
+    # "field=seconds,field=seconds" -> {field: seconds}
+    out = {}
+    for part in str(txt or "").split(','):
+        k, _, v = part.partition('=')
+        try:
+            out[k.strip()] = float(v)
+        except ValueError:
+            pass
+    return out
+
+class StatsHub:
+    """Shares one serialized stats snapshot per sensor tick with every SSE client.
+
+    ``publish`` JSON-encodes only the fields whose value changed and tags them
+    with the hub version; each subscriber sends the fields it hasn't sent yet,
+    subject to its per-field minimum interval.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.clients = 0
+        self._vals = {}
+        self._enc = {}  # field -> (json fragment, version it changed at)
+        self.listeners = []  # fn() called on the publishing thread after a change
+
+    def publish(self, state):
+        fields = stats_fields(state)
+        with self.cond:
+            ver = self.version + 1
+            changed = False
+            for k, v in fields.items():
+                if k not in self._vals or self._vals[k] != v:
+                    self._vals[k] = v
+                    self._enc[k] = (json.dumps(v), ver)
+                    changed = True
+            if changed:
+                self.version = ver
+                self.cond.notify_all()
+        if changed:
+            for fn in self.listeners:
+                fn()
+
+    def take(self, sent, limits, now):
+        """Fields this subscriber hasn't sent yet, as an SSE event (or None), and
+        the seconds until a rate-limited one comes due (or None). ``sent`` is the
+        subscriber's {field: (version, time)} and is updated in place."""
+        with self.cond:
+            enc = dict(self._enc)
+        parts, wait = [], None
+        for k, (frag, ver) in enc.items():
+            last_ver, last_t = sent.get(k, (0, -1e9))
+            if ver <= last_ver: continue
+            due = last_t + limits.get(k, 0.0)
+            if now >= due:
+                parts.append(f'"{k}":{frag}')
+                sent[k] = (ver, now)
+            else:  # rate-limited: come back for it when it's due
+                wait = min(wait or 1e9, due - now)
+        return ("data: {" + ",".join(parts) + "}\n\n" if parts else None), wait
+
+    def stream(self, limits=None, heartbeat_s=15.0):
+        limits = limits or {}
+        sent = {}  # field -> (version, monotonic time) last sent
+        seen = -1
+        with self.cond:
+            self.clients += 1
+        try:
+            yield "retry: 2000\n\n"
+            wait = None
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.version != seen, timeout=wait or heartbeat_s)
+                    seen = self.version
+                event, wait = self.take(sent, limits, time.monotonic())
+                if event:
+                    yield event
+                elif wait is None:
+                    yield ": ping\n\n"
+        finally:
+            with self.cond:
+                self.clients -= 1
+
+HUB = StatsHub()
@@ -0,0 +1,206 @@
+import os, threading, queue, struct, time
+from collections import deque
+from . import settings, telemetry
+from .sensors import get_state
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# index record per frame: wall ts (s), segment number, byte offset, size
+IDX = struct.Struct("<dHQI")
+
+def clips_dir(snap=None):
+    snap = snap or settings.snapshot()
+    return snap.raw.get("record.dir") or os.path.join(ROOT, "clips")
+
+class ClipWriter(threading.Thread):
+    """Appends queued JPEG frames to a clip's segment files plus its index.
+
+    Takes ("open", clip), ("frame", clip, ts, jpeg) and ("close", clip)
+    messages, so nothing but the ring buffer ever has to be held in RAM.
+    Frames are dropped when the queue is full; open/close never are. The
+    clip's row is inserted at open and updated at each segment and at close,
+    and every frame is flushed, so a power cut leaves a listed, playable clip.
+    """
+    def __init__(self):
+        super().__init__(daemon=True, name="clip-writer")
+        self.q = queue.Queue(maxsize=2000)
+        self.dropped = 0
+        self.errors = 0
+
+    def put(self, msg):
+        if msg[0] != "frame":
+            self.q.put(msg)  # waits for room rather than leave a clip half-open
+            return
+        try:
+            self.q.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def _open_segment(self, clip):
+        f, clip["f"] = clip.get("f"), None
+        if f: f.close()
+        clip["seg"] = clip.get("seg", -1) + 1
+        clip["f"] = open(os.path.join(clip["path"], f"seg-{clip['seg']:03d}.mjpeg"), "ab")
+        clip["off"] = clip["f"].tell()  # offsets stay right even if the file already had data
+        self._row(clip)
+        if clip["seg"]: self._prune(settings.snapshot())  # a long clip grows the directory too
+
+    def _row(self, clip):
+        telemetry.submit("clip", (clip["id"], clip["start"], clip["end"], clip["reason"],
+                                  clip["frames"], clip["bytes"], clip["path"]))
+
+    @staticmethod
+    def _remove(d):
+        for e in os.scandir(d): os.remove(e.path)
+        os.rmdir(d)
+
+    def _prune(self, snap):
+        # oldest clips go first once the directory exceeds record.max_disk_mb
+        root = clips_dir(snap)
+        cap = snap["record.max_disk_mb"] * 1024 * 1024
+        clips = []
+        for name in sorted(os.listdir(root)):
+            d = os.path.join(root, name)
+            if os.path.isdir(d):
+                clips.append((name, d, sum(e.stat().st_size for e in os.scandir(d))))
+        total = sum(c[2] for c in clips)
+        for name, d, size in clips[:-1]:
+            if total <= cap: break
+            self._remove(d)
+            telemetry.submit("clip_delete", (name,))
+            total -= size
+
+    def _handle(self, kind, clip, msg):
+        if kind == "open":
+            os.makedirs(clip["path"], exist_ok=True)
+            clip["idx"] = open(os.path.join(clip["path"], "index.bin"), "ab")
+            self._open_segment(clip)
+        elif kind == "frame":
+            if clip.get("f") is None or clip.get("idx") is None:  # its open failed
+                self.dropped += 1
+                return
+            ts, jpeg = msg[2], msg[3]
+            if clip["off"] + len(jpeg) > clip["seg_bytes"]:
+                self._open_segment(clip)
+            clip["f"].write(jpeg)
+            clip["f"].flush()  # data before the index entry that points at it
+            clip["idx"].write(IDX.pack(ts, clip["seg"], clip["off"], len(jpeg)))
+            clip["idx"].flush()
+            clip["off"] += len(jpeg)
+            clip["frames"] += 1
+            clip["bytes"] += len(jpeg)
+            clip["end"] = ts
+        elif kind == "close":
+            for k in ("f", "idx"):
+                f, clip[k] = clip.get(k), None
+                if f: f.close()
+            if clip["frames"]:
+                self._row(clip)
+            else:  # nothing made it to disk
+                telemetry.submit("clip_delete", (clip["id"],))
+                if os.path.isdir(clip["path"]): self._remove(clip["path"])
+            self._prune(settings.snapshot())
+
+    def run(self):
+        while True:
+            msg = self.q.get()
+            try:
+                self._handle(msg[0], msg[1], msg)
+            except (OSError, ValueError):
+                self.errors += 1  # disk full/gone; later messages try again
+
+class ClipRecorder(threading.Thread):
+    """Keeps the last ``record.pre_s`` seconds of encoded frames in a byte-capped
+    ring and turns them, plus ``record.post_s`` more, into a clip on disk when
+    a motion event starts or the distance drops below ``warning.threshold_m``.
+    A clip ends ``record.post_s`` after the last trigger, or at ``record.max_clip_s``.
+
+    Frames come from the stream broadcaster of ``record.profile``, so recording
+    reuses the stream's JPEGs instead of encoding again.
+    """
+    def __init__(self, cam):
+        super().__init__(daemon=True, name="clip-recorder")
+        self.cam = cam
+        self.ring = deque()
+        self.ring_bytes = 0
+        self.clip = None
+        self.writer = ClipWriter()
+        self._stop = threading.Event()
+        self._pending = None  # reason of a trigger not yet handled by the loop
+        self._near = False    # inside the proximity zone; only entering it triggers
+
+    def stop(self):
+        self._stop.set()
+
+    def on_motion(self, ev):
+        if ev.end is None:
+            self._pending = self._pending or "motion"
+
+    def _trigger(self, reason, snap, now):
+        until = now + snap["record.post_s"]
+        if self.clip is not None:
+            self.clip["until"] = max(self.clip["until"], until)
+            return
+        # ms in the id: a clip may close and the next start within the same second
+        cid = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}-{reason}"
+        start = self.ring[0][0] if self.ring else now
+        self.clip = {"id": cid, "path": os.path.join(clips_dir(snap), cid), "reason": reason,
+                     "start": start, "end": start, "until": until, "frames": 0, "bytes": 0,
+                     "seg_bytes": int(snap["record.segment_mb"] * 1024 * 1024)}
+        self.writer.put(("open", self.clip))
+        for ts, jpeg in self.ring:  # pre-event footage
+            self.writer.put(("frame", self.clip, ts, jpeg))
+
+    def _push(self, ts, jpeg, snap):
+        self.ring.append((ts, jpeg))
+        self.ring_bytes += len(jpeg)
+        cap = snap["record.buffer_mb"] * 1024 * 1024
+        horizon = ts - snap["record.pre_s"]
+        while self.ring and (self.ring_bytes > cap or self.ring[0][0] < horizon):
+            self.ring_bytes -= len(self.ring.popleft()[1])
+
+    def run(self):
+        self.writer.start()
+        b = self.cam.broadcaster(settings.get("record.profile", "full"))
+        frames = b.frames(viewer=False)
+        for seq, ts, part, jpeg in frames:
+            if self._stop.is_set(): break
+            jpeg = b.take(seq, jpeg)  # kept for seconds; a ring slot won't be
+            if jpeg is None: continue
+            snap = settings.snapshot()
+            if not snap.flag("record.enabled"):
+                self.ring.clear(); self.ring_bytes = 0
+                if self.clip is not None:  # switched off mid-clip
+                    self.writer.put(("close", self.clip))
+                    self.clip = None
+                continue
+            st = get_state()
+            near = st.distance_m is not None and st.distance_m < snap["warning.threshold_m"]
+            if near and not self._near:
+                self._pending = self._pending or "proximity"
+            self._near = near
+            if self._pending:
+                self._trigger(self._pending, snap, ts)
+                self._pending = None
+            if self.clip is not None:
+                self.writer.put(("frame", self.clip, ts, jpeg))
+                if ts >= min(self.clip["until"], self.clip["start"] + snap["record.max_clip_s"]):
+                    self.writer.put(("close", self.clip))
+                    self.clip = None
+            self._push(ts, jpeg, snap)
+        frames.close()
+
+    def stats(self):
+        return {"ring_frames": len(self.ring), "ring_mb": round(self.ring_bytes / 1048576, 2),
+                "recording": None if self.clip is None else self.clip["id"], "writer_dropped": self.writer.dropped,
+                "writer_errors": self.writer.errors}
+
+def read_index(path):
+    with open(os.path.join(path, "index.bin"), "rb") as f:
+        data = f.read()
+    return [IDX.unpack_from(data, i) for i in range(0, len(data) - len(data) % IDX.size, IDX.size)]
+
+def read_frame(path, entry):
+    _, seg, off, size = entry
+    with open(os.path.join(path, f"seg-{seg:03d}.mjpeg"), "rb") as f:
+        f.seek(off)
+        return f.read(size)
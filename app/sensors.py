@@ -1,15 +1,7 @@
-import threading, time, math, subprocess, os, psutil
-from . import settings
-from piina219 import INA219 as _INA219  # alias, but we’ll fallback if not found
-try:
-    from ina219 import INA219  # pi-ina219 naming
-except Exception:
-    INA219 = _INA219  # either way
-import board, busio
-try:
-    import adafruit_vl53l1x
-except Exception:
-    adafruit_vl53l1x = None
+import logging, threading, time, math, heapq, psutil
+from . import settings, telemetry
+from .push import HUB
+from . import wifi, hw, metrics, trace
 import numpy as np
 
 class SensorState:
@@ -18,17 +10,105 @@ class SensorState:
         self.current = None
         self.power = None
         self.batt_pct = None
-        self.distance_m = None
+        self.distance_m = None   # filtered
+        self.distance_t = None   # time.monotonic() of the reading behind distance_m
         self.cpu_temp_c = None
         self.cpu_load = None
         self.wifi_ssid = None
         self.wifi_rssi = None
         self.led_status = "off"
         self.lux_approx = None  # 0..255 (mean luma)
+        self.tier = None        # performance tier picked by the governor
         self.ap_mode = False
 
 S = SensorState()
 
+class Ring:
+    """Fixed-size ring of (monotonic t, value) samples.
+
+    Single writer; readers never lock: a slot is only reused ``n`` pushes
+    later and the index is bumped after the slot is written. Pushes to a ring
+    with a trace channel ``ch`` are also appended to the trace while it's on.
+    """
+    def __init__(self, n=256, ch=None):
+        self.n = n
+        self.ch = ch
+        self.t = np.zeros(n)
+        self.v = np.full(n, np.nan)
+        self.i = 0
+
+    def push(self, t, v):
+        j = self.i % self.n
+        self.t[j] = t
+        self.v[j] = np.nan if v is None else v
+        self.i += 1
+        w = trace.writer  # read once: tracing may be switched off meanwhile
+        if w is not None and self.ch is not None: w.write(self.ch, t, v)
+
+    def latest(self):
+        i = self.i
+        if not i: return None, None
+        j = (i - 1) % self.n
+        v = float(self.v[j])
+        return (None if math.isnan(v) else v), float(self.t[j])
+
+    def last(self, k):
+        i = self.i
+        k = min(k, i, self.n)
+        idx = np.arange(i - k, i) % self.n
+        return self.t[idx], self.v[idx]
+
+_watchers = []
+
+def watch(event):
+    """Have ``event`` set after every new reading (used to wake the LED renderer)."""
+    _watchers.append(event)
+
+RINGS = {name: Ring(ch=trace.CH[name])
+         for name in ("distance_raw", "distance", "voltage", "current", "power", "cpu_temp_c", "cpu_load")}
+
+def latest(name):
+    """(value, age in s) of the newest sample in ring ``name``; (None, None) if empty."""
+    v, t = RINGS[name].latest()
+    return (v, None) if t is None else (v, time.monotonic() - t)
+
+class MedianFilter:
+    def __init__(self, n=5):
+        self.n = max(1, int(n))
+
+    def __call__(self, ring, t, z):
+        _, v = ring.last(self.n)
+        v = v[~np.isnan(v)]
+        return float(np.median(v)) if len(v) else None
+
+class KalmanFilter:
+    # constant-position model: q = process noise (m^2/s), r = measurement noise (m^2)
+    def __init__(self, q=0.25, r=0.0009):
+        self.q, self.r = q, r
+        self.x = None
+        self.p = 1.0
+        self.t = None
+
+    def __call__(self, ring, t, z):
+        if z is None: return self.x
+        if self.x is None:
+            self.x, self.p, self.t = z, self.r, t
+            return z
+        self.p += self.q * max(0.0, t - self.t)
+        k = self.p / (self.p + self.r)
+        self.x += k * (z - self.x)
+        self.p *= (1 - k)
+        self.t = t
+        return self.x
+
+def make_filter(snap):
+    kind = snap.raw.get("distance.filter", "median")
+    if kind == "kalman":
+        return KalmanFilter(snap["distance.kalman_q"], snap["distance.kalman_r"])
+    if kind == "median":
+        return MedianFilter(snap["distance.filter_n"])
+    return lambda ring, t, z: z
+
 def _read_cpu_temp():
     try:
         with open("/sys/class/thermal/thermal_zone0/temp","r") as f:
@@ -36,81 +116,203 @@ def _read_cpu_temp():
     except Exception:
         return None
 
-def _read_wifi_info():
-    ssid, rssi = None, None
-    try:
-        out = subprocess.check_output(["nmcli","-t","-f","ACTIVE,SSID,SIGNAL","dev","wifi"], text=True, timeout=2)
-        for line in out.strip().splitlines():
-            active, s, sig = line.split(':', 2)
-            if active == "yes":
-                ssid, rssi = s, int(sig)
-                break
-    except Exception:
-        pass
-    return ssid, rssi
-
 def _map_pct(v, vmin, vmax):
     if v is None: return None
     return float(max(0.0, min(100.0, ( (v - vmin) / max(0.01, (vmax - vmin)) ) * 100.0)))
 
+def notify():
+    """Push ``S`` to stats subscribers and wake the LED renderer."""
+    HUB.publish(S)
+    for ev in _watchers:
+        ev.set()
+
+def apply(name, now, v):
+    """One sample for ring ``name`` as if just read (trace replay); True if ``S`` changed."""
+    ring = RINGS.get(name)
+    if ring is not None: ring.push(now, v)
+    if name == "distance":
+        S.distance_m, S.distance_t = v, now
+    elif name in ("voltage", "current", "power", "cpu_temp_c", "cpu_load"):
+        setattr(S, name, v)
+        if name == "voltage":
+            snap = settings.snapshot()
+            S.batt_pct = _map_pct(v, snap["battery.v_min"], snap["battery.v_max"])
+    elif name == "lux":
+        if v is not None: S.lux_approx = v
+    else:
+        return False
+    return True
+
+# VL53L1X timing budgets (ms) the driver accepts
+_TOF_BUDGETS = (15, 20, 33, 50, 100, 200, 500)
+
+READ_SECONDS = metrics.Histogram("rpicam_sensor_read_seconds", "Time per sensor task run.", ("device",))
+READ_ERRORS = metrics.Counter("rpicam_sensor_errors_total", "Sensor task runs that raised.", ("device",))
+log = logging.getLogger(__name__)
+metrics.Gauge("rpicam_cpu_temp_celsius", "SoC temperature.", fn=lambda: S.cpu_temp_c)
+metrics.Gauge("rpicam_battery_volts", "Battery voltage from the INA219.", fn=lambda: S.voltage)
+
+class Task:
+    __slots__ = ("name", "period", "fn", "next_t", "last_ms", "runs", "errors", "hist", "failed")
+
+    def __init__(self, name, hz, fn):
+        self.name, self.fn = name, fn
+        self.period = 1.0 / max(0.01, hz)
+        self.next_t = 0.0
+        self.last_ms = None
+        self.runs = self.errors = 0
+        self.hist = READ_SECONDS.labels(name)
+        self.failed = READ_ERRORS.labels(name)
+
 class SensorThread(threading.Thread):
-    def __init__(self, cam_ref):
+    """Polls every source at its own rate (``sensors.*_hz``) from one thread.
+
+    Tasks sit in a heap keyed on their next due time; each is rescheduled on
+    its own grid so rates don't drift. Readings land in ``RINGS`` with a
+    monotonic timestamp and are mirrored onto ``S`` for existing readers.
+    """
+    def __init__(self, lux_ref):
         super().__init__(daemon=True)
         self._stop = threading.Event()
-        self.cam_ref = cam_ref
-        self._i2c = busio.I2C(board.SCL, board.SDA)
+        self.lux_ref = lux_ref
+        # a missing bus or chip drops its tasks instead of the whole thread, and is
+        # named in ``degraded`` (the sensors subsystem shows "degraded" in /readyz)
+        missing = []
+        try:
+            self._i2c = hw.i2c()
+        except Exception as e:
+            self._i2c = None
+            missing.append(f"i2c: {type(e).__name__}: {e}")
         # INA219 @ 0x43
-        self._ina = INA219(shunt_ohms=0.1, address=0x43, busnum=None)
-        self._ina.configure()
+        try:
+            self._ina = hw.ina219(0x43)
+            self._ina.configure()
+        except Exception as e:
+            self._ina = None
+            missing.append(f"ina219: {type(e).__name__}: {e}")
+        snap = settings.snapshot()
         # VL53L1X @ 0x29
-        if adafruit_vl53l1x:
-            self._tof = adafruit_vl53l1x.VL53L1X(self._i2c)
-            self._tof.start_ranging()
+        self._tof = None
+        if self._i2c is None:
+            missing.append("tof: no i2c bus")
         else:
-            self._tof = None
+            try:
+                self._tof = hw.vl53l1x(self._i2c)
+                # longest budget that still fits the polling period: best accuracy for the rate
+                period_ms = 1000.0 / max(1.0, snap["sensors.tof_hz"])
+                try:
+                    self._tof.timing_budget = max([b for b in _TOF_BUDGETS if b <= period_ms] or [_TOF_BUDGETS[0]])
+                except Exception:
+                    pass
+                self._tof.start_ranging()
+            except Exception as e:
+                self._tof = None
+                missing.append(f"tof: {type(e).__name__}: {e}")
+        self.degraded = "; ".join(missing) or None
+        self._filter = make_filter(snap)
+        self._filter_ver = snap.version
+        self._last_batt_log = 0
+        self.tasks = [
+            Task("cpu_temp", snap["sensors.temp_hz"], self._read_temp),
+            Task("cpu_load", snap["sensors.load_hz"], self._read_load),
+            Task("misc", snap["sensors.misc_hz"], self._read_misc),
+        ]
+        if self._ina:
+            self.tasks.insert(0, Task("ina219", snap["sensors.ina_hz"], self._read_ina))
+        if self._tof:
+            self.tasks.insert(0, Task("tof", snap["sensors.tof_hz"], self._read_tof))
 
     def stop(self): self._stop.set()
 
+    def _read_tof(self, now):
+        try:
+            if not self._tof.data_ready:
+                return False
+            mm = self._tof.distance
+            self._tof.clear_interrupt()
+            z = None if mm is None else max(0.0, mm/1000.0)
+        except Exception:
+            z = None
+        snap = settings.snapshot()
+        if snap.version != self._filter_ver:
+            self._filter, self._filter_ver = make_filter(snap), snap.version
+        RINGS["distance_raw"].push(now, z)
+        d = self._filter(RINGS["distance_raw"], now, z) if z is not None else None
+        RINGS["distance"].push(now, d)
+        S.distance_m, S.distance_t = d, now
+        return True
+
+    def _read_ina(self, now):
+        try:
+            S.voltage = self._ina.voltage()  # V
+            S.current = self._ina.current() / 1000.0  # A (library returns mA)
+            S.power   = self._ina.power() / 1000.0    # W (mW -> W)
+        except Exception:
+            S.voltage = S.current = S.power = None  # no reading beats a stale one
+        for k in ("voltage", "current", "power"):
+            RINGS[k].push(now, getattr(S, k))
+        snap = settings.snapshot()
+        S.batt_pct = _map_pct(S.voltage, snap["battery.v_min"], snap["battery.v_max"])
+
+        # periodic battery history (1 min)
+        ts = int(time.time())
+        if ts - self._last_batt_log >= 60 and S.batt_pct is not None:
+            telemetry.log_battery(ts, S.batt_pct, S.voltage or 0, S.current or 0, S.power or 0)
+            self._last_batt_log = ts
+        return True
+
+    def _read_temp(self, now):
+        S.cpu_temp_c = _read_cpu_temp()
+        RINGS["cpu_temp_c"].push(now, S.cpu_temp_c)
+        return True
+
+    def _read_load(self, now):
+        S.cpu_load = psutil.getloadavg()[0]
+        RINGS["cpu_load"].push(now, S.cpu_load)
+        return True
+
+    def _read_misc(self, now):
+        # cached by the Wi-Fi monitor; never spawns nmcli from here
+        S.wifi_ssid, S.wifi_rssi, S.ap_mode = wifi.MONITOR.ssid, wifi.MONITOR.rssi, wifi.MONITOR.ap_mode
+        # Approx "lux": mean luma (0..255) from the camera's analysis lane
+        lux = self.lux_ref() if self.lux_ref else None
+        if lux is not None:
+            S.lux_approx = lux
+            trace.record(trace.CH["lux"], now, lux)
+        return True
+
     def run(self):
-        last_batt_log = 0
+        now = time.monotonic()
+        heap = []
+        for i, t in enumerate(self.tasks):
+            t.next_t = now
+            heap.append((now, i))
+        heapq.heapify(heap)
         while not self._stop.is_set():
+            due, i = heap[0]
+            dt = due - time.monotonic()
+            if dt > 0:
+                self._stop.wait(dt)
+                continue
+            t = self.tasks[i]
+            t0 = time.monotonic()
             try:
-                S.voltage = self._ina.voltage()  # V
-                S.current = self._ina.current() / 1000.0  # A (library returns mA)
-                S.power   = self._ina.power() / 1000.0    # W (mW -> W)
+                if t.fn(t0): notify()
             except Exception:
-                pass
-
-            vmin = float(settings.get("battery.v_min", 3.3))
-            vmax = float(settings.get("battery.v_max", 4.2))
-            S.batt_pct = _map_pct(S.voltage, vmin, vmax)
-
-            # Distance (in meters, 1 decimal place)
-            if self._tof:
-                try:
-                    mm = self._tof.distance
-                    S.distance_m = None if mm is None else max(0.0, mm/1000.0)
-                except Exception:
-                    S.distance_m = None
-
-            S.cpu_temp_c = _read_cpu_temp()
-            l1, l5, l15 = psutil.getloadavg()
-            S.cpu_load = l1
-            S.wifi_ssid, S.wifi_rssi = _read_wifi_info()
-
-            # Approx "lux": pull from camera mean luma (0..255)
-            frm = self.cam_ref() if self.cam_ref else None
-            if frm is not None:
-                gray = np.mean(0.2126*frm[:,:,2] + 0.7152*frm[:,:,1] + 0.0722*frm[:,:,0])
-                S.lux_approx = float(gray)
-
-            # periodic battery history (1 min)
-            now = int(time.time())
-            if now - last_batt_log >= 60 and S.batt_pct is not None:
-                settings.log_battery(now, S.batt_pct, S.voltage or 0, S.current or 0, S.power or 0)
-                last_batt_log = now
-
-            time.sleep(0.5)
+                # one bad read must not end polling for every sensor; the task keeps its slot
+                t.errors += 1
+                t.failed.inc()
+                if t.errors & (t.errors - 1) == 0:  # 1st, 2nd, 4th, ... failure
+                    log.exception("sensor task %s failed (%d so far)", t.name, t.errors)
+            took = time.monotonic() - t0
+            t.hist.observe(took)
+            t.last_ms = took * 1000.0
+            t.runs += 1
+            # stay on the task's own grid; if we fell a whole period behind, skip ahead
+            t.next_t += t.period
+            if t.next_t < t0:
+                t.next_t = t0 + t.period
+            heapq.heapreplace(heap, (t.next_t, i))
 
 def get_state():
     return S
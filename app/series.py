@@ -0,0 +1,53 @@
+import time
+from . import settings
+
+_VAL_KEY = {"battery": "pct", "motion": "m"}
+
+def lttb(pts, n, key):
+    """Largest-Triangle-Three-Buckets downsampling of ``[{"t":..., key:...}]``."""
+    if n >= len(pts) or n < 3:
+        return pts
+    out = [pts[0]]
+    every = (len(pts) - 2) / (n - 2)
+    a = 0
+    for i in range(n - 2):
+        # average of the next bucket is the third triangle corner
+        s, e = int((i + 1) * every) + 1, min(int((i + 2) * every) + 1, len(pts))
+        nxt = pts[s:e] or pts[-1:]
+        avg_t = sum(p["t"] for p in nxt) / len(nxt)
+        avg_v = sum(p[key] for p in nxt) / len(nxt)
+        lo, hi = int(i * every) + 1, int((i + 1) * every) + 1
+        at, av = pts[a]["t"], pts[a][key]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            p = pts[j]
+            area = abs((at - avg_t) * (p[key] - av) - (at - p["t"]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(pts[best])
+        a = best
+    out.append(pts[-1])
+    return out
+
+def pick_res(series, span_s, points):
+    # coarsest rollup that still has a bucket for every output point; raw rows otherwise
+    if not points: return 0
+    for res in reversed(settings.ROLLUP_RES):
+        if span_s / res >= points:
+            return res
+    return 0
+
+def query(series, minutes, since=None, points=None):
+    span = minutes * 60 if not since else max(0, time.time() - since)
+    res = pick_res(series, min(span, minutes * 60), points)
+    key = _VAL_KEY[series]
+    if res:
+        pts = [{"t": b, key: avg, "min": lo, "max": hi}
+               for b, avg, lo, hi in settings.get_rollup(series, res, minutes, since)]
+    elif series == "battery":
+        pts = settings.get_battery_series(minutes, since)
+    else:
+        pts = settings.get_motion_series(minutes, since)
+    if points:
+        pts = lttb([p for p in pts if p[key] is not None], points, key)
+    return res, pts
@@ -1,14 +1,39 @@
-import sqlite3, os, json, threading, time
+import sqlite3, os, threading, time
+from types import MappingProxyType
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'db', 'settings.db')
-DB_PATH = os.path.abspath(DB_PATH)
+DB_PATH = os.path.abspath(os.environ.get("RPICAM_DB", DB_PATH))
 _lock = threading.RLock()
 
 DEFAULTS = {
     # Camera & overlays
     "camera.resolution": "1280x720",
     "camera.framerate": "30",
-    "camera.rotation": "0",              # 0 or 180
+    "camera.rotation": "0",              # 0, 90, 180 or 270 (clockwise)
+    "camera.flip": "none",               # none | h (mirror) | v | hv, applied after rotation
+    "camera.crop": "",                   # normalized x0,y0,x1,y1 of the sensor image, scaled to fill the frame
+    "camera.undistort": "0",             # 1 = correct lens distortion with the values below
+    "camera.intrinsics": "",             # fx,fy,cx,cy in pixels at camera.calib_size (cv2.calibrateCamera)
+    "camera.distortion": "",             # k1,k2,p1,p2[,k3]
+    "camera.calib_size": "1280x720",     # resolution the intrinsics were measured at
+    "camera.undistort_alpha": "0",       # 0 = crop to valid pixels, 1 = keep every source pixel
+    "camera.lores": "0",                 # 1 = feed analysis from Picamera2's lores stream
+
+    # Analysis lane (motion, lux)
+    "analysis.size": "160x90",
+    "analysis.fps": "15",
+
+    # Motion engine (runs on the analysis lane)
+    "motion.grid": "8x6",                # cols x rows, at most 63 cells
+    "motion.zones": "",                  # "x0,y0,x1,y1;..." normalized, empty = whole frame
+    "motion.pixel_threshold": "25",      # luma delta vs background
+    "motion.cell_threshold": "0.05",     # changed-pixel fraction for a cell to count as active
+    "motion.bg_alpha": "0.05",           # background running-average rate
+    "motion.on_pct": "2.0",              # event starts at this zone magnitude (%)
+    "motion.off_pct": "1.0",             # ...and ends after staying below this
+    "motion.hold_s": "1.0",              # ...for this long
+
     "overlay.enabled": "1",
+    "overlay.mode": "burned",            # burned: drawn into frames; client: browsers draw it
     "overlay.text_pos": "0.02,0.10",     # normalized x,y
     "overlay.text_scale": "1.0",
     "overlay.show_cpu": "1",
@@ -31,6 +56,17 @@ DEFAULTS = {
     # Distance & warnings
     "distance.min_m": "0.2",
     "distance.max_m": "4.0",
+    "distance.filter": "median",         # median | kalman | none
+    "distance.filter_n": "5",            # median window (samples)
+    "distance.kalman_q": "0.25",         # process noise (m^2/s)
+    "distance.kalman_r": "0.0009",       # measurement noise (m^2)
+
+    # Sensor polling rates (Hz)
+    "sensors.tof_hz": "25",
+    "sensors.ina_hz": "2",
+    "sensors.temp_hz": "1",
+    "sensors.load_hz": "1",
+    "sensors.misc_hz": "2",              # Wi-Fi/lux copies from their caches
     "warning.freq_min_hz": "0.1",
     "warning.freq_max_hz": "20.0",
     "warning.enabled": "1",
@@ -52,22 +88,148 @@ DEFAULTS = {
     "battery.shutdown_enabled": "0",
     "battery.shutdown_voltage": "3.4",
 
+    # Clip recording (pre-event ring buffer of encoded frames)
+    "record.enabled": "1",
+    "record.profile": "full",            # stream profile whose JPEGs are recorded
+    "record.pre_s": "10",
+    "record.post_s": "10",
+    "record.max_clip_s": "120",          # a clip closes here even if triggers keep coming
+    "record.buffer_mb": "48",            # RAM cap for the pre-event ring
+    "record.segment_mb": "32",
+    "record.max_disk_mb": "2048",
+    "record.dir": "",                    # empty = <repo>/clips
+
+    # Live stream: per-client adaptation of quality, size and fps
+    "stream.adaptive": "1",
+    "stream.target_latency_ms": "300",   # frame age + socket queueing delay
+    "stream.min_fps": "2",
+
+    # Performance governor: tier thresholds are "balanced,eco,critical"
+    "governor.enabled": "1",
+    "governor.temp_c": "70,76,82",
+    "governor.temp_hyst_c": "5",
+    "governor.batt_pct": "35,20,10",
+    "governor.batt_hyst_pct": "5",
+    "governor.load": "1.5",              # 1-min load per core that costs one tier
+    "governor.idle_tier": "balanced",    # tier floor while nobody is watching
+    "governor.dwell_s": "15",            # calm time before each step back up
+
+    # Full-rate sensor/motion trace (memory-mapped files, rotated by size)
+    "trace.enabled": "0",
+    "trace.dir": "",                     # empty = <repo>/traces
+    "trace.file_mb": "64",
+    "trace.keep": "8",                   # newest files kept
+
+    # Live stats push (SSE): per-field minimum interval in seconds
+    "push.min_interval_s": "cpu_temp_c=2,cpu_load=2,wifi_rssi=5,battery_pct=5,voltage=1,current=1,power=1,lux=1",
+
     # Wi-Fi
     "wifi.ap.ssid": "RPiCam",
     "wifi.ap.password": "raspberry",
     "wifi.fallback_timeout_s": "30",
     "wifi.try_known_timeout_s": "30",
+    "wifi.scan_ttl_s": "20",
 
     # Logging windows
-    "metrics.battery_log_minutes": "240"  # 4 hours
+    "metrics.battery_log_minutes": "240", # 4 hours
+    "metrics.retention_hours": "24",      # motion samples/events
 }
 
 def _conn():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     return sqlite3.connect(DB_PATH)
 
+def _parse(v):
+    # "#RRGGBB" -> (r,g,b), "x,y" -> (x,y), "WxH" -> (w,h), numbers -> float
+    v = str(v).strip()
+    try:
+        if v.startswith('#') and len(v) == 7:
+            return (int(v[1:3], 16), int(v[3:5], 16), int(v[5:7], 16))
+        if ',' in v:
+            return tuple(float(x) for x in v.split(','))
+        if 'x' in v:
+            return tuple(int(x) for x in v.split('x'))
+        return float(v)
+    except ValueError:
+        return v
+
+# rollup bucket widths (s) and the raw column each rolled-up series comes from
+ROLLUP_RES = (60, 600, 3600)
+ROLLUP_SRC = {"battery": ("sensor_log", "batt_pct"), "motion": ("motion_events", "magnitude")}
+
+_DEFAULTS_PARSED = {k: _parse(v) for k, v in DEFAULTS.items()}
+
+def _typed(k, v):
+    val = _parse(v)
+    dflt = _DEFAULTS_PARSED.get(k)
+    if dflt is None or isinstance(dflt, str):
+        return val
+    # a malformed value must never reach the hot loops; fall back to the default
+    if type(val) is not type(dflt) or (isinstance(val, tuple) and len(val) != len(dflt)):
+        return dflt
+    return val
+
+class Snapshot:
+    """Immutable, typed view of every setting at one version.
+
+    Hot loops grab ``snapshot()`` once per iteration and read from it without
+    locking; ``set_many`` publishes a new instance instead of mutating this one.
+    """
+    __slots__ = ("version", "raw", "_val")
+
+    def __init__(self, version, raw):
+        self.version = version
+        self.raw = MappingProxyType(dict(raw))
+        self._val = MappingProxyType({k: _typed(k, v) for k, v in raw.items()})
+
+    def __getitem__(self, k):
+        return self._val[k]
+
+    def get(self, k, fallback=None):
+        return self._val.get(k, fallback)
+
+    def flag(self, k):
+        return self.raw.get(k) == "1"
+
+_snap = None
+_watchers = []
+
+def watch(event):
+    """Have ``event`` set whenever a new snapshot is published."""
+    _watchers.append(event)
+
+def _publish(raw):
+    # single reference assignment, so readers see either the old or the new snapshot
+    global _snap
+    _snap = Snapshot((_snap.version + 1) if _snap else 1, raw)
+    for ev in _watchers:
+        ev.set()
+    return _snap
+
+def reload():
+    with _lock, _conn() as c:
+        try:
+            rows = c.execute("SELECT k,v FROM settings", ()).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        raw = dict(DEFAULTS)
+        raw.update(rows)
+        return _publish(raw)
+
+def mirror(raw):
+    """Publish ``raw`` as the current settings without touching the DB; the
+    capture worker follows the web process's settings this way."""
+    with _lock:
+        return _publish(dict(raw))
+
+def snapshot():
+    s = _snap
+    return s if s is not None else reload()
+
 def init_db():
     with _lock, _conn() as c:
+        # WAL lets the telemetry writer commit while readers are mid-query
+        c.execute("PRAGMA journal_mode=WAL")
         c.execute("CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT)")
         c.execute("""CREATE TABLE IF NOT EXISTS sensor_log (
             ts INTEGER PRIMARY KEY,
@@ -77,48 +239,90 @@ def init_db():
             ts INTEGER PRIMARY KEY,
             magnitude REAL
         )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS motion_event_log (
+            id INTEGER PRIMARY KEY,
+            start REAL, end REAL, peak REAL, cells INTEGER
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS motion_event_log_start ON motion_event_log(start)")
+        c.execute("CREATE INDEX IF NOT EXISTS motion_event_log_end ON motion_event_log(end)")
+        c.execute("""CREATE TABLE IF NOT EXISTS clips (
+            id TEXT PRIMARY KEY,
+            start REAL, end REAL, reason TEXT, frames INTEGER, bytes INTEGER, path TEXT
+        )""")
+        c.execute("CREATE TABLE IF NOT EXISTS governor_log (ts REAL, tier TEXT, reason TEXT)")
+        c.execute("CREATE INDEX IF NOT EXISTS governor_log_ts ON governor_log(ts)")
+        fresh = c.execute("SELECT 1 FROM sqlite_master WHERE name='rollup'").fetchone() is None
+        c.execute("""CREATE TABLE IF NOT EXISTS rollup (
+            series TEXT, res INTEGER, bucket INTEGER,
+            n INTEGER, vmin REAL, vmax REAL, vsum REAL,
+            PRIMARY KEY(series, res, bucket)
+        ) WITHOUT ROWID""")
+        if fresh:  # backfill from whatever raw history is already there
+            for series, (table, col) in ROLLUP_SRC.items():
+                for res in ROLLUP_RES:
+                    c.execute(f"""INSERT OR IGNORE INTO rollup
+                        SELECT ?, ?, (ts/?)*?, count(*), min({col}), max({col}), sum({col})
+                        FROM {table} WHERE {col} IS NOT NULL GROUP BY ts/?""", (series, res, res, res, res))
         # seed defaults if missing
         for k,v in DEFAULTS.items():
             c.execute("INSERT OR IGNORE INTO settings(k,v) VALUES(?,?)", (k,str(v)))
         c.commit()
+    reload()
 
 def get(k, fallback=None):
-    with _lock, _conn() as c:
-        row = c.execute("SELECT v FROM settings WHERE k=?", (k,)).fetchone()
-        return row[0] if row else (DEFAULTS.get(k, fallback))
+    return snapshot().raw.get(k, fallback)
 
 def set_many(d: dict):
     with _lock, _conn() as c:
         for k,v in d.items():
             c.execute("INSERT INTO settings(k,v) VALUES(?,?) ON CONFLICT(k) DO UPDATE SET v=excluded.v", (k,str(v)))
         c.commit()
+        raw = dict(snapshot().raw)
+        raw.update({k: str(v) for k, v in d.items()})
+        _publish(raw)
 
 def get_all(prefix=None):
+    raw = snapshot().raw
+    if prefix:
+        return {k:v for k,v in raw.items() if k.startswith(prefix)}
+    return dict(raw)
+
+def get_battery_series(minutes, since=None):
+    cutoff = max(int(time.time()) - minutes*60, int(since or 0) + 1)
     with _lock, _conn() as c:
-        if prefix:
-            rows = c.execute("SELECT k,v FROM settings WHERE k LIKE ?", (prefix+'%',)).fetchall()
-        else:
-            rows = c.execute("SELECT k,v FROM settings", ()).fetchall()
-        return {k:v for k,v in rows}
+        rows = c.execute("SELECT ts,batt_pct FROM sensor_log WHERE ts>=? ORDER BY ts", (cutoff,)).fetchall()
+        return [{"t": ts, "pct": pct} for ts, pct in rows]
 
-def log_battery(ts, pct, v, i, p):
+def get_motion_series(minutes, since=None):
+    cutoff = max(int(time.time()) - minutes*60, int(since or 0) + 1)
     with _lock, _conn() as c:
-        c.execute("INSERT OR REPLACE INTO sensor_log(ts,batt_pct,voltage,current,power) VALUES (?,?,?,?,?)", (ts,pct,v,i,p))
-        c.commit()
+        rows = c.execute("SELECT ts,magnitude FROM motion_events WHERE ts>=? ORDER BY ts", (cutoff,)).fetchall()
+        return [{"t": ts, "m": m} for ts, m in rows]
 
-def get_battery_series(minutes):
-    cutoff = int(time.time()) - minutes*60
+def get_rollup(series, res, minutes, since=None):
+    # (bucket_start, avg, min, max) rows; a bucket is returned once it may have new data
+    cutoff = max(int(time.time()) - minutes*60, int(since or 0) + 1)
+    first = cutoff - cutoff % res
     with _lock, _conn() as c:
-        rows = c.execute("SELECT ts,batt_pct FROM sensor_log WHERE ts>=? ORDER BY ts", (cutoff,)).fetchall()
-        return [{"t": ts, "pct": pct} for ts, pct in rows]
+        rows = c.execute("SELECT bucket,vsum/n,vmin,vmax FROM rollup WHERE series=? AND res=? AND bucket>=? ORDER BY bucket",
+                         (series, res, first)).fetchall()
+        return rows
 
-def log_motion(ts, mag):
+def get_motion_events(t0, t1):
+    # every event overlapping [t0, t1]
     with _lock, _conn() as c:
-        c.execute("INSERT OR REPLACE INTO motion_events(ts,magnitude) VALUES (?,?)", (ts, mag))
-        c.commit()
+        rows = c.execute("SELECT start,end,peak,cells FROM motion_event_log WHERE start<=? AND end>=? ORDER BY start",
+                         (t1, t0)).fetchall()
+        return [{"start": a, "end": b, "peak": p, "cells": cl} for a, b, p, cl in rows]
 
-def get_motion_series(minutes):
-    cutoff = int(time.time()) - minutes*60
+def get_tier_log(limit=50):
     with _lock, _conn() as c:
-        rows = c.execute("SELECT ts,magnitude FROM motion_events WHERE ts>=? ORDER BY ts", (cutoff,)).fetchall()
-        return [{"t": ts, "m": m} for ts, m in rows]
+        rows = c.execute("SELECT ts,tier,reason FROM governor_log ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+        return [{"ts": ts, "tier": t, "reason": r} for ts, t, r in rows]
+
+def get_clips(limit=100):
+    with _lock, _conn() as c:
+        rows = c.execute("SELECT id,start,end,reason,frames,bytes,path FROM clips ORDER BY start DESC LIMIT ?",
+                         (limit,)).fetchall()
+        return [{"id": i, "start": a, "end": b, "reason": r, "frames": n, "bytes": sz, "path": p}
+                for i, a, b, r, n, sz, p in rows]
@@ -0,0 +1,119 @@
+"""
+Single-writer frame ring in ``multiprocessing.shared_memory``.
+
+Layout: a 64-byte ring header (magic, slot count, slot size, newest seq), then
+``slots`` slots of a 32-byte header (seq, ts, size, w, h, ch) plus payload.
+Frame ``seq`` lives in slot ``seq % slots``. The writer zeroes a slot's seq
+before overwriting it and stores the new header last, so a reader that finds
+the same seq before and after using a slot knows it read one whole frame.
+Readers get views into the segment, never copies; a slot is only reused
+``slots`` frames later.
+"""
+import struct
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+MAGIC = 0x52504652  # "RPFR"
+RING = struct.Struct("<IIIxxxxQ")   # magic, slots, slot_bytes, newest seq
+SLOT = struct.Struct("<QdIIII")     # seq, ts, size, w, h, ch
+SEQ = struct.Struct("<Q")
+HEAD = 64
+_HEAD_SEQ = 16
+
+class FrameRing:
+    def __init__(self, shm, owner):
+        self.shm, self.owner = shm, owner
+        self.buf = shm.buf
+        magic, self.slots, self.slot_bytes, _ = RING.unpack_from(self.buf, 0)
+        if magic != MAGIC: raise ValueError(f"{shm.name}: not a frame ring")
+        self.stride = (SLOT.size + self.slot_bytes + 63) & ~63
+        self.written = self.skipped = 0
+
+    @classmethod
+    def create(cls, slots, slot_bytes):
+        """New segment, owned (and unlinked on close) by the caller. Pages are
+        only backed once written, so a generous ``slot_bytes`` costs nothing."""
+        stride = (SLOT.size + slot_bytes + 63) & ~63
+        shm = shared_memory.SharedMemory(create=True, size=HEAD + slots * stride)
+        RING.pack_into(shm.buf, 0, MAGIC, slots, slot_bytes, 0)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)  # 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name)
+            # the owner unlinks it; our tracker must not when this process exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _off(self, seq):
+        return HEAD + (seq % self.slots) * self.stride
+
+    def write(self, seq, ts, data):
+        """Store frame ``seq`` (bytes-like or ndarray); False if it doesn't fit."""
+        a = data if isinstance(data, np.ndarray) else None
+        n = a.nbytes if a is not None else len(data)
+        if n > self.slot_bytes:
+            self.skipped += 1
+            return False
+        off = self._off(seq)
+        p = off + SLOT.size
+        SEQ.pack_into(self.buf, off, 0)
+        if a is not None:
+            np.copyto(np.ndarray(a.shape, a.dtype, self.buf, p), a)
+            h, w = a.shape[:2]
+            ch = a.shape[2] if a.ndim == 3 else 1
+        else:
+            self.buf[p:p + n] = data
+            w = h = ch = 0
+        SLOT.pack_into(self.buf, off, seq, ts, n, w, h, ch)
+        SEQ.pack_into(self.buf, _HEAD_SEQ, seq)
+        self.written += 1
+        return True
+
+    @property
+    def head(self):
+        return SEQ.unpack_from(self.buf, _HEAD_SEQ)[0]
+
+    def read(self, seq):
+        """(ts, payload memoryview) for frame ``seq``, or None if its slot moved on."""
+        off = self._off(seq)
+        s, ts, n, _, _, _ = SLOT.unpack_from(self.buf, off)
+        if s != seq: return None
+        p = off + SLOT.size
+        return ts, self.buf[p:p + n]
+
+    def array(self, seq):
+        """(ts, read-only uint8 image view) for a frame written from an ndarray, or None."""
+        off = self._off(seq)
+        s, ts, n, w, h, ch = SLOT.unpack_from(self.buf, off)
+        if s != seq or not n: return None
+        a = np.ndarray((h, w, ch) if ch > 1 else (h, w), np.uint8, self.buf, off + SLOT.size)
+        a.flags.writeable = False
+        return ts, a
+
+    def valid(self, seq):
+        # still the frame the caller read, i.e. it wasn't overwritten meanwhile
+        return SEQ.unpack_from(self.buf, self._off(seq))[0] == seq
+
+    def stats(self):
+        return {"name": self.name, "slots": self.slots, "slot_kb": self.slot_bytes // 1024,
+                "head": self.head, "written": self.written, "skipped": self.skipped}
+
+    def close(self):
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a reader still holds a view; the mapping goes with the process
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
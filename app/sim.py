@@ -0,0 +1,194 @@
+"""
+Simulated hardware for running and profiling off the Pi.
+
+RPICAM_SIM_VIDEO=<path>        loop a recorded video instead of the synthetic scene
+RPICAM_SIM_DISTANCE=<profile>  "metres:seconds,..." segments, interpolated and looped,
+                               e.g. "4.0:2,0.3:4,0.3:1,4.0:3" (default: slow reverse approach)
+"""
+import os, threading, time, math, cv2, numpy as np
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+class SimI2C:
+    pass
+
+class _SimRequest:
+    def __init__(self, arrays, metadata):
+        self._arrays = arrays
+        self._metadata = metadata
+
+    def make_array(self, name):
+        return self._arrays[name].copy()
+
+    @contextmanager
+    def mapped(self, name):
+        yield SimpleNamespace(array=self._arrays[name])
+
+    def get_metadata(self):
+        return dict(self._metadata)
+
+    def release(self):
+        self._arrays = None
+
+class SimPicamera2:
+    """Enough of the Picamera2 API for Camera: configure/start/capture_request.
+
+    Frames are paced to the configured FrameRate; ``SensorTimestamp`` is taken
+    from time.monotonic_ns() like the real sensor's.
+    """
+    def __init__(self):
+        self.size = (1280, 720)
+        self.lores = None
+        self.fps = 30.0
+        self._n = 0
+        self._next_t = 0.0
+        self._video = None
+        self._lock = threading.Lock()
+
+    def create_video_configuration(self, main=None, lores=None, controls=None, **_):
+        return {"main": main or {}, "lores": lores, "controls": controls or {}}
+
+    def configure(self, config):
+        self.size = tuple(config["main"].get("size", self.size))
+        self.lores = tuple(config["lores"]["size"]) if config.get("lores") else None
+        self.set_controls(config["controls"])
+
+    def set_controls(self, controls):
+        if "FrameRate" in controls:
+            self.fps = max(1.0, float(controls["FrameRate"]))
+
+    def start(self):
+        path = os.environ.get("RPICAM_SIM_VIDEO")
+        if path:
+            self._video = cv2.VideoCapture(path)
+        self._next_t = time.monotonic()
+
+    def stop(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def _scene(self):
+        w, h = self.size
+        if self._video is not None:
+            ok, img = self._video.read()
+            if not ok:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, img = self._video.read()
+            if ok:
+                return cv2.resize(img, (w, h)) if img.shape[1::-1] != (w, h) else img
+        # synthetic: static gradient "road" plus a box drifting across it
+        img = np.empty((h, w, 3), np.uint8)
+        img[:] = np.linspace(40, 140, h, dtype=np.uint8)[:, None, None]
+        x = int((math.sin(self._n / 40.0) * 0.4 + 0.5) * w)
+        cv2.rectangle(img, (x - w//20, h//2), (x + w//20, h//2 + h//6), (30, 60, 200), -1)
+        cv2.putText(img, f"SIM {self._n}", (20, h - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
+        return img
+
+    def _pace(self):
+        with self._lock:
+            now = time.monotonic()
+            self._next_t = max(self._next_t + 1.0 / self.fps, now)
+            wait = self._next_t - now
+        if wait > 0: time.sleep(wait)
+
+    def capture_request(self):
+        self._pace()
+        self._n += 1
+        main = self._scene()
+        arrays = {"main": main}
+        if self.lores:
+            lw, lh = self.lores
+            y = cv2.cvtColor(cv2.resize(main, (lw, lh), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+            arrays["lores"] = np.vstack([y, np.full((lh // 2, lw), 128, np.uint8)])  # YUV420 layout
+        return _SimRequest(arrays, {"SensorTimestamp": time.monotonic_ns(), "FrameDuration": int(1e6 / self.fps)})
+
+    def capture_array(self, name="main"):
+        req = self.capture_request()
+        try:
+            return req.make_array(name)
+        finally:
+            req.release()
+
+def parse_profile(txt):
+    segs = []
+    for part in str(txt).split(','):
+        d, _, s = part.partition(':')
+        try:
+            segs.append((float(d), max(0.01, float(s or 1))))
+        except ValueError:
+            pass
+    return segs or [(4.0, 2.0), (0.3, 6.0), (0.3, 2.0), (4.0, 2.0)]
+
+def profile_at(segs, t):
+    # linear ramp from each segment's distance to the next one's, looping
+    total = sum(s for _, s in segs)
+    t %= total
+    for i, (d, s) in enumerate(segs):
+        if t < s:
+            nxt = segs[(i + 1) % len(segs)][0]
+            return d + (nxt - d) * (t / s)
+        t -= s
+    return segs[-1][0]
+
+class SimVL53L1X:
+    """Scripted distance profile behind the adafruit_vl53l1x interface (mm, like the code expects)."""
+    def __init__(self, noise_mm=5.0):
+        self.timing_budget = 50
+        self.noise_mm = noise_mm
+        self._segs = parse_profile(os.environ.get("RPICAM_SIM_DISTANCE", ""))
+        self._t0 = time.monotonic()
+        self._last = 0.0
+
+    def start_ranging(self):
+        self._t0 = self._last = time.monotonic()
+
+    def stop_ranging(self):
+        pass
+
+    @property
+    def data_ready(self):
+        return time.monotonic() - self._last >= self.timing_budget / 1000.0
+
+    @property
+    def distance(self):
+        self._last = time.monotonic()
+        d = profile_at(self._segs, self._last - self._t0)
+        return max(0.0, d * 1000.0 + np.random.normal(0, self.noise_mm))
+
+    def clear_interrupt(self):
+        pass
+
+class SimINA219:
+    """A battery slowly discharging from 4.1 V under a ~1.2 W load."""
+    def __init__(self):
+        self._t0 = time.monotonic()
+
+    def configure(self):
+        pass
+
+    def voltage(self):
+        return 4.1 - 0.0002 * (time.monotonic() - self._t0)
+
+    def current(self):
+        return 300.0 + np.random.normal(0, 5)  # mA
+
+    def power(self):
+        return self.voltage() * self.current()  # mW
+
+class FakeNeoPixel:
+    """Records what would have been pushed to the strip."""
+    def __init__(self, n, brightness=1.0):
+        self.n = n
+        self.brightness = brightness
+        self.pixels = [(0,0,0)] * n
+        self.shows = 0
+        self.history = []  # (monotonic t, color) of the last writes
+
+    def fill(self, color):
+        self.pixels = [tuple(color)] * self.n
+
+    def show(self):
+        self.shows += 1
+        self.history.append((time.monotonic(), self.pixels[0]))
+        del self.history[:-256]
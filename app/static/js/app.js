@@ -1,19 +1,125 @@
+const stats = {};
+function render(s) {
+  const set = (id, txt) => { const el = document.getElementById(id); if (el) el.innerText = txt; };
+  set('distance', s.distance_m==null ? "--.- m" : `${s.distance_m.toFixed(1)} m`);
+  set('led', s.led_status || "--");
+  set('wifi', s.wifi_ssid ? `${s.wifi_ssid} (${s.wifi_rssi}%)` : "--");
+  set('cpu', (s.cpu_temp_c!=null) ? `${s.cpu_temp_c.toFixed(1)}°C / ${s.cpu_load?.toFixed(2)}` : "--");
+  set('batt', (s.battery_pct!=null) ? `${s.battery_pct.toFixed(0)}% (${s.voltage?.toFixed(2)}V)` : "--");
+  set('lux', (s.lux!=null) ? s.lux.toFixed(0) : "--");
+  set('tier', s.tier || "--");
+}
 async function refresh() {
   try {
     const r = await fetch('/api/stats');
-    const s = await r.json();
-    document.getElementById('distance')?.innerText = s.distance_m==null ? "--.- m" : `${s.distance_m.toFixed(1)} m`;
-    document.getElementById('led')?.innerText = s.led_status || "--";
-    document.getElementById('wifi')?.innerText = s.wifi_ssid ? `${s.wifi_ssid} (${s.wifi_rssi}%)` : "--";
-    document.getElementById('cpu')?.innerText = (s.cpu_temp_c!=null) ? `${s.cpu_temp_c.toFixed(1)}°C / ${s.cpu_load?.toFixed(2)}` : "--";
-    document.getElementById('batt')?.innerText = (s.battery_pct!=null) ? `${s.battery_pct.toFixed(0)}% (${s.voltage?.toFixed(2)}V)` : "--";
-    document.getElementById('lux')?.innerText = (s.lux!=null) ? s.lux.toFixed(0) : "--";
+    Object.assign(stats, await r.json());
+    render(stats);
   } catch (e) {}
 }
+let poller = null;
+function liveStats() {
+  // push updates over SSE; fall back to 2 s polling if the stream is unavailable
+  if (!window.EventSource) { poller = setInterval(refresh, 2000); return; }
+  const es = new EventSource('/api/stats/stream');
+  es.onmessage = ev => { Object.assign(stats, JSON.parse(ev.data)); render(stats); };
+  es.onopen = () => { if (poller) { clearInterval(poller); poller = null; } };
+  es.onerror = () => { if (!poller) poller = setInterval(refresh, 2000); };
+}
+// client-side overlay (overlay.mode = client): frames come through fetch() so each
+// part's X-Frame-Seq can be paired with the HUD state published for that frame
+const ov = {geo: null, huds: new Map(), latest: null, frameT: 0};
+function drawOverlay(c, hud) {
+  const g = ov.geo, ctx = c.getContext('2d');
+  ctx.clearRect(0, 0, c.width, c.height);
+  if (!g) return;
+  const k = c.width / g.frame[0];
+  ctx.lineCap = 'round';
+  g.guides.forEach(l => {
+    if (l.alpha <= 0) return;
+    ctx.globalAlpha = l.alpha; ctx.strokeStyle = l.color; ctx.lineWidth = l.width * k;
+    ctx.beginPath(); ctx.moveTo(l.start[0]*c.width, l.start[1]*c.height);
+    ctx.lineTo(l.end[0]*c.width, l.end[1]*c.height); ctx.stroke();
+  });
+  ctx.globalAlpha = 1;
+  if (!g.text || !hud) return;
+  ctx.font = `${Math.round(22 * g.text_scale * k)}px sans-serif`; ctx.lineJoin = 'round';
+  const x = g.text_pos[0]*c.width, y = g.text_pos[1]*c.height;
+  hud.lines.forEach((t, i) => {
+    const ty = y + i * g.line_px * k;
+    ctx.lineWidth = 3 * k; ctx.strokeStyle = '#000'; ctx.strokeText(t, x, ty);
+    ctx.fillStyle = '#fff'; ctx.fillText(t, x, ty);
+  });
+}
+function overlayFeed(c) {
+  const es = new EventSource('/api/overlay/stream');
+  es.addEventListener('geometry', ev => {
+    ov.geo = JSON.parse(ev.data);
+    if (!ov.frameT) { c.width = ov.geo.frame[0]; c.height = ov.geo.frame[1]; }
+    drawOverlay(c, ov.latest);
+  });
+  es.onmessage = ev => {
+    const h = JSON.parse(ev.data);
+    ov.latest = h; ov.huds.set(h.seq, h);
+    if (ov.huds.size > 64) ov.huds.delete(ov.huds.keys().next().value);
+    // no frame for a while (stalled or throttled stream): keep the HUD live anyway
+    if (performance.now() - ov.frameT > 250) drawOverlay(c, h);
+  };
+}
+function headerEnd(buf) {
+  for (let i = 0; i + 3 < buf.length; i++)
+    if (buf[i]===13 && buf[i+1]===10 && buf[i+2]===13 && buf[i+3]===10) return i;
+  return -1;
+}
+async function mjpegCanvas(url, video, over) {
+  const rd = (await fetch(url)).body.getReader(), dec = new TextDecoder(), ctx = video.getContext('2d');
+  let buf = new Uint8Array(0);
+  for (;;) {
+    const {value, done} = await rd.read(); if (done) return;
+    const nb = new Uint8Array(buf.length + value.length); nb.set(buf); nb.set(value, buf.length); buf = nb;
+    for (;;) {
+      const he = headerEnd(buf); if (he < 0) break;
+      const head = dec.decode(buf.subarray(0, he));
+      const end = he + 4 + +(/content-length:\s*(\d+)/i.exec(head) || [])[1];
+      if (!(buf.length >= end + 2)) break;
+      const seq = +(/x-frame-seq:\s*(\d+)/i.exec(head) || [])[1];
+      const bmp = await createImageBitmap(new Blob([buf.slice(he + 4, end)], {type: 'image/jpeg'}));
+      buf = buf.slice(end + 2);
+      if (video.width !== bmp.width || video.height !== bmp.height) {
+        video.width = over.width = bmp.width; video.height = over.height = bmp.height;
+      }
+      ctx.drawImage(bmp, 0, 0); bmp.close();
+      ov.frameT = performance.now();
+      drawOverlay(over, ov.huds.get(seq) || ov.latest);
+    }
+  }
+}
+function liveVideo() {
+  const video = document.getElementById('videoCanvas'), over = document.getElementById('overlayCanvas');
+  overlayFeed(over);
+  if (window.ReadableStream && window.createImageBitmap) {
+    const run = () => mjpegCanvas(video.dataset.src, video, over).catch(() => {}).then(() => setTimeout(run, 2000));
+    run();
+  } else {  // plain <img>: the overlay still follows the newest HUD, just not per frame
+    const img = new Image(); img.src = video.dataset.src; video.replaceWith(img);
+  }
+}
+const series = {battery: [], motion: [], windowS: 4*3600};
+function merge(old, add, windowS) {
+  // points at or after the first new t are superseded (rollup buckets can grow)
+  const t0 = add.length ? add[0].t : Infinity, cut = Date.now()/1000 - windowS;
+  return old.filter(p => p.t < t0 && p.t >= cut).concat(add);
+}
 async function loadSeries() {
-  const r = await fetch('/api/series'); const s = await r.json();
-  drawLine('battChart', s.battery.map(p=>({x:p.t*1000,y:p.pct})), 0, 100, 'Battery %');
-  drawLine('motionChart', s.motion.map(p=>({x:p.t*1000,y:p.m})), 0, undefined, 'Motion');
+  const lastOf = a => a.length ? a[a.length-1].t : 0;
+  const last = Math.min(lastOf(series.battery), lastOf(series.motion));
+  const q = last ? `since=${last}` : 'points=600';
+  const r = await fetch(`/api/series?${q}`);
+  if (!r.ok) return;
+  const s = await r.json();
+  series.battery = merge(series.battery, s.battery, series.windowS);
+  series.motion = merge(series.motion, s.motion, series.windowS);
+  drawLine('battChart', series.battery.map(p=>({x:p.t*1000,y:p.pct})), 0, 100, 'Battery %');
+  drawLine('motionChart', series.motion.map(p=>({x:p.t*1000,y:p.m})), 0, undefined, 'Motion');
 }
 function drawLine(id, pts, ymin, ymax, label) {
   const c = document.getElementById(id); if (!c) return;
@@ -41,5 +147,9 @@ async function scanWifi(){
     div.appendChild(el);
   });
 }
-setInterval(refresh, 2000);
-window.addEventListener('load', ()=>{ refresh(); loadSeries(); });
+setInterval(()=>{ if (document.getElementById('battChart')) loadSeries(); }, 60000);
+window.addEventListener('load', ()=>{
+  if (document.getElementById('distance')) { refresh(); liveStats(); }
+  if (document.getElementById('battChart')) loadSeries();
+  if (document.getElementById('videoCanvas')) liveVideo();
+});
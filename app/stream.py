@@ -0,0 +1,163 @@
+import threading, time, cv2
+from . import metrics, settings
+from .overlay import Overlay
+from .sensors import get_state
+from collections import namedtuple
+
+# size: output (w,h) or None for native; fps: cap, 0 = every frame;
+# crop: normalized (x0,y0,x1,y1) ROI taken before scaling, or None;
+# hud: burn the overlay in at encode time (dumb clients while overlay.mode = client)
+StreamProfile = namedtuple("StreamProfile", "name size quality fps crop hud", defaults=(False,))
+
+PROFILES = {
+    "full":        StreamProfile("full", None, 85, 0, None),
+    "preview":     StreamProfile("preview", (426, 240), 60, 10, None),
+    "zoom-center": StreamProfile("zoom-center", (1280, 720), 85, 0, (0.25, 0.25, 0.75, 0.75)),
+}
+
+def render(frame, profile):
+    if profile.crop:
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = profile.crop
+        frame = frame[int(y0*h):int(y1*h), int(x0*w):int(x1*w)]
+    if profile.size and (frame.shape[1], frame.shape[0]) != tuple(profile.size):
+        frame = cv2.resize(frame, tuple(profile.size), interpolation=cv2.INTER_AREA)
+    return frame
+
+def lookup(name, overlay=None):
+    """Profile for a request; ``?overlay=burned`` gets the HUD drawn in even
+    while browsers draw their own (overlay.mode = client). None if unknown."""
+    p = PROFILES.get(name)
+    if p is not None and overlay == "burned" and settings.get("overlay.mode") == "client":
+        p = p._replace(name=p.name + "+hud", hud=True)
+    return p
+
+def mjpeg_part(b, ts=None, seq=None):
+    # X-Timestamp (capture time, wall clock) lets a client measure the frame's age;
+    # X-Frame-Seq pairs the frame with its overlay state
+    extra = b"" if ts is None else b"X-Timestamp: %.6f\r\n" % ts
+    if seq is not None: extra += b"X-Frame-Seq: %d\r\n" % seq
+    return (b"--frame\r\n"
+            b"Content-Type: image/jpeg\r\n" + extra +
+            b"Content-Length: " + str(len(b)).encode() + b"\r\n\r\n" +
+            b + b"\r\n")
+
+ENCODE_SECONDS = metrics.Histogram("rpicam_jpeg_encode_seconds", "Render + cv2.imencode time per frame.", ("profile",))
+ENCODE_BYTES = metrics.Histogram("rpicam_jpeg_bytes", "Encoded JPEG size.", ("profile",), buckets=metrics.BYTE_BUCKETS)
+CLIENTS = metrics.Gauge("rpicam_stream_clients", "Connected stream subscribers.", ("profile",))
+
+class MjpegBroadcaster:
+    """Renders and encodes each new camera frame once for one ``StreamProfile``
+    and fans the bytes out to all of that profile's clients.
+
+    Clients wait on ``cond`` for a sequence number newer than the one they
+    last sent; a slow client simply picks up whatever is newest when it comes
+    back, so nothing queues up behind it.
+    """
+    volatile = False  # True when parts are views into a ring that gets reused; copy what you keep
+
+    def __init__(self, cam, profile):
+        self.cam = cam
+        self.profile = profile
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.part = None
+        self.jpeg = None  # view of the JPEG inside ``part``; shares its memory
+        self.ts = None    # wall-clock time the current frame was captured
+        self.clients = 0
+        self.viewers = 0  # clients that are people, not the recorder
+        self.listeners = []  # fn() called on the encoder thread after each new frame
+        self._thread = None
+        self._overlay = Overlay() if profile.hud else None
+        self._m_enc = ENCODE_SECONDS.labels(profile.name)
+        self._m_bytes = ENCODE_BYTES.labels(profile.name)
+        self._m_clients = CLIENTS.labels(profile.name)
+
+    def _ensure_thread(self):
+        with self.cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        p = self.profile
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), p.quality]
+        min_dt = 1.0 / p.fps if p.fps else 0.0
+        last, last_t = 0, 0.0
+        while self.cam.running:
+            with self.cond:  # park while nobody is watching
+                if not self.cond.wait_for(lambda: self.clients > 0, timeout=1.0): continue
+            seq, frame, captured = self.cam.wait_frame(last, timeout=1.0)
+            if frame is None or seq == last: continue
+            last = seq
+            now = time.monotonic()
+            if now - last_t < min_dt: continue
+            last_t = now
+            q = min(p.quality, self.cam.quality_cap)  # the governor may cap quality
+            if q != params[1]: params = [int(cv2.IMWRITE_JPEG_QUALITY), q]
+            t0 = time.perf_counter()
+            img = render(frame, p)
+            if self._overlay is not None:
+                snap = settings.snapshot()
+                if snap.raw.get("overlay.mode") == "client":  # otherwise the frame already has it
+                    if not img.flags.writeable: img = img.copy()  # published frames (and crops of them) are read-only
+                    self._overlay.draw(img, snap, get_state())
+            ok, jpg = cv2.imencode('.jpg', img, params)
+            if not ok: continue
+            self._m_enc.observe(time.perf_counter() - t0)
+            self._m_bytes.observe(len(jpg))
+            ts = time.time() - (time.monotonic() - captured)  # capture -> encode counts toward latency
+            part = mjpeg_part(jpg.tobytes(), ts, seq)
+            n = len(jpg)
+            with self.cond:
+                self.seq, self.part, self.ts = seq, part, ts
+                self.jpeg = memoryview(part)[len(part) - n - 2:len(part) - 2]
+                self.cond.notify_all()
+            for fn in self.listeners:
+                fn()
+
+    def attach(self, viewer=True):
+        # counts a subscriber; the encoder only runs while there is one
+        self._ensure_thread()
+        with self.cond:
+            self.clients += 1
+            self.viewers += viewer
+            self._m_clients.inc()
+            self.cond.notify_all()
+
+    def detach(self, viewer=True):
+        with self.cond:
+            self.clients -= 1
+            self.viewers -= viewer
+            self._m_clients.dec()
+
+    def latest(self):
+        with self.cond:
+            return self.seq, self.ts, self.part, self.jpeg
+
+    def frames(self, viewer=True):
+        """Yields (seq, ts, part, jpeg) for every frame this subscriber gets to see."""
+        self.attach(viewer)
+        try:
+            last = 0
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.seq != last, timeout=1.0): continue
+                    last = self.seq
+                    item = (self.seq, self.ts, self.part, self.jpeg)
+                yield item
+        finally:
+            self.detach(viewer)
+
+    def take(self, seq, buf):
+        """``buf`` (this frame's part or jpeg) as something safe to keep and send;
+        None if the frame was overwritten while it was being copied."""
+        return buf
+
+    def stream(self):
+        frames = self.frames()
+        try:
+            for _, _, part, _ in frames:
+                yield part
+        finally:
+            frames.close()
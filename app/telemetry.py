@@ -0,0 +1,143 @@
+import threading, queue, sqlite3, time
+from . import settings, metrics
+
+FLUSH_ROWS = 200      # flush when this many rows are pending...
+FLUSH_S = 10.0        # ...or when the oldest pending row is this old
+PRUNE_EVERY_S = 300.0
+
+WRITE_SECONDS = metrics.Histogram("rpicam_sqlite_write_seconds", "SQLite transaction time in the telemetry writer.", ("op",))
+ROWS = metrics.Counter("rpicam_sqlite_rows_total", "Telemetry rows committed.")
+_M_FLUSH, _M_PRUNE = WRITE_SECONDS.labels("flush"), WRITE_SECONDS.labels("prune")
+
+_SQL = {
+    # rolled-up series: the first row for a ts wins, so the rollup counts each row once
+    "battery": "INSERT OR IGNORE INTO sensor_log(ts,batt_pct,voltage,current,power) VALUES (?,?,?,?,?)",
+    "motion": "INSERT OR IGNORE INTO motion_events(ts,magnitude) VALUES (?,?)",
+    "motion_event": "INSERT INTO motion_event_log(start,end,peak,cells) VALUES (?,?,?,?)",
+    "clip": "INSERT OR REPLACE INTO clips(id,start,end,reason,frames,bytes,path) VALUES (?,?,?,?,?,?,?)",
+    "clip_delete": "DELETE FROM clips WHERE id=?",
+    "tier": "INSERT INTO governor_log(ts,tier,reason) VALUES (?,?,?)",
+}
+
+_ROLLUP_SQL = """INSERT INTO rollup(series,res,bucket,n,vmin,vmax,vsum) VALUES (?,?,?,1,?,?,?)
+    ON CONFLICT(series,res,bucket) DO UPDATE SET
+    n=n+1, vmin=min(vmin,excluded.vmin), vmax=max(vmax,excluded.vmax), vsum=vsum+excluded.vsum"""
+
+# which params element feeds the rollup for each kind: (series, ts index, value index)
+_ROLLUP_OF = {"battery": ("battery", 0, 1), "motion": ("motion", 0, 1)}
+
+class TelemetryWriter(threading.Thread):
+    """Single owner of the telemetry write connection.
+
+    Producers call ``submit`` which only enqueues (and drops the row if the
+    queue is full), so the camera and sensor threads never touch the disk.
+    Rows are written in one transaction per flush, and old rows are pruned
+    every few minutes according to the retention settings.
+    """
+    def __init__(self, maxsize=10000):
+        super().__init__(daemon=True, name="telemetry")
+        self.q = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.rows_written = 0
+        self.version = 0  # bumped on every flush/prune; used for series ETags
+        self._stop = threading.Event()
+
+    def submit(self, kind, params):
+        try:
+            self.q.put_nowait((kind, params))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self):
+        c = sqlite3.connect(settings.DB_PATH)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")  # WAL + NORMAL: no fsync per commit
+        return c
+
+    def _flush(self, c, rows):
+        by_kind, rollups = {}, []
+        for kind, params in rows:
+            by_kind.setdefault(kind, []).append(params)
+        t0 = time.perf_counter()
+        with c:  # one transaction for the whole batch, rollups included
+            for kind, params in by_kind.items():
+                r = _ROLLUP_OF.get(kind)
+                if r is None:
+                    c.executemany(_SQL[kind], params)
+                    continue
+                for p in params:  # row by row: only rows actually inserted feed the rollup
+                    if c.execute(_SQL[kind], p).rowcount == 1 and p[r[2]] is not None:
+                        ts, v = int(p[r[1]]), p[r[2]]
+                        rollups.extend((r[0], res, ts - ts % res, v, v, v) for res in settings.ROLLUP_RES)
+            c.executemany(_ROLLUP_SQL, rollups)
+        _M_FLUSH.observe(time.perf_counter() - t0)
+        ROWS.inc(len(rows))
+        self.rows_written += len(rows)
+        self.version += 1
+
+    def _prune(self, c):
+        snap = settings.snapshot()
+        now = time.time()
+        batt_cut = int(now - snap["metrics.battery_log_minutes"] * 60)
+        cut = now - snap["metrics.retention_hours"] * 3600
+        t0 = time.perf_counter()
+        with c:
+            c.execute("DELETE FROM sensor_log WHERE ts<?", (batt_cut,))
+            c.execute("DELETE FROM motion_events WHERE ts<?", (int(cut),))
+            c.execute("DELETE FROM motion_event_log WHERE end<?", (cut,))
+            c.execute("DELETE FROM governor_log WHERE ts<?", (cut,))
+            # rollups outlive the raw battery rows: they are the long-window history
+            c.execute("DELETE FROM rollup WHERE bucket<?", (int(min(cut, batt_cut)),))
+        _M_PRUNE.observe(time.perf_counter() - t0)
+        self.version += 1
+
+    def run(self):
+        c = self._connect()
+        pending, first_t, last_prune = [], None, 0.0
+        while not self._stop.is_set() or pending:
+            timeout = FLUSH_S if first_t is None else max(0.0, first_t + FLUSH_S - time.monotonic())
+            try:
+                pending.append(self.q.get(timeout=min(timeout, 1.0)))
+                if first_t is None: first_t = time.monotonic()
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            due = first_t is not None and now - first_t >= FLUSH_S
+            if pending and (len(pending) >= FLUSH_ROWS or due or self._stop.is_set()):
+                try:
+                    self._flush(c, pending)
+                except sqlite3.Error:
+                    pass  # drop the batch rather than wedge the writer
+                pending, first_t = [], None
+            if now - last_prune >= PRUNE_EVERY_S:
+                try:
+                    self._prune(c)
+                except sqlite3.Error:
+                    pass
+                last_prune = now
+        c.close()
+
+_writer = TelemetryWriter()
+
+def start():
+    if not _writer.is_alive():
+        _writer.start()
+    return _writer
+
+def writer():
+    return _writer
+
+def submit(kind, params):
+    _writer.submit(kind, params)
+
+def log_battery(ts, pct, v, i, p):
+    _writer.submit("battery", (ts, pct, v, i, p))
+
+def log_motion(ts, mag):
+    _writer.submit("motion", (ts, mag))
+
+def log_motion_event(ev):
+    _writer.submit("motion_event", (ev.start, ev.end, ev.peak, ev.cells))
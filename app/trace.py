@@ -0,0 +1,326 @@
+"""
+Full-rate sensor/motion trace: fixed-width records in preallocated, memory-mapped
+files that rotate by size, plus a replayer that feeds a trace back through the
+live sensor, motion and LED paths.
+
+File layout: a 4 KiB header (magic, record size, record count, wall/monotonic
+start time, channel names as JSON), then ``REC`` records of (monotonic t,
+channel, value). Appending is one ``pack_into`` into the mapping and a count
+update, so a crash loses nothing the kernel already has. The next file is
+preallocated on a helper thread while the current one fills up.
+
+  python -m app.trace info <file>...
+  python -m app.trace replay <file>... [--speed 10] [--leds]
+"""
+import json, logging, mmap, os, struct, sys, threading, time, glob
+import numpy as np
+from . import settings
+
+MAGIC = b"RPTRACE1"
+HEAD = 4096
+HDR = struct.Struct("<8sIIQdd")  # magic, version, record size, count, t0 wall, t0 monotonic
+COUNT_OFF = 16
+COUNT = struct.Struct("<Q")
+REC = struct.Struct("<dIxxxxd")  # monotonic t, channel, value (NaN = no reading)
+DTYPE = np.dtype([("t", "<f8"), ("ch", "<u4"), ("pad", "<u4"), ("v", "<f8")])
+
+CHANNELS = ("distance_raw", "distance", "voltage", "current", "power", "cpu_temp_c", "cpu_load",
+            "motion", "motion_cells", "lux")
+CH = {n: i for i, n in enumerate(CHANNELS)}
+NAN = float("nan")
+log = logging.getLogger(__name__)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def trace_dir(snap=None):
+    snap = snap or settings.snapshot()
+    return snap.raw.get("trace.dir") or os.path.join(ROOT, "traces")
+
+class _File:
+    __slots__ = ("path", "fd", "mm", "cap")
+
+    def __init__(self, path, size):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # real blocks now: a store into a hole on a full disk is SIGBUS, not an exception
+            if hasattr(os, "posix_fallocate"): os.posix_fallocate(self.fd, 0, size)
+            else: os.ftruncate(self.fd, size)  # no fallocate (not Linux): development only
+            self.mm = mmap.mmap(self.fd, size)
+        except OSError:
+            os.close(self.fd)
+            os.remove(path)
+            raise
+        self.cap = (size - HEAD) // REC.size
+        names = json.dumps(CHANNELS).encode()
+        HDR.pack_into(self.mm, 0, MAGIC, 1, REC.size, 0, time.time(), time.monotonic())
+        self.mm[HDR.size:HDR.size + len(names)] = names
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+class TraceWriter:
+    """Appends records to ``dirpath``/trace-*.rpt, ``file_mb`` per file, keeping
+    the newest ``keep`` files."""
+    def __init__(self, dirpath, file_mb=64, keep=8):
+        os.makedirs(dirpath, exist_ok=True)
+        self.dir, self.keep = dirpath, max(1, int(keep))
+        self.size = HEAD + max(1, int(file_mb * 1024 * 1024 - HEAD) // REC.size) * REC.size
+        self._lock = threading.Lock()
+        self._n_files = 0
+        self._spare = None
+        self._preparing = False
+        self.closed = False
+        self.error = None
+        self.records = self.rotations = 0
+        self.f = self._new()
+        self.n = 0
+
+    def _new(self):
+        while True:
+            self._n_files += 1
+            path = os.path.join(self.dir, time.strftime("trace-%Y%m%d-%H%M%S") + f"-{self._n_files:03d}.rpt")
+            if not os.path.exists(path): return _File(path, self.size)
+
+    def _prepare(self):
+        try:
+            spare = self._new()
+        except OSError as e:
+            log.warning("trace: preallocating the next file failed: %s", e)
+            spare = None
+        with self._lock:
+            self._preparing = False
+            if not self.closed:
+                self._spare = spare
+                return
+        if spare is not None:  # closed while it was being built
+            spare.close()
+            os.remove(spare.path)
+
+    def write(self, ch, t, v):
+        with self._lock:
+            if self.closed: return
+            i = self.n
+            if i == self.f.cap:
+                if not self._rotate(): return
+                i = 0
+            elif i == self.f.cap // 2 and self._spare is None and not self._preparing:
+                self._preparing = True
+                threading.Thread(target=self._prepare, name="trace-prealloc", daemon=True).start()
+            REC.pack_into(self.f.mm, HEAD + i * REC.size, t, ch, NAN if v is None else v)
+            self.n = i + 1
+            COUNT.pack_into(self.f.mm, COUNT_OFF, i + 1)
+            self.records += 1
+
+    def _rotate(self):
+        self.f.close()
+        spare, self._spare = self._spare, None
+        try:
+            self.f = spare or self._new()  # the helper lost the race: allocate inline
+        except OSError as e:
+            log.error("trace: no room for the next file, tracing stopped: %s", e)
+            self.closed, self.error = True, str(e)
+            return False
+        self.n = 0
+        self.rotations += 1
+        files = sorted(glob.glob(os.path.join(self.dir, "trace-*.rpt")))
+        for p in files[:-self.keep]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        return True
+
+    def close(self):
+        # a spare still being built is discarded by _prepare once it sees closed
+        with self._lock:
+            if self.closed and self.error is None: return
+            if self.error is None: self.f.close()
+            self.closed = True
+            spare, self._spare = self._spare, None
+        if spare is not None:
+            spare.close()
+            os.remove(spare.path)
+
+    def stats(self):
+        return {"file": os.path.basename(self.f.path), "records": self.records, "in_file": self.n,
+                "file_capacity": self.f.cap, "rotations": self.rotations, "error": self.error}
+
+writer = None  # TraceWriter while tracing is on; the hot paths check this
+
+def record(ch, t, v):
+    w = writer
+    if w is not None: w.write(ch, t, v)
+
+class TraceControl(threading.Thread):
+    """Opens/closes the writer as ``trace.enabled`` and friends change."""
+    def __init__(self):
+        super().__init__(daemon=True, name="trace")
+        self._wake = threading.Event()
+        self._halt = threading.Event()
+        self._key = None
+        self.error = None
+        settings.watch(self._wake)
+
+    def stop(self):
+        self._halt.set()
+        self._wake.set()
+
+    def apply(self, snap):
+        # snap None: off
+        global writer
+        key = None
+        if snap is not None and snap.flag("trace.enabled"):
+            key = (trace_dir(snap), snap["trace.file_mb"], snap["trace.keep"])
+        if key == self._key: return
+        old, writer = writer, None
+        if old is not None: old.close()
+        self._key, self.error = key, None
+        if key is None: return
+        try:
+            writer = TraceWriter(*key)
+        except OSError as e:
+            log.error("trace: cannot start tracing in %s: %s", key[0], e)
+            self.error = str(e)
+
+    def stats(self):
+        w = writer
+        out = {"enabled": w is not None and not w.closed, "dir": trace_dir(), **(w.stats() if w else {})}
+        if self.error: out["error"] = self.error
+        return out
+
+    def run(self):
+        while not self._halt.is_set():
+            self.apply(settings.snapshot())
+            self._wake.wait()
+            self._wake.clear()
+        self.apply(None)
+
+def start():
+    t = TraceControl()
+    t.apply(settings.snapshot())
+    t.start()
+    return t
+
+# --- reading / replay -------------------------------------------------------------
+
+class TraceFile:
+    """Read-only view of one trace file; ``records`` is a structured array over the mapping."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, rsize, n, self.t0_wall, self.t0_mono = HDR.unpack_from(self.mm, 0)
+        if magic != MAGIC or rsize != REC.size: raise ValueError(f"{path}: not a trace file")
+        end = self.mm.find(b"\0", HDR.size, HEAD)
+        self.channels = json.loads(self.mm[HDR.size:end if end >= 0 else HEAD])
+        self.records = np.frombuffer(self.mm, DTYPE, count=n, offset=HEAD)
+
+    def summary(self):
+        r = self.records
+        out = {"path": self.path, "records": len(r), "start": self.t0_wall}
+        if len(r):
+            out["duration_s"] = round(float(r["t"][-1] - r["t"][0]), 3)
+            out["channels"] = {self.channels[c]: int(k) for c, k in zip(*np.unique(r["ch"], return_counts=True))}
+        return out
+
+class Replayer(threading.Thread):
+    """Plays trace files back at ``speed`` x real time.
+
+    Sensor samples take the live path (``sensors.apply``: rings, ``SensorState``,
+    the stats push and the LED wake-up) stamped with the playback clock, so
+    freshness checks behave as they did when recorded. Motion scores drive
+    ``motion_ref()``'s event state machine (``MotionDetector.feed``) and keep
+    its own frame analysis out of the way. Stands in for ``SensorThread``.
+    """
+    def __init__(self, paths, speed=1.0, motion_ref=None, loop=False):
+        super().__init__(daemon=True, name="trace-replay")
+        self.files = [TraceFile(p) for p in paths]
+        self.speed = max(1e-3, float(speed))
+        self.motion_ref = motion_ref or (lambda: None)
+        self.loop = loop
+        self._halt = threading.Event()
+        self.tasks = []  # SensorThread compatibility (/api/sensors)
+        self.played = 0
+        self.late_ms = 0.0
+
+    def stop(self): self._halt.set()
+
+    def _play(self, f):
+        from . import sensors
+        r = f.records
+        if not len(r): return
+        names = [CH.get(n) for n in f.channels]
+        t_first, start = float(r["t"][0]), time.monotonic()
+        cells = 0
+        i, n = 0, len(r)
+        while i < n and not self._halt.is_set():
+            due = start + (float(r["t"][i]) - t_first) / self.speed
+            dt = due - time.monotonic()
+            if dt > 0 and self._halt.wait(dt): break
+            now = time.monotonic()
+            self.late_ms = max(self.late_ms, (now - due) * 1000.0)
+            # every record with this timestamp, then one notification
+            t, changed = r["t"][i], False
+            while i < n and r["t"][i] == t:
+                ch, v = names[r["ch"][i]], float(r["v"][i])
+                v = None if v != v else v
+                i += 1
+                self.played += 1
+                if ch == CH["motion_cells"]:
+                    cells = int(v or 0)
+                elif ch == CH["motion"]:
+                    m = self.motion_ref()
+                    if m is not None: m.feed(v or 0.0, cells, now)
+                elif ch is not None:
+                    changed |= sensors.apply(CHANNELS[ch], now, v)
+            if changed: sensors.notify()
+
+    def run(self):
+        try:
+            while not self._halt.is_set():
+                for f in self.files:
+                    if self._halt.is_set(): break
+                    self._play(f)
+                if not self.loop: break
+        finally:
+            m = self.motion_ref()
+            if m is not None: m.replay = False
+
+    def stats(self):
+        return {"files": [f.path for f in self.files], "speed": self.speed, "played": self.played,
+                "max_late_ms": round(self.late_ms, 2)}
+
+def _main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m app.trace")
+    ap.add_argument("cmd", choices=("info", "replay"))
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--speed", type=float, default=1.0)
+    ap.add_argument("--leds", action="store_true", help="drive the LED strip (or its simulation)")
+    args = ap.parse_args(argv)
+    if args.cmd == "info":
+        for p in args.files:
+            print(json.dumps(TraceFile(p).summary()))
+        return 0
+    from .motion import MotionDetector
+    md = MotionDetector()
+    md.listeners.append(lambda ev: print(json.dumps({"motion_event": ev._asdict()})))
+    leds = None
+    if args.leds:
+        from .leds import LedController
+        leds = LedController()
+        leds.start()
+    rp = Replayer(args.files, args.speed, motion_ref=lambda: md)
+    rp.start()
+    rp.join()
+    out = rp.stats()
+    if leds is not None:
+        out["leds"] = leds.stats()
+        leds.stop()
+    print(json.dumps(out))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
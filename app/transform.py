@@ -0,0 +1,126 @@
+"""
+Geometric transform stage: rotation, mirror, crop (digital zoom) and lens
+undistortion, applied to every captured frame before overlay and analysis.
+
+Every output pixel's source position is computed once per settings change and
+frame size, then stored as ``cv2.remap`` tables in OpenCV's fixed-point form
+(CV_16SC2 integer coordinates plus a 16-bit interpolation index). That takes
+6 bytes per pixel instead of 8, and is the fastest remap path. Rotations by 0
+or 180 degrees and mirroring with nothing else to do are one lossless
+``cv2.flip``. With all settings at their defaults, frames pass through untouched.
+
+Undistortion uses OpenCV's pinhole + Brown-Conrady model, as produced by
+``cv2.calibrateCamera``. ``camera.intrinsics`` holds fx,fy,cx,cy in pixels at
+``camera.calib_size``, and ``camera.distortion`` holds k1,k2,p1,p2[,k3].
+"""
+import time, cv2, numpy as np
+
+KEYS = ("camera.rotation", "camera.flip", "camera.crop", "camera.undistort", "camera.intrinsics",
+        "camera.distortion", "camera.calib_size", "camera.undistort_alpha")
+
+def _floats(v, n):
+    try:
+        t = tuple(float(x) for x in str(v).split(","))
+    except ValueError:
+        return None
+    return t if len(t) in n else None
+
+def rotation(snap):
+    r = int(snap.get("camera.rotation", 0) or 0) % 360
+    return r if r % 90 == 0 else 0
+
+def out_size(snap):
+    """(w, h) of frames leaving the transform stage."""
+    w, h = snap["camera.resolution"]
+    return (h, w) if rotation(snap) in (90, 270) else (w, h)
+
+class Transform:
+    """One frame geometry's transform; ``apply`` rebuilds the tables when the
+    settings or the input size change."""
+    def __init__(self):
+        self.kind = "identity"  # identity | flip | remap
+        self.key = None
+        self._ver = None
+        self.code = None        # cv2.flip code
+        self.map1 = self.map2 = None
+        self.out = None         # output (h, w)
+        self.build_ms = 0.0
+        self.builds = 0
+
+    def apply(self, img, snap, pool=None):
+        if snap.version != self._ver or self.key is None or img.shape[:2] != self.key[0]:
+            self._ver = snap.version
+            key = (img.shape[:2],) + tuple(snap.raw.get(k) for k in KEYS)
+            if key != self.key: self._build(key, snap, img.shape[:2])
+        if self.kind == "identity": return img
+        shape = self.out + img.shape[2:]
+        dst = pool.acquire(shape, img.dtype) if pool else None
+        if self.kind == "flip":
+            return cv2.flip(img, self.code, dst=dst)
+        return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_CONSTANT)
+
+    def _build(self, key, snap, shape):
+        t0 = time.perf_counter()
+        self.key, self.map1, self.map2 = key, None, None
+        h, w = shape
+        rot = rotation(snap)
+        flip = snap.raw.get("camera.flip", "none")
+        fx, fy = "h" in flip, "v" in flip
+        crop = _floats(snap.raw.get("camera.crop", ""), (4,))
+        if crop and not (0 <= crop[0] < crop[2] <= 1 and 0 <= crop[1] < crop[3] <= 1): crop = None
+        lens = self._lens(snap, w, h) if snap.flag("camera.undistort") else None
+        self.out = (w, h) if rot in (90, 270) else (h, w)
+        if crop is None and lens is None and rot in (0, 180):
+            fx, fy = fx != (rot == 180), fy != (rot == 180)
+            self.kind = "flip" if fx or fy else "identity"
+            self.code = -1 if fx and fy else (1 if fx else 0)
+        else:
+            self.kind = "remap"
+            self.map1, self.map2 = self._maps(w, h, rot, fx, fy, crop, lens)
+        self.build_ms = (time.perf_counter() - t0) * 1000.0
+        self.builds += 1
+
+    @staticmethod
+    def _lens(snap, w, h):
+        k = _floats(snap.raw.get("camera.intrinsics", ""), (4,))
+        d = _floats(snap.raw.get("camera.distortion", ""), (4, 5))
+        if k is None or d is None: return None
+        cw, ch = snap["camera.calib_size"]
+        sx, sy = w / cw, h / ch  # calibration was done at another resolution
+        K = np.array([[k[0] * sx, 0, k[2] * sx], [0, k[1] * sy, k[3] * sy], [0, 0, 1]])
+        D = np.array(d + (0.0,) * (5 - len(d)))
+        alpha = min(1.0, max(0.0, float(snap.get("camera.undistort_alpha", 0.0))))
+        newK, _ = cv2.getOptimalNewCameraMatrix(K, D, (w, h), alpha, (w, h))
+        return K, D, newK
+
+    @staticmethod
+    def _maps(w, h, rot, fx, fy, crop, lens):
+        # walk back from each output pixel centre: un-flip, un-rotate, un-crop, re-distort
+        ow, oh = (h, w) if rot in (90, 270) else (w, h)
+        x = ((np.arange(ow, dtype=np.float32) + 0.5) / ow)[None, :].repeat(oh, 0)
+        y = ((np.arange(oh, dtype=np.float32) + 0.5) / oh)[:, None].repeat(ow, 1)
+        if fx: x = 1 - x
+        if fy: y = 1 - y
+        if rot == 90: x, y = y, 1 - x       # clockwise
+        elif rot == 180: x, y = 1 - x, 1 - y
+        elif rot == 270: x, y = 1 - y, x
+        if crop:
+            x0, y0, x1, y1 = crop
+            x, y = x0 + x * (x1 - x0), y0 + y * (y1 - y0)
+        px, py = x * w - 0.5, y * h - 0.5
+        if lens:
+            K, D, newK = lens
+            k1, k2, p1, p2, k3 = D
+            xn, yn = (px - newK[0, 2]) / newK[0, 0], (py - newK[1, 2]) / newK[1, 1]
+            r2 = xn * xn + yn * yn
+            radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+            xd = xn * radial + 2 * p1 * xn * yn + p2 * (r2 + 2 * xn * xn)
+            yd = yn * radial + p1 * (r2 + 2 * yn * yn) + 2 * p2 * xn * yn
+            px, py = K[0, 0] * xd + K[0, 2], K[1, 1] * yd + K[1, 2]
+        return cv2.convertMaps(px.astype(np.float32), py.astype(np.float32), cv2.CV_16SC2)
+
+    def stats(self):
+        out = {"kind": self.kind, "builds": self.builds, "build_ms": round(self.build_ms, 1)}
+        if self.out: out["size"] = [self.out[1], self.out[0]]
+        if self.map1 is not None: out["table_kb"] = (self.map1.nbytes + self.map2.nbytes) // 1024
+        return out
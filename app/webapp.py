@@ -1,27 +1,103 @@
 from . import create_app
-from flask import render_template, Response, request, redirect, url_for, jsonify, flash
+from flask import render_template, Response, request, redirect, url_for, jsonify, flash, abort
 from . import settings as cfg
-from .camera import Camera
-from .sensors import SensorThread, get_state
-from .leds import LedController
-from . import settings
 from . import wifi as wifimgr
-import time, os
+from . import telemetry, series, push, metrics
+from .lifecycle import Lifecycle, UP
+import time, os, glob
 
+# cv2/numpy-heavy modules (camera, stream, sensors, leds, recorder) are only
+# imported by the subsystems that need them, so Flask can answer before they load
 app = create_app()
-cfg.init_db()
+lifecycle = Lifecycle()
 
-_cam = Camera()
-_cam.start()
+def _start_camera():
+    # RPICAM_CAPTURE=process: capture and encoding in a supervised worker process
+    if os.environ.get("RPICAM_CAPTURE", "thread") == "process":
+        from .worker import RemoteCamera as Camera
+        timeout = 45.0  # a cold worker imports numpy/cv2/picamera2 first; slow on a Zero 2 W
+    else:
+        from .camera import Camera
+        timeout = 10.0
+    cam = Camera()
+    cam.start()
+    cam.wait_frame(0, timeout=timeout)  # "ready" means a frame is available
+    if cam.frame_seq == 0:
+        cam.stop()  # or a worker supervisor keeps respawning behind a "failed" camera
+        raise RuntimeError(f"no frame within {timeout:.0f} s")
+    return cam
+
+REPLAY = [p for p in os.environ.get("RPICAM_REPLAY", "").split(",") if p]
+
+def _start_sensors():
+    if REPLAY:  # recorded trace instead of the devices
+        from .trace import Replayer
+        def motion_ref():
+            cam = lifecycle.get("camera")
+            return cam.motion if cam is not None else None
+        t = Replayer(REPLAY, float(os.environ.get("RPICAM_REPLAY_SPEED", "1")), motion_ref,
+                     loop=os.environ.get("RPICAM_REPLAY_LOOP") == "1")
+        t.start()
+        return t
+    from .sensors import SensorThread
+    def lux_ref():
+        cam = lifecycle.get("camera")
+        return cam.analysis.lux if cam is not None else None
+    t = SensorThread(lux_ref=lux_ref)
+    t.start()
+    return t
+
+def _start_leds():
+    from .leds import LedController
+    t = LedController()
+    t.start()
+    return t
+
+def _start_recorder():
+    from .recorder import ClipRecorder
+    cam = lifecycle.get("camera")
+    rec = ClipRecorder(cam)
+    cam.motion.listeners.append(rec.on_motion)
+    rec.start()
+    return rec
+
+def _start_trace():
+    from . import trace
+    t = trace.TraceControl()
+    if not REPLAY:  # it would record the replay
+        t.apply(cfg.snapshot())
+        t.start()
+    return t
+
+def _start_governor():
+    from .governor import Governor
+    g = Governor(lambda: lifecycle.get("camera"), lambda: lifecycle.get("leds"))
+    g.start()
+    return g
+
+lifecycle.add("db", cfg.init_db, required=True)
+lifecycle.add("telemetry", telemetry.start, deps=("db",))
+lifecycle.add("wifi", wifimgr.start, deps=("db",))
+lifecycle.add("camera", _start_camera, deps=("db",), required=True)
+lifecycle.add("sensors", _start_sensors, deps=("db",))
+lifecycle.add("trace", _start_trace, deps=("db",))
+lifecycle.add("leds", _start_leds, deps=("db",))
+lifecycle.add("recorder", _start_recorder, deps=("camera", "telemetry"))
+lifecycle.add("governor", _start_governor, deps=("camera", "sensors", "telemetry"))
+lifecycle.start()
+
+metrics.Gauge("rpicam_subsystem_up", "1 when the subsystem started, 0 otherwise.", ("subsystem",),
+              fn=lambda: {(n,): float(s.state in UP) for n, s in lifecycle.subs.items()})
 
-_last_frame = [None]
-def _latest_frame_ref():
-    return _cam.latest()
+def _need(name):
+    obj = lifecycle.get(name)
+    if obj is None:
+        abort(503, f"{name} {lifecycle.subs[name].state}")
+    return obj
 
-_sensors = SensorThread(cam_ref=_latest_frame_ref)
-_sensors.start()
-_leds = LedController()
-_leds.start()
+def get_state():
+    from .sensors import get_state
+    return get_state()
 
 @app.route("/")
 def dashboard():
@@ -29,36 +105,188 @@ def dashboard():
 
 @app.route("/video")
 def video():
-    return render_template("video.html")
+    return render_template("video.html", overlay_mode=cfg.get("overlay.mode", "burned"))
 
 @app.route("/stream.mjpg")
 def stream():
-    return Response(_cam.mjpeg_generator(quality=85),
-        mimetype="multipart/x-mixed-replace; boundary=frame")
+    profile = request.args.get("profile", "full")
+    from .stream import lookup
+    p = lookup(profile, request.args.get("overlay"))
+    if p is None:
+        return f"unknown profile '{profile}'", 404
+    cam = _need("camera")
+    if cfg.snapshot().flag("stream.adaptive") and request.args.get("adaptive", "1") != "0":
+        from . import adaptive
+        gen = adaptive.stream(cam, p, request.environ.get("werkzeug.socket"), request.remote_addr)
+    else:
+        gen = cam.mjpeg_generator(p)
+    return Response(gen, mimetype="multipart/x-mixed-replace; boundary=frame")
+
+@app.route("/api/stream/profiles")
+def api_stream_profiles():
+    from .stream import PROFILES
+    return jsonify({n: p._asdict() for n, p in PROFILES.items()})
+
+@app.route("/api/stream/clients")
+def api_stream_clients():
+    from .adaptive import CLIENTS
+    return jsonify({"clients": [c.stats() for c in list(CLIENTS.values())]})
 
 @app.route("/api/stats")
 def api_stats():
-    s = get_state()
-    return jsonify({
-        "distance_m": None if s.distance_m is None else round(s.distance_m, 1),
-        "led_status": s.led_status,
-        "wifi_ssid": s.wifi_ssid,
-        "wifi_rssi": s.wifi_rssi,
-        "cpu_temp_c": s.cpu_temp_c,
-        "cpu_load": s.cpu_load,
-        "battery_pct": s.batt_pct,
-        "voltage": s.voltage, "current": s.current, "power": s.power,
-        "lux": s.lux_approx
-    })
+    return jsonify(push.stats_fields(get_state()))
+
+@app.route("/api/sensors")
+def api_sensors():
+    from . import sensors
+    out = {}
+    for name in sensors.RINGS:
+        v, age = sensors.latest(name)
+        out[name] = {"value": v, "age_s": None if age is None else round(age, 3)}
+    tasks = {t.name: {"hz": round(1.0 / t.period, 2), "runs": t.runs, "errors": t.errors,
+                      "last_ms": t.last_ms}
+             for t in _need("sensors").tasks}
+    return jsonify({"latest": out, "tasks": tasks})
+
+@app.route("/api/trace")
+def api_trace():
+    from . import trace
+    files = [{"name": os.path.basename(p), "bytes": os.path.getsize(p)}
+             for p in sorted(glob.glob(os.path.join(trace.trace_dir(), "trace-*.rpt")))]
+    sens = lifecycle.get("sensors")
+    return jsonify({"writer": _need("trace").stats(), "files": files,
+                    "replay": sens.stats() if isinstance(sens, trace.Replayer) else None})
+
+@app.route("/api/leds")
+def api_leds():
+    return jsonify(_need("leds").stats())
+
+@app.route("/api/stats/stream")
+def api_stats_stream():
+    # SSE: first event is the full snapshot, then only changed fields
+    limits = push.parse_limits(cfg.get("push.min_interval_s"))
+    return Response(push.HUB.stream(limits), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/overlay")
+def api_overlay():
+    # what a client-side overlay needs right now; /api/overlay/stream follows it per frame
+    from .overlay import geometry
+    from .transform import out_size
+    cam = _need("camera")
+    snap, frame = cfg.snapshot(), cam.latest()
+    shape = frame.shape if frame is not None else out_size(snap)[::-1]
+    lines = cam.overlay.hud_lines(snap, get_state()) if snap.flag("overlay.enabled") else []
+    return jsonify({"mode": snap.raw.get("overlay.mode"), "seq": cam.frame_seq,
+                    "geometry": geometry(snap, shape), "lines": lines})
+
+@app.route("/api/overlay/stream")
+def api_overlay_stream():
+    # SSE: "geometry" events when guidelines/text placement change, then one HUD message per frame
+    return Response(_need("camera").overlay_feed.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/series")
 def api_series():
-    minutes = int(settings.get("metrics.battery_log_minutes", "240"))
+    # ?since=<epoch s> for only newer points, ?points=<n> for server-side LTTB
+    minutes = request.args.get("minutes", int(cfg.snapshot()["metrics.battery_log_minutes"]), type=int)
+    since = request.args.get("since", type=int)
+    points = request.args.get("points", type=int)
+    # data only changes when the telemetry writer flushes/prunes; the minute
+    # term lets the sliding window expire old points
+    etag = f"{telemetry.writer().version}-{int(time.time()) // 60}-{minutes}-{since}-{points}"
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304)
+    res_b, battery = series.query("battery", minutes, since, points)
+    res_m, motion = series.query("motion", minutes, since, points)
+    resp = jsonify({"battery": battery, "motion": motion, "res": {"battery": res_b, "motion": res_m}})
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@app.route("/api/governor")
+def api_governor():
+    return jsonify(_need("governor").stats())
+
+@app.route("/api/camera/stats")
+def api_camera_stats():
+    return jsonify(_need("camera").stats())
+
+@app.route("/api/motion")
+def api_motion():
+    m = _need("camera").motion
     return jsonify({
-        "battery": cfg.get_battery_series(minutes),
-        "motion": cfg.get_motion_series(minutes)
+        "score": m.score,
+        "grid": [getattr(m, "cols", 0), getattr(m, "rows", 0)],
+        "active_cells": m.active,
+        "cells": None if m.cell_frac is None else [round(float(v), 3) for v in m.cell_frac.ravel()],
     })
 
+@app.route("/api/motion/events")
+def api_motion_events():
+    now = time.time()
+    t1 = request.args.get("to", now, type=float)
+    t0 = request.args.get("from", t1 - 3600, type=float)
+    return jsonify({"from": t0, "to": t1, "events": cfg.get_motion_events(t0, t1)})
+
+def _clip(cid):
+    clip = next((c for c in cfg.get_clips(1000) if c["id"] == cid), None)
+    if clip is None or not os.path.isdir(clip["path"]):
+        return None
+    return clip
+
+@app.route("/api/clips")
+def api_clips():
+    return jsonify({"clips": cfg.get_clips(request.args.get("limit", 100, type=int)), "recorder": rec.stats() if (rec := lifecycle.get("recorder")) else None})
+
+@app.route("/api/clips/<cid>/index")
+def api_clip_index(cid):
+    from . import recorder
+    clip = _clip(cid)
+    if clip is None: return "not found", 404
+    return jsonify({"id": cid, "frames": [{"t": ts, "size": size} for ts, _, _, size in recorder.read_index(clip["path"])]})
+
+@app.route("/clips/<cid>/frame/<int:n>.jpg")
+def clip_frame(cid, n):
+    from . import recorder
+    # random access through the index: no decoding, one seek + read
+    clip = _clip(cid)
+    if clip is None: return "not found", 404
+    idx = recorder.read_index(clip["path"])
+    if not 0 <= n < len(idx): return "not found", 404
+    return Response(recorder.read_frame(clip["path"], idx[n]), mimetype="image/jpeg")
+
+@app.route("/clips/<cid>.mjpg")
+def clip_stream(cid):
+    from . import recorder
+    from .stream import mjpeg_part
+    clip = _clip(cid)
+    if clip is None: return "not found", 404
+    speed = max(0.1, request.args.get("speed", 1.0, type=float))
+    idx = recorder.read_index(clip["path"])
+    def gen():
+        prev = None
+        for e in idx:
+            if prev is not None:
+                time.sleep(max(0.0, min(1.0, (e[0] - prev) / speed)))
+            prev = e[0]
+            yield mjpeg_part(recorder.read_frame(clip["path"], e))
+    return Response(gen(), mimetype="multipart/x-mixed-replace; boundary=frame")
+
+@app.route("/healthz")
+def healthz():
+    # liveness: the web server answers, whatever the devices are doing
+    return jsonify({"status": "ok", "uptime_s": lifecycle.report()["uptime_s"]})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/readyz")
+def readyz():
+    rep = lifecycle.report()
+    return jsonify(rep), 200 if rep["ready"] else 503
+
 @app.route("/settings", methods=["GET","POST"])
 def settings_page():
     if request.method == "POST":
@@ -71,12 +299,18 @@ def settings_page():
     data = {
         "camera": cfg.get_all("camera."),
         "overlay": cfg.get_all("overlay."),
+        "analysis": cfg.get_all("analysis."),
+        "motion": cfg.get_all("motion."),
+        "stream": cfg.get_all("stream."),
+        "governor": cfg.get_all("governor."),
+        "trace": cfg.get_all("trace."),
         "guideline1": cfg.get_all("guideline1."),
         "guideline2": cfg.get_all("guideline2."),
         "distance": cfg.get_all("distance."),
         "warning": cfg.get_all("warning."),
         "led": cfg.get_all("led."),
         "battery": cfg.get_all("battery."),
+        "metrics": cfg.get_all("metrics."),
         "wifi": cfg.get_all("wifi.")
     }
     return render_template("settings.html", data=data)
@@ -109,7 +343,12 @@ def shutdown_if_low():
 
 def main():
     port = int(os.environ.get("PORT", "8000"))
-    app.run(host="0.0.0.0", port=port, threaded=True)
+    # async: streams on one event loop, other routes on a small pool; flask: thread per request
+    if os.environ.get("RPICAM_SERVER", "async") == "async":
+        from . import aserver
+        aserver.run(app, lambda: lifecycle.get("camera"), port=port)
+    else:
+        app.run(host="0.0.0.0", port=port, threaded=True)
 
 if __name__ == "__main__":
     main()
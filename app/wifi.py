@@ -1,11 +1,48 @@
-import subprocess, shlex
+import subprocess, shlex, threading, time
 from . import settings
 
+IFACE = "wlan0"
+AP_CON = "rpirc-ap"
+
 def nm(cmd):
     return subprocess.check_output(["bash","-lc", cmd], text=True, timeout=10)
 
-def scan():
-    out = nm("nmcli -t -f SSID,SIGNAL,SECURITY dev wifi")
+def _nmcli(*args, timeout=10):
+    # direct exec: no login shell to spin up for read-only queries
+    return subprocess.check_output(["nmcli", "-t", *args], text=True, timeout=timeout)
+
+def read_link(iface=IFACE):
+    """(operstate up, signal % or None) from sysfs and /proc/net/wireless; no subprocess."""
+    try:
+        with open(f"/sys/class/net/{iface}/operstate") as f:
+            up = f.read().strip() == "up"
+    except OSError:
+        up = False
+    pct = None
+    try:
+        with open("/proc/net/wireless") as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name.strip() == iface:
+                    level = float(rest.split()[2].rstrip('.'))  # dBm
+                    pct = int(max(0, min(100, 2 * (level + 100))))
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    return up, pct
+
+def _read_ssid():
+    ssid, ap = None, False
+    for line in _nmcli("-f", "ACTIVE,SSID", "dev", "wifi", timeout=5).strip().splitlines():
+        active, _, s = line.partition(':')
+        if active == "yes":
+            ssid = s
+            break
+    ap = AP_CON in _nmcli("-f", "NAME", "con", "show", "--active", timeout=5).split()
+    return ssid, ap
+
+def _scan_now():
+    out = _nmcli("-f", "SSID,SIGNAL,SECURITY", "dev", "wifi")
     nets = []
     seen = set()
     for line in out.strip().splitlines():
@@ -21,6 +58,7 @@ def save_and_connect(ssid, password=None):
         nm(f"nmcli dev wifi connect {shlex.quote(ssid)} password {shlex.quote(password)}")
     else:
         nm(f"nmcli dev wifi connect {shlex.quote(ssid)}")
+    MONITOR.refresh()
     return True
 
 def ensure_ap_exists():
@@ -39,15 +77,105 @@ def ensure_ap_exists():
 def up_ap():
     ensure_ap_exists()
     nm("nmcli con up rpirc-ap || true")
+    MONITOR.refresh()
     return True
 
 def down_ap():
     nm("nmcli con down rpirc-ap || true")
+    MONITOR.refresh()
     return True
 
+class WifiMonitor(threading.Thread):
+    """Keeps Wi-Fi status and scan results cached off the request/sensor paths.
+
+    Link state and signal come from sysfs/procfs every ``poll_s``; the SSID is
+    re-read through nmcli only when the link changes or once a minute. Scans
+    run on this thread; concurrent ``scan()`` callers share the one in flight
+    and results are reused for ``wifi.scan_ttl_s``.
+    """
+    def __init__(self, poll_s=2.0, ssid_every_s=60.0):
+        super().__init__(daemon=True, name="wifi-monitor")
+        self.poll_s = poll_s
+        self.ssid_every_s = ssid_every_s
+        self.connected = False
+        self.ssid = None
+        self.rssi = None
+        self.ap_mode = False
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._scan = None
+        self._scan_t = 0.0
+        self._scan_done = threading.Event()
+        self._scan_wanted = False
+        self._force_ssid = False
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    def refresh(self):
+        # re-read link + SSID on the next wake-up (after connect/AP changes)
+        self._force_ssid = True
+        self._wake.set()
+
+    def _refresh_link(self, force_ssid, last_ssid_t):
+        up, pct = read_link()
+        changed = up != self.connected
+        self.connected, self.rssi = up, (pct if up else None)
+        now = time.monotonic()
+        if force_ssid or changed or now - last_ssid_t >= self.ssid_every_s:
+            try:
+                self.ssid, self.ap_mode = _read_ssid() if up else (None, self.ap_mode)
+            except Exception:
+                pass
+            return now
+        return last_ssid_t
+
+    def _run_scan(self):
+        try:
+            nets = _scan_now()
+        except Exception:
+            nets = self._scan or []
+        with self._lock:
+            self._scan, self._scan_t, self._scan_wanted = nets, time.monotonic(), False
+            done, self._scan_done = self._scan_done, threading.Event()
+        done.set()
+
+    def run(self):
+        last_ssid_t = self._refresh_link(True, 0.0)
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_s)
+            self._wake.clear()
+            if self._scan_wanted:
+                self._run_scan()
+            force, self._force_ssid = self._force_ssid, False
+            last_ssid_t = self._refresh_link(force, last_ssid_t)
+
+    def scan(self, timeout=15.0):
+        ttl = settings.snapshot()["wifi.scan_ttl_s"]
+        with self._lock:
+            if self._scan is not None and time.monotonic() - self._scan_t < ttl:
+                return self._scan
+            self._scan_wanted = True
+            done = self._scan_done
+        if not self.is_alive():  # e.g. called from a one-shot script
+            self._run_scan()
+        else:
+            self._wake.set()
+            done.wait(timeout)
+        return self._scan or []
+
+MONITOR = WifiMonitor()
+
+def start():
+    if not MONITOR.is_alive():
+        MONITOR.start()
+    return MONITOR
+
+def scan():
+    return MONITOR.scan()
+
 def is_connected():
-    try:
-        out = nm("nmcli -t -f DEVICE,STATE dev | grep '^wlan0'")
-        return ":connected" in out
-    except Exception:
-        return False
+    if MONITOR.is_alive():
+        return MONITOR.connected
+    return read_link()[0]
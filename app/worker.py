@@ -0,0 +1,369 @@
+"""
+Capture/encode worker process (RPICAM_CAPTURE=process).
+
+The worker runs the camera pipeline and every wanted stream encoder, so they
+don't share a GIL with Flask, the LED loop or the sensor thread. Frames come
+back through shared-memory rings (``shmring``): one for raw published frames,
+one per stream profile for finished MJPEG parts. A socketpair carries control
+messages to the worker (settings, sensor state for the HUD, governor caps,
+which profiles to encode) and one small "frame ``seq`` is ready" note back per
+frame; the data itself is read in place.
+
+In the web process ``RemoteCamera`` stands in for ``Camera``: same attributes
+and broadcasters, plus a supervisor that restarts a worker that exits or stops
+delivering frames. Streams stall while it restarts; the UI stays up.
+
+  python -m app.worker <fd> <raw ring> <first seq>   (started by RemoteCamera)
+"""
+import atexit, os, socket, subprocess, sys, threading, time
+from multiprocessing.connection import Connection
+from . import settings, sensors, metrics, hw
+from .camera import Camera
+from .pipeline import DropQueue, stage_thread
+from .sensors import get_state
+from .shmring import FrameRing
+from .stream import MjpegBroadcaster, StreamProfile
+from .transform import out_size
+
+RAW_SLOTS = 6
+JPEG_SLOTS = 8
+STALL_S = 10.0        # no raw frame for this long: restart the worker
+BACKOFF_MAX_S = 30.0
+STATE_HZ = 20.0       # cap on sensor state forwarded for the worker's HUD
+STATS_S = 2.0         # how often the worker reports its own pipeline stats
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESTARTS = metrics.Counter("rpicam_worker_restarts_total", "Capture worker restarts.")
+TORN = metrics.Counter("rpicam_ring_torn_total", "Ring frames overwritten while a reader used them.")
+
+class RemoteBroadcaster(MjpegBroadcaster):
+    """One profile's MJPEG parts, encoded by the worker and handed out as views
+    of its ring slot. The worker only encodes the profile while this has clients."""
+    volatile = True
+
+    def __init__(self, cam, profile):
+        super().__init__(cam, profile)
+        w, h = profile.size or cam.native
+        self.ring = FrameRing.create(JPEG_SLOTS, w * h * 3 + 4096)
+        self.torn = 0
+
+    def attach(self, viewer=True):
+        with self.cond:
+            if self.clients == 0: self.cam.want(self)
+            self.clients += 1
+            self.viewers += viewer
+            self._m_clients.inc()
+            self.cond.notify_all()
+
+    def detach(self, viewer=True):
+        with self.cond:
+            super().detach(viewer)
+            if self.clients == 0: self.cam.unwant(self)
+
+    def on_frame(self, seq):
+        r = self.ring.read(seq)
+        if r is None: return
+        ts, part = r
+        body = bytes(part[:256]).find(b"\r\n\r\n") + 4
+        with self.cond:
+            self.seq, self.part, self.ts = seq, part, ts
+            self.jpeg = part[body:len(part) - 2]
+            self.cond.notify_all()
+        for fn in self.listeners:
+            fn()
+
+    def take(self, seq, buf):
+        data = bytes(buf)  # out of the slot; then make sure the slot still held this frame
+        if self.ring.valid(seq): return data
+        self.torn += 1
+        TORN.inc()
+        return None
+
+    def stream(self):
+        frames = self.frames()
+        try:
+            for seq, _, part, _ in frames:
+                data = self.take(seq, part)
+                if data is not None: yield data
+        finally:
+            frames.close()
+
+class RemoteCamera(Camera):
+    """``Camera`` for the web process while a worker captures and encodes.
+
+    Raw frames are read from the worker's ring for ``latest()``/``wait_frame``,
+    the analysis lane (motion, lux) and the client-side overlay feed; encoded
+    parts go to ``RemoteBroadcaster``s. Sequence numbers continue across
+    worker restarts.
+    """
+    Broadcaster = RemoteBroadcaster
+
+    def __init__(self):
+        self.conn = None
+        super().__init__()
+        self.native = out_size(settings.snapshot())  # frames as the worker publishes them
+        self.raw = None
+        self.proc = None
+        self.restarts = 0
+        self.last_exit = None
+        self.spawned_t = None
+        self._send_lock = threading.Lock()
+        self._last_raw_t = 0.0
+        self.worker_stats = {}
+        self.queues = {"analysis": DropQueue(2, name="analysis")}
+
+    @property
+    def quality_cap(self):
+        return self._quality_cap
+
+    @quality_cap.setter
+    def quality_cap(self, q):
+        self._quality_cap = q
+        self._send(("quality_cap", q))
+
+    def _send(self, msg):
+        conn = self.conn
+        if conn is None: return
+        with self._send_lock:
+            try:
+                conn.send(msg)
+            except (OSError, ValueError):
+                pass  # worker gone; the supervisor restarts it
+
+    def start(self):
+        if self.running: return
+        hw.check_camera()  # no camera: "absent" now, not a worker that never delivers
+        snap = settings.snapshot()
+        self.fps = snap["camera.framerate"]
+        self.analysis.configure(snap)
+        self.running = True
+        atexit.register(self.stop)
+        self._spawn()
+        threading.Thread(target=self._supervise, name="cam-supervisor", daemon=True).start()
+        threading.Thread(target=self._forward, name="cam-forward", daemon=True).start()
+        stage_thread("cam-analysis", self.queues["analysis"], self._analyze_raw, lambda: self.running)
+
+    def _raw_ring(self):
+        # the worker configures the camera from the settings as they are now, which may
+        # be a new resolution since the last spawn; its frames must fit a raw slot
+        self.native = out_size(settings.snapshot())
+        w, h = self.native
+        if self.raw is not None and self.raw.slot_bytes >= w * h * 4: return
+        old, self.raw = self.raw, FrameRing.create(RAW_SLOTS, w * h * 4)
+        with self.frame_lock:
+            self.frame = None  # a view into the old ring
+        if old is not None: old.close()
+
+    def _spawn(self):
+        self._raw_ring()
+        a, b = socket.socketpair()
+        self.proc = subprocess.Popen([sys.executable, "-m", "app.worker", str(b.fileno()), self.raw.name,
+                                      str(self.frame_seq)], cwd=ROOT, pass_fds=(b.fileno(),))
+        b.close()
+        conn = Connection(a.detach())
+        self.spawned_t = self._last_raw_t = time.monotonic()
+        with self._send_lock:
+            self.conn = conn
+        # the worker starts from scratch: settings first, then everything it should be doing
+        self._send(("settings", dict(settings.snapshot().raw)))
+        self._send(("state", vars(get_state())))
+        self._send(("fps", self.fps))
+        self._send(("quality_cap", self._quality_cap))
+        with self.frame_lock:
+            live = [b for b in self._broadcasters.values() if b.clients]
+        for b in live:
+            self.want(b)
+        threading.Thread(target=self._receive, args=(conn,), name="cam-receive", daemon=True).start()
+
+    def want(self, b):
+        self._send(("want", tuple(b.profile), b.ring.name))
+
+    def unwant(self, b):
+        self._send(("drop", b.profile.name))
+
+    def set_fps(self, fps):
+        fps = max(1.0, round(fps, 1))
+        if fps == self.fps: return
+        self.fps = fps
+        self._send(("fps", fps))
+
+    def _receive(self, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "raw":
+                self._on_raw(msg[1])
+            elif msg[0] == "jpeg":
+                b = self._broadcasters.get(msg[1])
+                if b is not None: b.on_frame(msg[2])
+            elif msg[0] == "stats":
+                self.worker_stats = msg[1]
+        conn.close()
+
+    def latest(self):
+        # the frame is a view of a raw slot the worker reuses; hand out a copy of a whole one
+        for _ in range(3):
+            with self.frame_lock:
+                seq, view, raw = self.frame_seq, self.frame, self.raw
+            if view is None: return None
+            img = view.copy()
+            if raw.valid(seq): return img
+        return None
+
+    def _on_raw(self, seq):
+        r = self.raw.array(seq)
+        if r is None: return
+        ts, view = r
+        now = time.monotonic()
+        with self.frame_cond:
+            self.frame, self.frame_seq, self.frame_t = view, seq, ts
+            self.frame_cond.notify_all()
+        self._last_raw_t = now
+        self.latency.add("capture_to_web", (now - ts) * 1000.0)
+        self.overlay_feed.publish(seq, time.time(), settings.snapshot(), get_state(), view.shape)
+        if self.analysis.due(ts):
+            self.analysis.mark(ts)
+            self.queues["analysis"].put((seq, view, ts))
+
+    def _analyze_raw(self, item):
+        seq, view, ts = item
+        gray = self.analysis.from_main(view)
+        if self.raw.valid(seq):  # otherwise it may have been half overwritten
+            self.analysis.publish(gray, ts)
+
+    def _forward(self):
+        # settings and sensor state for the worker's overlay, coalesced to STATE_HZ
+        ev = threading.Event()
+        settings.watch(ev)
+        sensors.watch(ev)
+        ver = settings.snapshot().version
+        while self.running:
+            ev.wait(1.0)
+            ev.clear()
+            snap = settings.snapshot()
+            if snap.version != ver:
+                ver = snap.version
+                self._send(("settings", dict(snap.raw)))
+            self._send(("state", vars(get_state())))
+            time.sleep(1.0 / STATE_HZ)
+
+    def _supervise(self):
+        backoff = 1.0
+        while self.running:
+            time.sleep(0.5)
+            p, now = self.proc, time.monotonic()
+            code = p.poll()
+            if code is None and now - self._last_raw_t < STALL_S:
+                if now - self.spawned_t > 60.0: backoff = 1.0  # stable again
+                continue
+            if not self.running: break
+            self.last_exit = {"t": time.time(), "reason": "stalled" if code is None else f"exit {code}"}
+            if code is None:
+                p.kill()
+                p.wait()
+            with self._send_lock:
+                conn, self.conn = self.conn, None
+            if conn is not None: conn.close()
+            self.restarts += 1
+            RESTARTS.inc()
+            time.sleep(backoff)
+            backoff = min(BACKOFF_MAX_S, backoff * 2)
+            if self.running: self._spawn()
+            if not self.running and self.proc.poll() is None:  # stop() raced the respawn
+                self.proc.kill()
+
+    def stop(self):
+        if not self.running: return
+        self.running = False
+        self._send(("stop",))
+        if self.proc is not None:
+            try:
+                self.proc.wait(3)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        with self.frame_lock:
+            rings = [b.ring for b in self._broadcasters.values()]
+        for r in rings + [self.raw]:
+            r.close()
+
+    def stats(self):
+        rings = {"raw": self.raw.stats() if self.raw else None}
+        with self.frame_lock:
+            for name, b in self._broadcasters.items():
+                rings[name] = dict(b.ring.stats(), torn=b.torn)
+        return {
+            "latency_ms": self.latency.summary(),
+            "dropped": {n: q.dropped for n, q in self.queues.items()},
+            "worker": {"pid": self.proc.pid if self.proc else None, "restarts": self.restarts,
+                       "last_exit": self.last_exit,
+                       "uptime_s": round(time.monotonic() - self.spawned_t, 1) if self.spawned_t else None},
+            "rings": rings,
+            "pipeline": self.worker_stats,  # the worker's stage latencies, transform and pool
+        }
+
+# --- worker process -------------------------------------------------------------
+
+def serve(fd, raw_name, seq0):
+    conn = Connection(fd)
+    raw = FrameRing.attach(raw_name)
+    _, raw_settings = conn.recv()  # always sent first
+    settings.mirror(raw_settings)
+    st = get_state()
+    cam = Camera(analyze=False)
+    cam.frame_seq = seq0
+    lock = threading.Lock()
+    def send(msg):
+        with lock:
+            conn.send(msg)
+
+    def on_publish(seq, frame, ts):
+        if raw.write(seq, ts, frame): send(("raw", seq))
+    cam.listeners.append(on_publish)
+
+    rings, subs = {}, {}
+    def want(fields, ring_name):
+        p = StreamProfile(*fields)
+        ring = rings.get(ring_name) or rings.setdefault(ring_name, FrameRing.attach(ring_name))
+        b = cam.broadcaster(p)
+        def push():
+            seq, ts, part, _ = b.latest()
+            if ring.write(seq, ts, part): send(("jpeg", p.name, seq))
+        old = subs.pop(p.name, None)
+        if old is not None: drop(*old)
+        b.listeners.append(push)
+        b.attach(viewer=False)
+        subs[p.name] = (b, push)
+
+    def drop(b, push):
+        b.detach(viewer=False)
+        b.listeners.remove(push)
+
+    def report():
+        while cam.running:
+            time.sleep(STATS_S)
+            try:
+                send(("stats", cam.stats()))
+            except (OSError, ValueError):
+                break
+    cam.start()
+    threading.Thread(target=report, name="worker-stats", daemon=True).start()
+    try:
+        while True:
+            msg = conn.recv()
+            kind = msg[0]
+            if kind == "settings": settings.mirror(msg[1])
+            elif kind == "state": st.__dict__.update(msg[1])
+            elif kind == "fps": cam.set_fps(msg[1])
+            elif kind == "quality_cap": cam.quality_cap = msg[1]
+            elif kind == "want": want(msg[1], msg[2])
+            elif kind == "drop" and msg[1] in subs: drop(*subs.pop(msg[1]))
+            elif kind == "stop": break
+    except (EOFError, OSError):
+        pass  # the web process went away
+    finally:
+        cam.stop()
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]), sys.argv[2], int(sys.argv[3]))
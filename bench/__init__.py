@@ -0,0 +1 @@
+# makes bench a package; run with `python -m bench`
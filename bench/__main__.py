@@ -0,0 +1,54 @@
+"""
+Performance benchmarks on simulated hardware.
+
+  python -m bench                         micro + end-to-end, JSON to stdout
+  python -m bench --suite micro --out bench.json
+  python -m bench --suite e2e --clients 1,3,5 --profile preview --duration 10
+  python -m bench --suite e2e --overlay burned,client  server CPU with the overlay burned in vs drawn by browsers
+  python -m bench --suite viewers --viewers 1,5,20    flask vs async server, in subprocesses
+  python -m bench --suite viewers --modes async --capture thread,process   capture in-process vs worker
+
+Results are JSON so runs can be diffed/tracked over time.
+"""
+import argparse, json, sys
+from .common import setup, meta
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench")
+    ap.add_argument("--suite", choices=("micro", "e2e", "viewers", "all"), default="all")
+    ap.add_argument("--clients", default="0,1,3", help="comma-separated stream client counts")
+    ap.add_argument("--viewers", default="1,5,20", help="comma-separated viewer counts (viewers suite)")
+    ap.add_argument("--modes", default="flask,async", help="RPICAM_SERVER modes to compare (viewers suite)")
+    ap.add_argument("--overlay", default="burned,client", help="overlay.mode values to compare (e2e suite)")
+    ap.add_argument("--capture", default="thread", help="RPICAM_CAPTURE modes to compare (viewers suite)")
+    ap.add_argument("--profile", default="full")
+    ap.add_argument("--duration", type=float, default=5.0)
+    ap.add_argument("--backend", default="sim", help="sim | hw | auto")
+    ap.add_argument("--out", help="write JSON here instead of stdout")
+    args = ap.parse_args(argv)
+
+    settings = setup(args.backend)
+    result = {}
+    if args.suite in ("micro", "all"):
+        from . import micro
+        result["micro"] = micro.run(settings)
+    if args.suite in ("e2e", "all"):
+        from . import e2e
+        clients = [int(c) for c in args.clients.split(',') if c.strip()]
+        result["e2e"] = e2e.run(settings, clients, args.profile, args.duration, args.overlay.split(','))
+    if args.suite == "viewers":  # not in "all": it starts its own servers
+        from . import viewers
+        counts = [int(c) for c in args.viewers.split(',') if c.strip()]
+        result["viewers"] = viewers.run(counts, args.modes.split(','), args.profile, args.duration, args.backend,
+                                       args.capture.split(','))
+    result["meta"] = meta()
+
+    txt = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(txt + "\n")
+    else:
+        print(txt)
+
+if __name__ == "__main__":
+    sys.exit(main())
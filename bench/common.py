@@ -0,0 +1,55 @@
+import os, sys, time, tempfile, platform
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+def setup(backend="sim"):
+    """Point the app at simulated hardware and a throwaway DB; call before importing app modules."""
+    os.environ.setdefault("RPICAM_BACKEND", backend)
+    from app import settings
+    settings.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="rpicam-bench-"), "settings.db")
+    settings.init_db()
+    return settings
+
+def meta():
+    from app import hw
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "backend": hw.BACKEND,
+        "devices": dict(hw.used),
+    }
+
+def alloc_bytes(fn, n=50):
+    """Mean bytes allocated (and not freed before the next call) per call, via tracemalloc."""
+    import tracemalloc
+    fn()
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(n):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return int(total / n)
+
+def timeit(fn, n=None, min_s=0.5):
+    """Call fn repeatedly; per-call wall time summary in microseconds."""
+    import numpy as np
+    fn()  # warm-up (allocations, caches)
+    samples = []
+    t_end = time.perf_counter() + min_s
+    while (n is None and time.perf_counter() < t_end) or (n is not None and len(samples) < n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    a = np.asarray(samples)
+    return {"n": len(a), "mean_us": round(float(a.mean()), 2), "p50_us": round(float(np.percentile(a, 50)), 2),
+            "p99_us": round(float(np.percentile(a, 99)), 2)}
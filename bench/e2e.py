@@ -0,0 +1,71 @@
+import threading, time, gc
+
+def _client(gen, stop, counts, idx):
+    for _ in gen:
+        counts[idx] += 1
+        if stop.is_set():
+            break
+    gen.close()
+
+def _feed(cam, stop, out):
+    # what a canvas client costs the server: one overlay SSE subscriber
+    gen = cam.overlay_feed.stream()
+    for ev in gen:
+        out[0] += 1; out[1] += len(ev)
+        if stop.is_set():
+            break
+    gen.close()
+
+def run_one(settings, clients, profile="full", duration=5.0, with_devices=True, overlay="burned"):
+    from app.camera import Camera
+    settings.set_many({"overlay.mode": overlay})
+    cam = Camera()
+    sensors = leds = None
+    if with_devices:
+        from app.sensors import SensorThread
+        from app.leds import LedController
+        sensors = SensorThread(lux_ref=lambda: cam.analysis.lux)
+        sensors.start()
+        leds = LedController()
+        leds.start()
+    cam.start()
+    time.sleep(1.0)  # let the pipeline fill
+
+    stop = threading.Event()
+    counts = [0] * clients
+    threads = [threading.Thread(target=_client, args=(cam.mjpeg_generator(profile), stop, counts, i), daemon=True)
+               for i in range(clients)]
+    feed = [0, 0]
+    if overlay == "client" and clients:
+        threads.append(threading.Thread(target=_feed, args=(cam, stop, feed), daemon=True))
+    gc0 = [s["collections"] for s in gc.get_stats()]
+    seq0, cpu0, t0 = cam.frame_seq, time.process_time(), time.monotonic()
+    for t in threads: t.start()
+    time.sleep(duration)
+    stop.set()
+    elapsed, cpu = time.monotonic() - t0, time.process_time() - cpu0
+    captured = cam.frame_seq - seq0
+    gc_runs = [s["collections"] - c for s, c in zip(gc.get_stats(), gc0)]
+    stats = cam.stats()
+    cam.stop()
+    if sensors: sensors.stop()
+    if leds: leds.stop()
+    for t in threads: t.join(timeout=2.0)
+
+    delivered = sum(counts)
+    return {
+        "clients": clients, "profile": profile, "overlay": overlay, "duration_s": round(elapsed, 2),
+        "capture_fps": round(captured / elapsed, 2),
+        "client_fps": [round(c / elapsed, 2) for c in counts],
+        "cpu_pct": round(100.0 * cpu / elapsed, 1),
+        "cpu_ms_per_frame": round(1000.0 * cpu / max(1, captured), 3),
+        "cpu_ms_per_delivered_frame": round(1000.0 * cpu / max(1, delivered), 3),
+        "latency_ms": stats["latency_ms"],
+        "dropped": stats["dropped"],
+        "frame_pool": stats["pool"],
+        "gc_collections": gc_runs,
+        "overlay_feed": {"events": feed[0], "bytes_per_s": round(feed[1] / elapsed)} if overlay == "client" else None,
+    }
+
+def run(settings, clients=(0, 1, 3), profile="full", duration=5.0, overlays=("burned", "client")):
+    return [run_one(settings, n, profile, duration, overlay=o) for n in clients for o in overlays]
@@ -0,0 +1,103 @@
+import cv2, numpy as np
+
+def run(settings):
+    from app.overlay import Overlay
+    from app.motion import MotionDetector
+    from app.analysis import AnalysisLane
+    from app.stream import PROFILES, render
+    from app.sensors import get_state
+    from app.sim import SimPicamera2
+    from app.pipeline import FramePool, readonly
+    from .common import timeit, alloc_bytes
+
+    snap = settings.snapshot()
+    w, h = snap["camera.resolution"]
+    sim = SimPicamera2()
+    sim.size = (w, h)
+    frame = sim._scene()  # synthetic scene: compresses like a real image, unlike noise
+    st = get_state()
+    st.distance_m, st.batt_pct, st.voltage, st.cpu_temp_c, st.cpu_load = 1.2, 80.0, 3.95, 48.2, 0.7
+    out = {}
+
+    out["settings_get"] = timeit(lambda: settings.get("guideline1.alpha"))
+    out["settings_snapshot_typed"] = timeit(lambda: settings.snapshot()["guideline1.alpha"])
+
+    ov = Overlay()
+    img = frame.copy()
+    out["overlay_draw"] = timeit(lambda: ov.draw(img, snap, st))
+
+    def legacy():
+        # what the per-frame full-image guideline blend used to cost
+        for i in (1, 2):
+            o = img.copy()
+            cv2.line(o, (int(0.25*w), int(0.8*h)), (int(0.25*w), int(0.95*h)), (0,255,0), 4, cv2.LINE_AA)
+            cv2.addWeighted(o, 0.6, img, 0.4, 0, img)
+    out["overlay_legacy_full_frame"] = timeit(legacy)
+
+    # transform stage: lossless flip (rotation 180 + mirror) vs one fixed-point remap
+    # (mirror + undistortion) vs the per-frame cv2.undistort it replaces
+    from app.settings import Snapshot
+    from app.transform import Transform
+    lens = {"camera.flip": "h", "camera.undistort": "1", "camera.calib_size": f"{w}x{h}",
+            "camera.intrinsics": f"{0.7*w},{0.7*w},{w/2},{h/2}", "camera.distortion": "-0.3,0.1,0,0"}
+    tpool = FramePool(4)
+    for name, kw in (("transform_flip", {"camera.rotation": "180", "camera.flip": "h"}), ("transform_remap", lens)):
+        tsnap = Snapshot(1, dict(snap.raw, **kw))
+        tf = Transform()
+        out[name] = timeit(lambda: tf.apply(frame, tsnap, tpool))
+        out[name].update(tf.stats())
+    K = np.array([[0.7*w, 0, w/2], [0, 0.7*w, h/2], [0, 0, 1]])
+    out["transform_naive_undistort"] = timeit(lambda: cv2.flip(cv2.undistort(frame, K, np.array([-0.3, 0.1, 0, 0])), 1))
+
+    lane = AnalysisLane()
+    lane.configure(snap)
+    out["analysis_downscale"] = timeit(lambda: lane.from_main(frame))
+
+    md = MotionDetector()
+    grays = [lane.from_main(np.roll(frame, k * 8, axis=1)) for k in range(8)]
+    k = [0]
+    def tick():
+        k[0] += 1
+        md.tick(grays[k[0] % len(grays)])
+    out["motion_tick"] = timeit(tick)
+
+    # frame hand-off: the old per-call copy vs a pooled buffer + read-only view
+    src = frame.copy()
+    pool = FramePool(4)
+    held = []
+    def publish_copy():
+        held[:] = [src.copy()]
+    def publish_pooled():
+        buf = pool.acquire(src.shape, src.dtype)
+        np.copyto(buf, src)  # the one copy out of the camera buffer
+        held[:] = [readonly(buf)]
+    def reader_copy():
+        return src.copy()
+    def reader_view():
+        return readonly(src)
+    for name, fn in (("frame_capture_alloc", publish_copy), ("frame_capture_pooled", publish_pooled),
+                     ("frame_reader_copy", reader_copy), ("frame_reader_view", reader_view)):
+        r = timeit(fn)
+        r["alloc_bytes"] = alloc_bytes(fn)
+        out[name] = r
+
+    # sensor hot path: a ring push with tracing off vs on (one mmap'd record)
+    import tempfile, time
+    from app import trace
+    from app.sensors import Ring
+    ring = Ring(ch=trace.CH["distance"])
+    out["sensor_push"] = timeit(lambda: ring.push(time.monotonic(), 1.23))
+    trace.writer = trace.TraceWriter(tempfile.mkdtemp(prefix="rpicam-trace-"), file_mb=16, keep=2)
+    try:
+        out["sensor_push_traced"] = timeit(lambda: ring.push(time.monotonic(), 1.23))
+        out["sensor_push_traced"]["alloc_bytes"] = alloc_bytes(lambda: ring.push(time.monotonic(), 1.23))
+    finally:
+        trace.writer.close()
+        trace.writer = None
+
+    for name, p in PROFILES.items():
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), p.quality]
+        r = timeit(lambda: cv2.imencode('.jpg', render(frame, p), params))
+        r["bytes"] = int(len(cv2.imencode('.jpg', render(frame, p), params)[1]))
+        out[f"jpeg_encode_{name}"] = r
+    return out
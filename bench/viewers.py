@@ -0,0 +1,100 @@
+"""
+Server comparison: the app in a subprocess under each RPICAM_SERVER mode,
+N raw-socket viewers on /stream.mjpg, plus one SSE subscriber.
+
+Latency is receive time minus the part's X-Timestamp (capture time, same host);
+CPU is the server process's plus its capture worker's (RPICAM_CAPTURE=process);
+thread counts are the server's, sampled over the window.
+"""
+import os, socket, subprocess, sys, tempfile, threading, time
+import numpy as np
+import psutil
+from .common import ROOT
+
+def _viewer(port, profile, stop, out):
+    lat, n = [], 0
+    try:
+        s = socket.create_connection(("127.0.0.1", port), timeout=5)
+        s.sendall(f"GET /stream.mjpg?profile={profile}&adaptive=0 HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        f = s.makefile("rb")
+        while f.readline() not in (b"\r\n", b""): pass  # response headers
+        while not stop.is_set():
+            size, ts = None, None
+            while True:
+                line = f.readline()
+                if not line: raise ConnectionError
+                if line == b"\r\n" and size is not None: break
+                k, _, v = line.decode("latin-1").partition(":")
+                if k.lower() == "content-length": size = int(v)
+                elif k.lower() == "x-timestamp": ts = float(v)
+            f.read(size + 2)
+            n += 1
+            if ts is not None: lat.append((time.time() - ts) * 1000.0)
+        s.close()
+    except (OSError, ConnectionError, ValueError):
+        pass
+    out.append((n, lat))
+
+def _wait_ready(port, timeout=30.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as s:
+                s.sendall(b"GET /readyz HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+                if b" 200 " in s.recv(64): return True
+        except OSError:
+            pass
+        time.sleep(0.3)
+    return False
+
+def _cpu(p):
+    # the server plus its capture worker, if it has one
+    procs = [p] + p.children(recursive=True)
+    return sum(t.user + t.system for t in (q.cpu_times() for q in procs))
+
+def run_one(mode, viewers, profile="full", duration=5.0, port=8765, backend="sim", capture="thread"):
+    env = dict(os.environ, RPICAM_BACKEND=backend, RPICAM_SERVER=mode, RPICAM_CAPTURE=capture, PORT=str(port),
+               RPICAM_DB=os.path.join(tempfile.mkdtemp(prefix="rpicam-bench-"), "settings.db"))
+    proc = subprocess.Popen([sys.executable, "-m", "app.webapp"], cwd=str(ROOT), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not _wait_ready(port):
+            return {"mode": mode, "capture": capture, "viewers": viewers, "error": "server not ready"}
+        p = psutil.Process(proc.pid)
+        stop, results = threading.Event(), []
+        ts = [threading.Thread(target=_viewer, args=(port, profile, stop, results), daemon=True) for _ in range(viewers)]
+        sse = socket.create_connection(("127.0.0.1", port))
+        sse.sendall(b"GET /api/stats/stream HTTP/1.1\r\nHost: x\r\n\r\n")
+        for t in ts: t.start()
+        time.sleep(1.0)  # connect + warm up
+        cpu0, t0 = _cpu(p), time.monotonic()
+        threads = []
+        while time.monotonic() - t0 < duration:
+            time.sleep(0.5)
+            threads.append(p.num_threads())
+        cpu1, el = _cpu(p), time.monotonic() - t0
+        stop.set()
+        for t in ts: t.join(timeout=3)
+        sse.close()
+        lat = np.asarray([x for _, l in results for x in l] or [np.nan])
+        cpu = cpu1 - cpu0
+        return {
+            "mode": mode, "capture": capture, "viewers": viewers, "profile": profile,
+            "server_cpu_pct": round(100.0 * cpu / el, 1),
+            "server_threads": max(threads),
+            "viewer_fps_mean": round(sum(n for n, _ in results) / max(1, len(results)) / (el + 1.0), 2),
+            "latency_ms": {"p50": round(float(np.nanpercentile(lat, 50)), 1),
+                           "p95": round(float(np.nanpercentile(lat, 95)), 1),
+                           "max": round(float(np.nanmax(lat)), 1)},
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def run(viewers=(1, 5, 20), modes=("flask", "async"), profile="full", duration=5.0, backend="sim",
+        captures=("thread",)):
+    return [run_one(m, n, profile, duration, backend=backend, capture=c)
+            for n in viewers for m in modes for c in captures]
@@ -1,3 +1,10 @@
 CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT);
 CREATE TABLE IF NOT EXISTS sensor_log (ts INTEGER PRIMARY KEY, batt_pct REAL, voltage REAL, current REAL, power REAL);
 CREATE TABLE IF NOT EXISTS motion_events (ts INTEGER PRIMARY KEY, magnitude REAL);
+CREATE TABLE IF NOT EXISTS motion_event_log (id INTEGER PRIMARY KEY, start REAL, end REAL, peak REAL, cells INTEGER);
+CREATE INDEX IF NOT EXISTS motion_event_log_start ON motion_event_log(start);
+CREATE INDEX IF NOT EXISTS motion_event_log_end ON motion_event_log(end);
+CREATE TABLE IF NOT EXISTS rollup (series TEXT, res INTEGER, bucket INTEGER, n INTEGER, vmin REAL, vmax REAL, vsum REAL, PRIMARY KEY(series, res, bucket)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS clips (id TEXT PRIMARY KEY, start REAL, end REAL, reason TEXT, frames INTEGER, bytes INTEGER, path TEXT);
+CREATE TABLE IF NOT EXISTS governor_log (ts REAL, tier TEXT, reason TEXT);
+CREATE INDEX IF NOT EXISTS governor_log_ts ON governor_log(ts);